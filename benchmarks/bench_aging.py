@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Time the statement behind nido.aging.aging_report over a community with a
+# million charges spread over a thousand residences, a quarter of them
+# unpaid and overdue. Cached reports skip this entirely.
+#
+#   PYTHONPATH=. python benchmarks/bench_aging.py [charges]
+
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from nido.aging import aging_statement
+from nido.db import make_engine
+from nido.models import Base, BillingCharge, Community, Residence
+
+
+def seed(session, charges):
+    community = Community(name="Bench", country="United States")
+    session.add(community)
+    session.flush()
+    residences = [
+        Residence(
+            community_id=community.id,
+            unit_no=str(i),
+            street="Bench Street",
+            locality="Bench",
+            postcode="00000",
+            region="Bench",
+        )
+        for i in range(1000)
+    ]
+    session.add_all(residences)
+    session.flush()
+    today = date.today()
+    for start in range(0, charges, 100000):
+        session.execute(
+            BillingCharge.__table__.insert(),
+            [
+                {
+                    "residence_id": residences[i % 1000].id,
+                    "r_community_id": community.id,
+                    "community_id": community.id,
+                    "name": f"Charge {i}",
+                    "base_amount": 1000 + i % 5000,
+                    "paid": i % 4 != 0,
+                    "charge_date": today - timedelta(days=30 + i % 400),
+                    "due_date": today - timedelta(days=i % 400 - 30),
+                }
+                for i in range(start, min(start + 100000, charges))
+            ],
+        )
+    session.commit()
+    return community.id
+
+
+if __name__ == "__main__":
+    charges = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    community_id = seed(Session(), charges)
+
+    session = Session()
+    for run in range(3):
+        start = time.perf_counter()
+        rows = session.execute(aging_statement(community_id, date.today())).all()
+        elapsed = time.perf_counter() - start
+        print(f"run {run} {elapsed * 1000:7.1f} ms, {len(rows)} owners")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Time splitting a $400,000 assessment across 10k residences by ownership
+# stake with nido.allocation: reading the stakes, apportioning the cents and
+# inserting one charge per residence in a single transaction.
+#
+#   PYTHONPATH=. python benchmarks/bench_allocation.py [residences]
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from sqlalchemy.orm import sessionmaker
+
+from nido.allocation import allocate, insert_charges
+from nido.db import make_engine
+from nido.models import Base, Community, Residence
+
+TOTAL = 40000000
+
+
+def seed(session, residences):
+    random.seed(1)
+    community = Community(name="Bench", country="United States")
+    session.add(community)
+    session.flush()
+    session.execute(
+        Residence.__table__.insert(),
+        [
+            {
+                "community_id": community.id,
+                "unit_no": f"Unit {i}",
+                "street": "1 Bench Street",
+                "locality": "Bench",
+                "postcode": "00000",
+                "region": "CA",
+                "ownership_stake": str(Decimal(random.randint(1, 99999)) / 10000),
+            }
+            for i in range(residences)
+        ],
+    )
+    session.commit()
+    return community.id
+
+
+if __name__ == "__main__":
+    residences = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    community_id = seed(Session(), residences)
+
+    session = Session()
+    start = time.perf_counter()
+    allocations = allocate(session, community_id, TOTAL)
+    allocated = time.perf_counter()
+    insert_charges(
+        session,
+        community_id,
+        allocations,
+        "Roof Replacement",
+        date.today() + timedelta(days=30),
+    )
+    session.commit()
+    inserted = time.perf_counter()
+
+    assert sum(allocation.amount for allocation in allocations) == TOTAL
+    print(f"allocate {(allocated - start) * 1000:8.1f} ms for {residences} residences")
+    print(f"insert   {(inserted - allocated) * 1000:8.1f} ms")
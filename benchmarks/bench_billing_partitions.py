@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Per-community billing query latency on Postgres, with billing_charge
+# unpartitioned and partitioned by community, as the total number of charges
+# grows. Needs a scratch database; everything in it is dropped.
+#
+#   BENCH_POSTGRES_URL=postgresql://localhost/nido_bench \
+#       PYTHONPATH=. python benchmarks/bench_billing_partitions.py
+
+import os
+import statistics
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from nido.models import Base, BillingCharge
+from nido.partitions import partition_billing_charges
+
+COMMUNITIES = 50
+RESIDENCES = 20
+QUERIES = 200
+
+
+def seed(conn, charges_per_community):
+    conn.exec_driver_sql(
+        "INSERT INTO community (id, name, country)"
+        " SELECT c, 'Community ' || c, 'US' FROM generate_series(1, %s) c",
+        (COMMUNITIES,),
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO residence (id, community_id, street, locality, postcode, region)"
+        " SELECT (c - 1) * %s + r, c, 'Street', 'Town', '00000', 'Region'"
+        " FROM generate_series(1, %s) c, generate_series(1, %s) r",
+        (RESIDENCES, COMMUNITIES, RESIDENCES),
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO billing_charge (residence_id, r_community_id, community_id,"
+        "  name, base_amount, paid, charge_date, due_date)"
+        " SELECT (c - 1) * %s + 1 + n %% %s, c, c, 'Charge', 1000, n %% 4 = 0,"
+        "  DATE '2022-01-01' + n %% 365, DATE '2022-01-15' + n %% 365"
+        " FROM generate_series(1, %s) c, generate_series(1, %s) n",
+        (RESIDENCES, RESIDENCES, COMMUNITIES, charges_per_community),
+    )
+    conn.exec_driver_sql("ANALYZE")
+
+
+def time_queries(engine):
+    timings = []
+    with Session(engine) as session:
+        for i in range(QUERIES):
+            community_id = 1 + i % COMMUNITIES
+            start = time.perf_counter()
+            session.execute(
+                select(BillingCharge.id, BillingCharge.base_amount)
+                .where(
+                    BillingCharge.community_id == community_id,
+                    BillingCharge.residence_id == (community_id - 1) * RESIDENCES + 1,
+                    BillingCharge.paid == False,
+                    BillingCharge.charge_date <= date(2022, 12, 31),
+                )
+                .order_by(BillingCharge.due_date)
+            ).all()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def run(url, charges_per_community, partitioned):
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        if partitioned:
+            partition_billing_charges(conn, "hash", 16)
+        seed(conn, charges_per_community)
+    latency = time_queries(engine)
+    engine.dispose()
+    return latency
+
+
+if __name__ == "__main__":
+    url = os.environ["BENCH_POSTGRES_URL"]
+    print(f"{'total charges':>14} {'unpartitioned':>14} {'hash x16':>10}")
+    for per_community in (1000, 10000, 40000):
+        total = per_community * COMMUNITIES
+        plain = run(url, per_community, partitioned=False)
+        hashed = run(url, per_community, partitioned=True)
+        print(f"{total:>14} {plain:>12.2f}ms {hashed:>8.2f}ms")
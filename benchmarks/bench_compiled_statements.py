@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Measure the Python time saved per request by the prebuilt statements in
+# nido.auth, nido.household and nido.billing.
+#
+# Each "request" runs the auth context lookup, the household occupancies and
+# the member billing queries against a small in-memory database, first built
+# through the Query API on every call (as the views used to do), then using
+# the module-level statements with bind parameters.
+#
+#   PYTHONPATH=. python benchmarks/bench_compiled_statements.py [requests]
+
+import sys
+import time
+from datetime import date
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import func
+
+from nido.auth import AUTH_CONTEXT_IN_COMMUNITY
+from nido.billing import CURRENT_CHARGES, RECURRING_CHARGES
+from nido.db import make_engine
+from nido.household import OCCUPANCIES
+from nido.models import (
+    Base,
+    BillingCharge,
+    Community,
+    Group,
+    RecurringCharge,
+    Residence,
+    ResidenceOccupancy,
+    Role,
+    User,
+    UserSession,
+    user_groups,
+)
+from nido.permissions import Permissions
+
+
+def seed(session):
+    community = Community(name="Bench", country="United States")
+    residence = Residence(
+        unit_no="Unit 1",
+        street="1 Bench Street",
+        locality="Benchville",
+        postcode="00000",
+        region="Benchland",
+        community=community,
+    )
+    user = User(
+        community=community,
+        personal_name="Bench",
+        family_name="User",
+        email="bench@example.com",
+    )
+    session.add_all([community, residence, user])
+    session.flush()
+    session.add(
+        ResidenceOccupancy(
+            residence_id=residence.id,
+            user_id=user.id,
+            r_community_id=community.id,
+            u_community_id=community.id,
+            relationship_name="Owner",
+            is_owner=True,
+        )
+    )
+    session.add(UserSession(user=user))
+    session.commit()
+
+
+def query_api(session, params):
+    session.query(
+        UserSession.user_id,
+        UserSession.community_id,
+        Community.name,
+        func.count(Group.id).label("group_count"),
+        *[func.max(getattr(Role, m.name)).label(m.name) for m in Permissions],
+    ).join(Community, Community.id == UserSession.community_id).outerjoin(
+        user_groups, user_groups.c.user_id == UserSession.user_id
+    ).outerjoin(
+        Group,
+        (Group.id == user_groups.c.group_id)
+        & (Group.community_id == UserSession.community_id),
+    ).outerjoin(
+        Role, Role.id == Group.role_id
+    ).filter(
+        UserSession.id == params["session_id"],
+        UserSession.community_id == params["community_id"],
+    ).group_by(
+        UserSession.user_id, UserSession.community_id, Community.name
+    ).first()
+    session.query(ResidenceOccupancy).join(Residence).filter(
+        ResidenceOccupancy.user_id == params["user_id"]
+    ).order_by(ResidenceOccupancy.is_owner.desc()).all()
+    owned = (
+        session.query(ResidenceOccupancy.residence_id)
+        .filter(
+            ResidenceOccupancy.user_id == params["user_id"],
+            ResidenceOccupancy.is_owner == True,
+        )
+        .scalar_subquery()
+    )
+    session.query(BillingCharge).filter(
+        (BillingCharge.user_id == params["user_id"])
+        | BillingCharge.residence_id.in_(owned)
+    ).filter(
+        BillingCharge.community_id == params["community_id"],
+        BillingCharge.charge_date <= params["today"],
+        BillingCharge.paid == False,
+    ).order_by(
+        BillingCharge.due_date
+    ).all()
+    session.query(RecurringCharge).filter(
+        (RecurringCharge.user_id == params["user_id"])
+        | RecurringCharge.residence_id.in_(owned)
+    ).all()
+
+
+def prebuilt(session, params):
+    session.execute(AUTH_CONTEXT_IN_COMMUNITY, params).first()
+    session.execute(OCCUPANCIES, params).scalars().all()
+    session.execute(CURRENT_CHARGES, params).scalars().all()
+    session.execute(RECURRING_CHARGES, params).scalars().all()
+
+
+def measure(run, session, params, requests):
+    for _ in range(50):
+        run(session, params)
+    start = time.process_time()
+    for _ in range(requests):
+        run(session, params)
+    return (time.process_time() - start) / requests
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    seed(session)
+    params = {
+        "session_id": 1,
+        "community_id": 1,
+        "user_id": 1,
+        "today": date.today(),
+    }
+    before = measure(query_api, session, params, requests)
+    after = measure(prebuilt, session, params, requests)
+    print(f"{'query api':12} {before * 1e6:8.0f} us/request")
+    print(f"{'prebuilt':12} {after * 1e6:8.0f} us/request")
+    print(f"{'saved':12} {(before - after) * 1e6:8.0f} us/request")
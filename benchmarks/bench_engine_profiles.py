@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Compare read/write throughput of the database engine profiles in nido.db.
+#
+# Each SQLite profile gets a fresh database file that several processes hit
+# at once, each doing a mix of reads and single-row inserts, like web workers
+# would. Set BENCH_POSTGRES_URL to also measure the postgres-pooled profile.
+#
+#   PYTHONPATH=. python benchmarks/bench_engine_profiles.py [seconds] [workers]
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from nido.db import make_engine
+from nido.models import Base, BillingCharge, Community, Residence
+
+WRITE_EVERY = 10
+
+
+def seed(url, profile):
+    engine = make_engine(url, profile)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    community = Community(name="Bench", country="United States")
+    for i in range(100):
+        residence = Residence(
+            unit_no=f"Unit {i}",
+            street="1 Bench Street",
+            locality="Benchville",
+            postcode="00000",
+            region="Benchland",
+            community=community,
+        )
+        session.add(residence)
+    session.commit()
+    engine.dispose()
+
+
+def worker(url, profile, seconds, results):
+    engine = make_engine(url, profile)
+    Session = sessionmaker(bind=engine)
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        session = Session()
+        try:
+            if ops % WRITE_EVERY == 0:
+                session.add(
+                    BillingCharge(
+                        residence_id=1 + ops % 100,
+                        r_community_id=1,
+                        name="Bench Charge",
+                        base_amount=1000,
+                        paid=False,
+                        charge_date=date.today(),
+                        due_date=date.today() + timedelta(days=14),
+                    )
+                )
+                session.commit()
+            else:
+                session.query(BillingCharge).filter_by(residence_id=1 + ops % 100).all()
+            ops += 1
+        except OperationalError:
+            session.rollback()
+            errors += 1
+        finally:
+            session.close()
+    results.put((ops, errors))
+
+
+def run(url, profile, seconds, workers):
+    seed(url, profile)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=worker, args=(url, profile, seconds, results))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    totals = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    ops = sum(t[0] for t in totals)
+    errors = sum(t[1] for t in totals)
+    print(f"{profile:24} {ops / seconds:10.0f} ops/s {errors:6} lock errors")
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("sqlite-single", "sqlite-wal-multiworker"):
+            url = f"sqlite:///{os.path.join(tmp, profile)}.db"
+            run(url, profile, seconds, workers)
+    if os.environ.get("BENCH_POSTGRES_URL"):
+        run(os.environ["BENCH_POSTGRES_URL"], "postgres-pooled", seconds, workers)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Compare a 24 month income forecast for 10k recurring charges worked out by
+# stepping each charge with RecurringCharge.find_next_date against
+# nido.forecast, with and without NumPy. The charges are a mix of monthly,
+# quarterly, yearly and weekly ones.
+#
+#   PYTHONPATH=. python benchmarks/bench_forecast.py [charges]
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from nido import forecast as forecast_module
+from nido.models import Frequency, RecurringCharge, add_months
+
+MONTHS = 24
+KINDS = (
+    (Frequency.MONTHLY, 1),
+    (Frequency.MONTHLY, 3),
+    (Frequency.YEARLY, 1),
+    (Frequency.DAILY, 7),
+)
+
+
+def rows(charges):
+    random.seed(1)
+    today = date.today()
+    for i in range(charges):
+        frequency, skip = KINDS[i % len(KINDS)]
+        yield (
+            i % 1000,
+            random.randint(1000, 50000),
+            frequency,
+            skip,
+            today + timedelta(days=random.randint(-30, 365)),
+        )
+
+
+def stepped(charge_rows, start):
+    end = add_months(start, MONTHS)
+    by_month = [0] * MONTHS
+    for _, amount, frequency, skip, next_charge in charge_rows:
+        charge = RecurringCharge(
+            frequency=frequency, frequency_skip=skip, next_charge=next_charge
+        )
+        while charge.next_charge < end:
+            if charge.next_charge >= start:
+                month = (charge.next_charge.year - start.year) * 12 + (
+                    charge.next_charge.month - start.month
+                )
+                by_month[month] += amount
+            charge.next_charge = charge.find_next_date()
+    return by_month
+
+
+def batched(add_batch, charge_rows, start):
+    result = forecast_module.Forecast(start, MONTHS)
+    for i in range(0, len(charge_rows), 500):
+        add_batch(result, charge_rows[i : i + 500])
+    return result.by_month
+
+
+if __name__ == "__main__":
+    charges = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    charge_rows = list(rows(charges))
+    start = date.today().replace(day=1)
+    runs = [
+        ("stepped", lambda: stepped(charge_rows, start)),
+        (
+            "python",
+            lambda: batched(forecast_module.add_batch_python, charge_rows, start),
+        ),
+    ]
+    if forecast_module.numpy is not None:
+        runs.append(
+            (
+                "numpy",
+                lambda: batched(forecast_module.add_batch_numpy, charge_rows, start),
+            )
+        )
+    expected = None
+    for name, run in runs:
+        begin = time.process_time()
+        by_month = run()
+        elapsed = time.process_time() - begin
+        expected = expected or by_month
+        assert by_month == expected
+        print(f"{name:8} {elapsed * 1000:8.1f} ms for {charges} charges")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Time nido.late_fees.apply_late_fees over a community with a million
+# charges, a quarter of them unpaid and overdue, and then again to show
+# that a repeat run finds nothing left to charge.
+#
+#   PYTHONPATH=. python benchmarks/bench_late_fees.py [charges]
+
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from nido.db import make_engine
+from nido.late_fees import apply_late_fees
+from nido.models import (
+    Base,
+    BillingCharge,
+    Community,
+    LateFeeMethod,
+    LateFeePolicy,
+    User,
+)
+
+
+def seed(session, charges):
+    community = Community(name="Bench", country="United States")
+    user = User(community=community, personal_name="Bench", family_name="User")
+    session.add_all([community, user])
+    session.flush()
+    session.add(
+        LateFeePolicy(
+            community_id=community.id,
+            method=LateFeeMethod.DAILY,
+            amount=25,
+            grace_days=5,
+        )
+    )
+    today = date.today()
+    for start in range(0, charges, 100000):
+        session.execute(
+            BillingCharge.__table__.insert(),
+            [
+                {
+                    "user_id": user.id,
+                    "u_community_id": community.id,
+                    "community_id": community.id,
+                    "name": f"Charge {i}",
+                    "base_amount": 1000 + i % 5000,
+                    "paid": i % 4 != 0,
+                    "charge_date": today - timedelta(days=30 + i % 400),
+                    "due_date": today - timedelta(days=i % 400),
+                }
+                for i in range(start, min(start + 100000, charges))
+            ],
+        )
+    session.commit()
+
+
+if __name__ == "__main__":
+    charges = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    seed(Session(), charges)
+
+    session = Session()
+    for run in ("first", "repeat"):
+        start = time.perf_counter()
+        counts = apply_late_fees(session, date.today())
+        session.commit()
+        elapsed = time.perf_counter() - start
+        print(f"{run:7} {elapsed:6.2f} s, {sum(counts.values())} fees")
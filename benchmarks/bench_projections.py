@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Compare loading charges as ORM instances with the read-only projections in
+# nido.projections, per row, for a listing of 10k charges.
+#
+# Both sides select the same rows and produce what the billing templates
+# read: name, dates, formatted amount and whether the charge is overdue.
+# CPU time is process time per row; memory is the tracemalloc peak while
+# the list of rows is alive.
+#
+#   PYTHONPATH=. python benchmarks/bench_projections.py [rows]
+
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+from nido.db import make_engine
+from nido.models import Base, BillingCharge, Community, User
+from nido.projections import ChargeView, charge_views
+
+
+def seed(session, rows):
+    community = Community(name="Bench", country="United States")
+    user = User(community=community, personal_name="Bench", family_name="User")
+    session.add_all([community, user])
+    session.flush()
+    today = date.today()
+    session.execute(
+        BillingCharge.__table__.insert(),
+        [
+            {
+                "user_id": user.id,
+                "u_community_id": community.id,
+                "community_id": community.id,
+                "name": f"Charge {i}",
+                "base_amount": 1000 + i,
+                "paid": False,
+                "charge_date": today - timedelta(days=i % 60),
+                "due_date": today + timedelta(days=30 - i % 60),
+            }
+            for i in range(rows)
+        ],
+    )
+    session.commit()
+
+
+def orm_rows(session, today):
+    charges = session.execute(select(BillingCharge)).scalars().all()
+    for charge in charges:
+        (charge.name, charge.formatted_amount, charge.due_date <= today)
+    return charges
+
+
+def projected_rows(session, today):
+    charges = list(charge_views(session.execute(select(*ChargeView.columns)), today))
+    for charge in charges:
+        (charge.name, charge.formatted_amount, charge.overdue)
+    return charges
+
+
+def measure(load, Session, today, rows, repeat=5):
+    cpu = []
+    for _ in range(repeat):
+        session = Session()
+        start = time.process_time()
+        load(session, today)
+        cpu.append(time.process_time() - start)
+        session.close()
+    session = Session()
+    tracemalloc.start()
+    kept = load(session, today)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del kept
+    session.close()
+    return min(cpu) / rows, peak / rows
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    seed(Session(), rows)
+    today = date.today()
+    for name, load in (("orm", orm_rows), ("projection", projected_rows)):
+        cpu, memory = measure(load, Session, today, rows)
+        print(f"{name:12} {cpu * 1e6:8.1f} us/row {memory:8.0f} bytes/row")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Time nido.reconciliation.reconcile on a statement of 50k payments against
+# 200k open charges spread over 2000 residents.
+#
+# The statement mixes payments quoting a charge reference, payments matched
+# by payer and amount, combined payments covering two charges and payments
+# from unknown payers that go to review. Loading the charges, matching and
+# marking the matches paid are reported separately.
+#
+#   PYTHONPATH=. python benchmarks/bench_reconciliation.py [payments] [charges]
+
+import io
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from nido.db import make_engine
+from nido.models import Base, BillingCharge, Community, User
+from nido.reconciliation import (
+    Reconciler,
+    apply_matches,
+    open_charges,
+    read_statement,
+)
+
+RESIDENTS = 2000
+
+
+def name(i):
+    # Payer matching ignores digits, so each resident needs a distinct word
+    letters = ""
+    while True:
+        i, letter = divmod(i, 26)
+        letters += chr(ord("a") + letter)
+        if not i:
+            return letters.title()
+
+
+def seed(session, charges):
+    community = Community(name="Bench", country="United States")
+    users = [
+        User(community=community, personal_name=name(i), family_name="Bench")
+        for i in range(RESIDENTS)
+    ]
+    session.add_all([community, *users])
+    session.flush()
+    today = date.today()
+    rows = []
+    for i in range(charges):
+        user = users[i % RESIDENTS]
+        rows.append(
+            {
+                "user_id": user.id,
+                "u_community_id": community.id,
+                "community_id": community.id,
+                "name": f"Charge {i}",
+                "base_amount": 1000 + (i * 37) % 50000,
+                "paid": False,
+                "charge_date": today - timedelta(days=60 + i % 300),
+                "due_date": today - timedelta(days=30 + i % 300),
+            }
+        )
+    session.execute(BillingCharge.__table__.insert(), rows)
+    session.commit()
+    return community.id, rows
+
+
+def statement(rows, payments):
+    random.seed(1)
+    today = date.today().isoformat()
+    lines = ["Date,Payer,Reference,Amount"]
+    picked = random.sample(range(len(rows) // 2), payments)
+    for n, i in enumerate(picked):
+        row = rows[i * 2]
+        payer = f"Bench {name(i * 2 % RESIDENTS)}"
+        amount = row["base_amount"]
+        reference = ""
+        if n % 4 == 0:
+            reference = f"NIDO-{i * 2 + 1}"
+        elif n % 4 == 2:
+            amount += rows[(i * 2 + RESIDENTS) % len(rows)]["base_amount"]
+        elif n % 4 == 3:
+            payer = "Unknown Payer"
+        lines.append(f"{today},{payer},{reference},{amount / 100:.2f}")
+    return "\n".join(lines).encode()
+
+
+if __name__ == "__main__":
+    payments = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    charges = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    engine = make_engine("sqlite://", "sqlite-single")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    community_id, rows = seed(Session(), charges)
+    data = statement(rows, payments)
+
+    session = Session()
+    start = time.perf_counter()
+    reconciler = Reconciler(open_charges(session, community_id))
+    loaded = time.perf_counter()
+    matched, review, skipped = [], [], []
+    for payment in read_statement(io.BytesIO(data), skipped):
+        match = reconciler.match(payment)
+        (matched if match.reason else review).append(match)
+    done = time.perf_counter()
+    apply_matches(
+        session, community_id, [i for match in matched for i in match.charge_ids]
+    )
+    session.commit()
+    applied = time.perf_counter()
+
+    print(f"load     {loaded - start:6.2f} s for {charges} open charges")
+    print(f"match    {done - loaded:6.2f} s for {payments} payments")
+    print(f"apply    {applied - done:6.2f} s")
+    reasons = {}
+    for match in matched:
+        reasons[match.reason] = reasons.get(match.reason, 0) + 1
+    print(f"matched  {reasons}, review {len(review)}, skipped {len(skipped)}")
@@ -17,7 +17,9 @@
 from flask import Blueprint
 from .billing import bill_bp
 from .dashboard import dash_bp, dashboard
+from .documents import docs_bp
 from .groups import posit_bp
+from .issues import issues_bp
 from .reporting import report_bp
 from .permissions import bp as perm_bp
 
@@ -28,5 +30,7 @@ admin_bp.add_url_rule("/", endpoint="root", view_func=dashboard)
 admin_bp.register_blueprint(bill_bp)
 admin_bp.register_blueprint(perm_bp)
 admin_bp.register_blueprint(dash_bp)
+admin_bp.register_blueprint(docs_bp)
 admin_bp.register_blueprint(posit_bp)
+admin_bp.register_blueprint(issues_bp)
 admin_bp.register_blueprint(report_bp)
@@ -16,6 +16,7 @@
 
 from flask import (
     Blueprint,
+    Response,
     abort,
     current_app,
     redirect,
@@ -23,9 +24,35 @@ from flask import (
     request,
     url_for,
 )
-from nido.auth import login_required, get_community_id, get_user_id, requires_permission
-from nido.models import BillingCharge, Frequency, Residence, RecurringCharge, User
+from sqlalchemy.sql import delete, func, select, update
+from nido.aging import BUCKETS as AGING_BUCKETS, aging_csv, aging_report
+from nido.allocation import allocate, charged, insert_charges
+from nido.auth import (
+    login_required,
+    get_community_id,
+    get_money_format,
+    get_user_id,
+    requires_permission,
+)
+from nido.models import (
+    BillingCharge,
+    Frequency,
+    LateFeeMethod,
+    LateFeePolicy,
+    Residence,
+    RecurringCharge,
+    User,
+)
 from nido.permissions import Permissions
+from nido.projections import (
+    ChargeView,
+    RecurringChargeView,
+    charge_views,
+    recurring_charge_views,
+)
+from nido.forecast import forecast
+from nido.reconciliation import StatementError, reconcile, resolve_payments
+from nido.streaming import STREAM_BATCH, render_listing
 
 from datetime import date, timedelta
 import decimal
@@ -33,26 +60,72 @@ import functools
 
 bill_bp = Blueprint("billing", __name__)
 
+FRAGMENT_HEADER = "Nido-Fragment"
+
 
 @bill_bp.route("/manage-billing")
 @login_required
 @requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
 def root():
     user_list = (
-        current_app.Session.query(User)
+        current_app.Session.query(User.id, User.family_name, User.personal_name)
         .filter_by(community_id=get_community_id())
         .order_by(User.family_name)
         .all()
     )
     residence_list = (
-        current_app.Session.query(Residence)
+        current_app.Session.query(Residence.id, Residence.unit_no, Residence.street)
         .filter_by(community_id=get_community_id())
         .order_by(Residence.unit_no)
         .all()
     )
+    late_fee_policy = current_app.Session.get(LateFeePolicy, get_community_id())
     return render_template(
-        "manage-billing.html", users=user_list, residences=residence_list
+        "manage-billing.html",
+        users=user_list,
+        residences=residence_list,
+        late_fee_policy=late_fee_policy,
+        late_fee_methods=LateFeeMethod,
+        currency=get_money_format().symbol,
+    )
+
+
+## The lists on the billing records page. lookup_id is "u<id>" for a user's
+## charges or "r<id>" for a residence's. Fragment responses reuse these,
+## narrowed to the rows that changed.
+def current_charge_rows(community_id, lookup_id):
+    query = current_app.Session.query(*ChargeView.columns).filter(
+        BillingCharge.community_id == community_id
     )
+    if lookup_id[0] == "u":
+        query = query.filter(BillingCharge.user_id == int(lookup_id[1:]))
+    else:
+        query = query.filter(BillingCharge.residence_id == int(lookup_id[1:]))
+    return query.order_by(BillingCharge.due_date)
+
+
+def recurring_charge_rows(community_id, lookup_id):
+    query = current_app.Session.query(*RecurringChargeView.columns)
+    if lookup_id[0] == "u":
+        return query.filter(
+            RecurringCharge.user_id == int(lookup_id[1:]),
+            RecurringCharge.u_community_id == community_id,
+        )
+    return query.filter(
+        RecurringCharge.residence_id == int(lookup_id[1:]),
+        RecurringCharge.r_community_id == community_id,
+    )
+
+
+def charges_changed():
+    # The day's cached aging report no longer matches
+    aging_report.invalidate(get_community_id(), date.today())
+
+
+## Scripted forms on the records page (see static/js/fragments.js) send this
+## header and get back only the affected rows instead of a redirect
+def wants_fragment():
+    return request.headers.get(FRAGMENT_HEADER) == "1"
 
 
 @bill_bp.route("/manage-billing/edit-billing-records")
@@ -60,29 +133,18 @@ def root():
 @requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
 def billing_records():
     today = date.today()
-    lookup_id = int(request.args["lookup_id"][1:])
-    current_charges = current_app.Session.query(BillingCharge).order_by(
-        BillingCharge.due_date
-    )
-    recurring_charges = current_app.Session.query(RecurringCharge)
-    if request.args["lookup_id"][0] == "u":
-        current_charges = current_charges.filter(BillingCharge.user_id == lookup_id)
-        recurring_charges = recurring_charges.filter(
-            RecurringCharge.user_id == lookup_id
-        )
-    else:
-        current_charges = current_charges.filter(
-            BillingCharge.residence_id == lookup_id
-        )
-        recurring_charges = recurring_charges.filter(
-            RecurringCharge.residence_id == lookup_id
-        )
-    return render_template(
+    lookup_id = request.args["lookup_id"]
+    community_id = get_community_id()
+    current_charges = current_charge_rows(community_id, lookup_id)
+    recurring_charges = recurring_charge_rows(community_id, lookup_id)
+    return render_listing(
         "edit-billing-records.html",
         today=today,
-        current_charges=current_charges.all(),
-        recurring_charges=recurring_charges.all(),
-        lookup_id=request.args["lookup_id"],
+        current_charges=charge_views(
+            current_charges.yield_per(STREAM_BATCH), today, get_money_format()
+        ),
+        recurring_charges=recurring_charge_views(recurring_charges, get_money_format()),
+        lookup_id=lookup_id,
     )
 
 
@@ -91,13 +153,15 @@ def billing_records():
 @requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
 def new_recurring_charge():
     lookup_id = int(request.form["lookup_id"][1:])
+    starting = date.fromisoformat(request.form["starting"])
     new_charge = RecurringCharge(
         name=request.form["name"],
         grace_period=timedelta(days=int(request.form["grace"])),
         base_amount=int(
             decimal.Decimal(request.form["amount"]) / decimal.Decimal(".01")
         ),
-        next_charge=date.fromisoformat(request.form["starting"]),
+        next_charge=starting,
+        anchor_day=starting.day,
         frequency=Frequency[request.form["frequency"]],
     )
     try:
@@ -111,7 +175,19 @@ def new_recurring_charge():
         new_charge.residence_id = lookup_id
         new_charge.r_community_id = get_community_id()
     current_app.Session.add(new_charge)
+    current_app.Session.flush()
+    # Read before committing, which would expire it and cost a reload
+    new_id = new_charge.id
     current_app.Session.commit()
+    if wants_fragment():
+        rows = recurring_charge_rows(get_community_id(), request.form["lookup_id"])
+        return render_template(
+            "billing-recurring-rows.html",
+            recurring_charges=recurring_charge_views(
+                rows.filter(RecurringCharge.id == new_id), get_money_format()
+            ),
+            lookup_id=request.form["lookup_id"],
+        )
     return redirect(url_for(".billing_records", lookup_id=request.form["lookup_id"]))
 
 
@@ -136,7 +212,22 @@ def new_single_charge():
         new_charge.residence_id = lookup_id
         new_charge.r_community_id = get_community_id()
     current_app.Session.add(new_charge)
+    current_app.Session.flush()
+    # Read before committing, which would expire it and cost a reload
+    new_id = new_charge.id
     current_app.Session.commit()
+    charges_changed()
+    if wants_fragment():
+        rows = current_charge_rows(get_community_id(), request.form["lookup_id"])
+        return render_template(
+            "billing-charge-rows.html",
+            current_charges=charge_views(
+                rows.filter(BillingCharge.id == new_id),
+                date.today(),
+                get_money_format(),
+            ),
+            lookup_id=request.form["lookup_id"],
+        )
     return redirect(url_for(".billing_records", lookup_id=request.form["lookup_id"]))
 
 
@@ -145,11 +236,306 @@ def new_single_charge():
 @requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
 def delete_charge():
     delete_id = int(request.form["delete_id"][1:])
+    community_id = get_community_id()
     if request.form["delete_id"][0] == "r":
-        delend = RecurringCharge
+        delend = current_app.Session.query(RecurringCharge).filter(
+            RecurringCharge.id == delete_id,
+            (RecurringCharge.u_community_id == community_id)
+            | (RecurringCharge.r_community_id == community_id),
+        )
     else:
-        delend = BillingCharge
-    current_app.Session.query(delend).filter_by(id=delete_id).delete()
+        delend = current_app.Session.query(BillingCharge).filter(
+            BillingCharge.id == delete_id,
+            BillingCharge.community_id == community_id,
+        )
+    deleted = delend.delete(synchronize_session=False)
     current_app.Session.commit()
-
+    charges_changed()
+    if wants_fragment():
+        # The script removes the row itself
+        return ("", 204) if deleted else abort(404)
     return redirect(url_for(".billing_records", lookup_id=request.form["lookup_id"]))
+
+
+## Bulk operations select charges by an id list and/or filters and change
+## them all with one UPDATE or DELETE, always within the admin's community.
+## Only unpaid charges are touched: paying, voiding or adjusting a charge
+## that's already been paid would make the records disagree with the money.
+BULK_ACTIONS = {
+    "mark_paid": "marked paid",
+    "void": "voided",
+    "adjust": "adjusted",
+}
+
+
+def parse_cents(value):
+    # Fractions of a cent are refused rather than silently dropped
+    amount = decimal.Decimal(value)
+    if not amount.is_finite() or amount != amount.quantize(decimal.Decimal("0.01")):
+        raise ValueError(f"Not an amount in cents: {value}")
+    return int(amount * 100)
+
+
+def bulk_criteria(community_id, form):
+    criteria = []
+    charge_ids = form.getlist("charge_ids", type=int)
+    if charge_ids:
+        criteria.append(BillingCharge.id.in_(charge_ids))
+    lookup_id = form.get("lookup_id")
+    if lookup_id and lookup_id[0] == "u":
+        criteria.append(BillingCharge.user_id == int(lookup_id[1:]))
+    elif lookup_id:
+        criteria.append(BillingCharge.residence_id == int(lookup_id[1:]))
+    if form.get("name"):
+        criteria.append(BillingCharge.name.contains(form["name"], autoescape=True))
+    if form.get("due_from"):
+        criteria.append(BillingCharge.due_date >= date.fromisoformat(form["due_from"]))
+    if form.get("due_to"):
+        criteria.append(BillingCharge.due_date <= date.fromisoformat(form["due_to"]))
+    # Never act on every charge in the community by leaving the form blank
+    if not criteria:
+        abort(400)
+    return [
+        BillingCharge.community_id == community_id,
+        BillingCharge.paid == False,
+        *criteria,
+    ]
+
+
+@bill_bp.post("/manage-billing/bulk")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def bulk_charges():
+    action = request.form.get("action")
+    if action not in BULK_ACTIONS:
+        abort(400)
+    dry_run = bool(request.form.get("dry_run"))
+    try:
+        criteria = bulk_criteria(get_community_id(), request.form)
+        if action == "adjust":
+            delta = parse_cents(request.form["amount"])
+            # Leave charges alone that the adjustment would take below zero
+            criteria.append(BillingCharge.base_amount + delta >= 0)
+    except (KeyError, ValueError, decimal.InvalidOperation):
+        abort(400)
+
+    (count, total) = current_app.Session.execute(
+        select(
+            func.count(BillingCharge.id),
+            func.coalesce(func.sum(BillingCharge.base_amount), 0),
+        ).where(*criteria)
+    ).one()
+    if not dry_run:
+        if action == "void":
+            statement = delete(BillingCharge)
+        elif action == "mark_paid":
+            statement = update(BillingCharge).values(paid=True)
+        else:
+            statement = update(BillingCharge).values(
+                base_amount=BillingCharge.base_amount + delta
+            )
+        result = current_app.Session.execute(
+            statement.where(*criteria).execution_options(synchronize_session=False)
+        )
+        if action == "mark_paid":
+            resolve_payments(
+                current_app.Session,
+                get_community_id(),
+                request.form.getlist("payments"),
+            )
+        current_app.Session.commit()
+        charges_changed()
+        count = result.rowcount
+    return render_template(
+        "bulk-charges.html",
+        action=BULK_ACTIONS[action],
+        dry_run=dry_run,
+        count=count,
+        total=get_money_format()(total),
+        adjustment=get_money_format()(delta) if action == "adjust" else None,
+        lookup_id=request.form.get("lookup_id"),
+    )
+
+
+## Matches an uploaded bank statement against the open charges, marks the
+## confident matches paid and lists the rest. Suggested charges for those can
+## be ticked and marked paid with the bulk form, along with the payments they
+## settle.
+@bill_bp.route("/manage-billing/reconcile", methods=["GET", "POST"])
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def reconcile_statement():
+    if request.method == "GET":
+        return render_template("reconcile.html")
+    upload = request.files.get("statement")
+    if upload is None or not upload.filename:
+        abort(400)
+    try:
+        (matched, review, skipped, repeated) = reconcile(
+            current_app.Session, get_community_id(), upload.stream
+        )
+    except (StatementError, UnicodeDecodeError):
+        abort(400)
+    current_app.Session.commit()
+    charges_changed()
+    return render_template(
+        "reconcile.html",
+        matched=matched,
+        review=review,
+        skipped=skipped,
+        repeated=repeated,
+        format_money=get_money_format(),
+    )
+
+
+## A special assessment split across residences by ownership stake. The
+## first post shows how it would be split without writing anything; posting
+## again with confirm set inserts every charge in one transaction, so either
+## all residences are charged or none are, then redirects to what was
+## charged. An assessment with the same name and due date is only charged
+## once, so a repeated submit can't charge everyone twice.
+@bill_bp.route("/manage-billing/assessment", methods=["GET", "POST"])
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def assessment():
+    if request.method == "GET":
+        return render_template("assessment.html")
+    try:
+        name = request.form["name"]
+        total = parse_cents(request.form["amount"])
+        due_date = date.fromisoformat(request.form["due"])
+        if not name or total <= 0:
+            abort(400)
+        allocations = allocate(current_app.Session, get_community_id(), total)
+    except (KeyError, ValueError, decimal.InvalidOperation):
+        abort(400)
+    (existing, _) = charged(current_app.Session, get_community_id(), name, due_date)
+    if request.form.get("confirm"):
+        if not existing:
+            insert_charges(
+                current_app.Session, get_community_id(), allocations, name, due_date
+            )
+            current_app.Session.commit()
+            charges_changed()
+        return redirect(url_for(".assessment_charged", name=name, due=due_date))
+    return render_template(
+        "assessment.html",
+        allocations=allocations,
+        existing=existing,
+        name=name,
+        amount=request.form["amount"],
+        due=due_date,
+        total=get_money_format()(total),
+        stake_total=sum(allocation.stake for allocation in allocations),
+        format_money=get_money_format(),
+    )
+
+
+@bill_bp.route("/manage-billing/assessment/charged")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def assessment_charged():
+    try:
+        name = request.args["name"]
+        due_date = date.fromisoformat(request.args["due"])
+    except (KeyError, ValueError):
+        abort(400)
+    (count, total) = charged(current_app.Session, get_community_id(), name, due_date)
+    return render_template(
+        "assessment.html",
+        charged=count,
+        name=name,
+        due=due_date,
+        total=get_money_format()(total),
+    )
+
+
+## The community's late fee policy; an empty method turns late fees off.
+## The amount is in dollars, or percent for PERCENT, both stored times 100.
+@bill_bp.post("/manage-billing/late-fees")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def late_fee_policy():
+    policy = current_app.Session.get(LateFeePolicy, get_community_id())
+    if not request.form.get("method"):
+        if policy is not None:
+            current_app.Session.delete(policy)
+    else:
+        try:
+            method = LateFeeMethod[request.form["method"]]
+            amount = parse_cents(request.form["amount"])
+            grace_days = int(request.form.get("grace_days") or 0)
+        except (KeyError, ValueError, decimal.InvalidOperation):
+            abort(400)
+        if amount <= 0 or grace_days < 0:
+            abort(400)
+        if policy is None:
+            policy = LateFeePolicy(community_id=get_community_id())
+            current_app.Session.add(policy)
+        policy.method = method
+        policy.amount = amount
+        policy.grace_days = grace_days
+    current_app.Session.commit()
+    return redirect(url_for(".root"))
+
+
+## Expected income from recurring charges over the next two years
+@bill_bp.route("/manage-billing/forecast")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def income_forecast():
+    community_id = get_community_id()
+    expected = forecast(current_app.Session, community_id)
+    residences = (
+        current_app.Session.query(Residence.id, Residence.unit_no, Residence.street)
+        .filter_by(community_id=community_id)
+        .order_by(Residence.unit_no)
+        .all()
+    )
+    return render_template(
+        "forecast.html",
+        forecast=expected,
+        frequencies=Frequency,
+        residences=[r for r in residences if expected.by_residence.get(r.id)],
+        format_money=get_money_format(),
+    )
+
+
+## Overdue balances by how long they have been owed, as a page or CSV
+@bill_bp.route("/manage-billing/aging")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def aging():
+    return render_template(
+        "aging.html",
+        report=aging_report(get_community_id(), date.today()),
+        buckets=AGING_BUCKETS,
+        format_money=get_money_format(),
+    )
+
+
+@bill_bp.route("/manage-billing/aging-summary")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def aging_summary():
+    # Just the community totals, for the dashboard to load in place
+    return render_template(
+        "aging-summary.html",
+        report=aging_report(get_community_id(), date.today()),
+        buckets=AGING_BUCKETS,
+        format_money=get_money_format(),
+    )
+
+
+@bill_bp.route("/manage-billing/aging.csv")
+@login_required
+@requires_permission(Permissions.MODIFY_BILLING_SETTINGS)
+def aging_download():
+    report = aging_report(get_community_id(), date.today())
+    return Response(
+        aging_csv(report),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename=aging-{report['as_of']}.csv"
+        },
+    )
@@ -0,0 +1,80 @@
+#  Nido admin_view/documents.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from nido.auth import login_required, get_community_id, requires_permission
+from nido.documents import document_listing, invalidate_listing, queue_preview
+from nido.file_store import store_stream
+from nido.models import Document
+from nido.permissions import Permissions
+
+docs_bp = Blueprint("documents", __name__)
+
+
+@docs_bp.route("/manage-documents")
+@login_required
+@requires_permission(Permissions.MODIFY_DOCUMENTS)
+def root():
+    return render_template(
+        "manage-documents.html", documents=document_listing(get_community_id())
+    )
+
+
+@docs_bp.post("/manage-documents/upload")
+@login_required
+@requires_permission(Permissions.MODIFY_DOCUMENTS)
+def upload():
+    community_id = get_community_id()
+    upload = request.files.get("document")
+    if upload is None or not upload.filename:
+        abort(400)
+    (digest, size) = store_stream(upload.stream)
+    new_document = Document(
+        community_id=community_id,
+        title=request.form.get("title") or upload.filename,
+        digest=digest,
+        filename=upload.filename,
+        mimetype=upload.mimetype or None,
+        size=size,
+    )
+    current_app.Session.add(new_document)
+    current_app.Session.commit()
+    invalidate_listing(community_id)
+    queue_preview(new_document)
+    return redirect(url_for(".root"))
+
+
+@docs_bp.post("/manage-documents/delete")
+@login_required
+@requires_permission(Permissions.MODIFY_DOCUMENTS)
+def delete():
+    community_id = get_community_id()
+    # Only the row is removed; the stored file may be shared with other
+    # documents or attachments that have the same contents
+    current_app.Session.query(Document).filter_by(
+        id=int(request.form["delete_id"]), community_id=community_id
+    ).delete()
+    current_app.Session.commit()
+    invalidate_listing(community_id)
+    return redirect(url_for(".root"))
@@ -23,6 +23,7 @@ from flask import (
     request,
     url_for,
 )
+from sqlalchemy.orm import joinedload
 from nido.auth import login_required, get_user_id, get_community_id, is_admin
 
 from nido.models import Group
@@ -45,7 +46,9 @@ def edit_groups():
 def edit_groups_post():
     delete_id = request.form.get("delete_id")
     if delete_id:
-        delend = current_app.Session.get(Group, int(delete_id))
+        delend = current_app.Session.get(
+            Group, int(delete_id), options=[joinedload(Group.role)]
+        )
         if delend.role.parent_id is None:
             pass
         else:
@@ -0,0 +1,126 @@
+#  Nido admin_view/issues.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from sqlalchemy.orm import joinedload, selectinload
+import sqlalchemy.sql.expression as sql_expr
+from nido.auth import login_required, get_community_id, requires_permission
+from nido.models import Issue, IssueStatus, User
+from nido.permissions import Permissions
+
+from datetime import datetime
+
+PAGE_SIZE = 25
+
+issues_bp = Blueprint("issues", __name__)
+
+## Loading profile: each row shows who reported it and links its attachments
+QUEUE_LOADING = (joinedload(Issue.submitter), selectinload(Issue.attachments))
+
+
+## Keyset cursor helpers: a page is addressed by the (created_at, id) of
+## its last row rather than by an offset, so every page is an index seek
+def encode_cursor(issue):
+    return f"{issue.created_at.isoformat()}_{issue.id}"
+
+
+def decode_cursor(cursor):
+    created_at, issue_id = cursor.rsplit("_", 1)
+    return (datetime.fromisoformat(created_at), int(issue_id))
+
+
+@issues_bp.route("/issue-queue")
+@login_required
+@requires_permission(Permissions.MODIFY_REPORTING_SETTINGS)
+def queue():
+    community_id = get_community_id()
+    try:
+        status = IssueStatus[request.args.get("status", "OPEN")]
+    except KeyError:
+        abort(400)
+
+    issues = (
+        current_app.Session.query(Issue)
+        .options(*QUEUE_LOADING)
+        .filter(Issue.community_id == community_id, Issue.status == status)
+    )
+    if request.args.get("after"):
+        try:
+            after = decode_cursor(request.args["after"])
+        except ValueError:
+            abort(400)
+        issues = issues.filter(
+            sql_expr.tuple_(Issue.created_at, Issue.id) > sql_expr.tuple_(*after)
+        )
+    issues = issues.order_by(Issue.created_at, Issue.id).limit(PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(issues) > PAGE_SIZE:
+        issues = issues[:PAGE_SIZE]
+        next_cursor = encode_cursor(issues[-1])
+
+    members = (
+        current_app.Session.query(User.id, User.personal_name, User.family_name)
+        .filter_by(community_id=community_id)
+        .order_by(User.family_name)
+        .all()
+    )
+    return render_template(
+        "issue-queue.html",
+        issues=issues,
+        members=members,
+        status=status,
+        statuses=IssueStatus,
+        next_cursor=next_cursor,
+    )
+
+
+@issues_bp.post("/issue-queue/<int:issue_id>")
+@login_required
+@requires_permission(Permissions.MODIFY_REPORTING_SETTINGS)
+def update_issue(issue_id):
+    community_id = get_community_id()
+    try:
+        changes = {Issue.status: IssueStatus[request.form["status"]]}
+        if "assignee_id" in request.form:
+            assignee_id = int(request.form["assignee_id"] or 0) or None
+            changes[Issue.assignee_id] = assignee_id
+    except (KeyError, ValueError):
+        abort(400)
+    # Issues can only be assigned to members of the same community
+    if changes.get(Issue.assignee_id) is not None and (
+        current_app.Session.query(User.id)
+        .filter_by(id=changes[Issue.assignee_id], community_id=community_id)
+        .first()
+        is None
+    ):
+        abort(400)
+    updated = (
+        current_app.Session.query(Issue)
+        .filter_by(id=issue_id, community_id=community_id)
+        .update(changes, synchronize_session=False)
+    )
+    if updated == 0:
+        abort(404)
+    current_app.Session.commit()
+    return redirect(url_for(".queue", status=request.form.get("return_status", "OPEN")))
@@ -24,7 +24,7 @@ from flask import (
     request,
     url_for,
 )
-from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from nido.auth import login_required, get_user_id, get_community_id, is_admin
 
 from nido.models import User, Group, Role, user_groups
@@ -103,7 +103,9 @@ def create_new_role():
 def edit_single_role(role_id):
     if not check_edit_role_allowed(role_id):
         return abort(403)
-    modificand = current_app.Session.get(Role, role_id)
+    modificand = current_app.Session.get(
+        Role, role_id, options=[joinedload(Role.parent)]
+    )
     return render_template(
         "edit-single-perm-role.html", role=modificand, perms=Permissions
     )
@@ -114,7 +116,9 @@ def edit_single_role(role_id):
 def update_single_role(role_id):
     if not check_edit_role_allowed(role_id):
         return abort(403)
-    modificand = current_app.Session.get(Role, role_id)
+    modificand = current_app.Session.get(
+        Role, role_id, options=[joinedload(Role.parent)]
+    )
     modificand.name = request.form["name"]
     for m in Permissions:
         setattr(modificand, m.name, Permissions(int(request.form.get(m.name, 0))))
@@ -0,0 +1,226 @@
+#  Nido aging.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Accounts receivable aging: unpaid charges at or past their due date,
+## totalled by how long they have been overdue, for each residence and
+## member that owes money. The database does all of it in one statement:
+## CASE sums what each owner has owed since each bucket boundary, and
+## window functions put the community's totals and each owner's rank on
+## every row, so there is no second query and no arithmetic in Python.
+## Reports are cached per community per day; the billing admin views and
+## the late fee job drop the day's entry when they change charges. That only
+## reaches other workers through a shared cache, so the per-worker local
+## cache keeps entries for CACHE_LOCAL_TTL at most (see make_cache).
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .cache import memoize
+from .models import BillingCharge, Residence, User
+from .money import Money
+from .sharding import each_shard_session
+
+from datetime import date, timedelta
+from sqlalchemy import BigInteger, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import case, cast, func, select
+from sqlalchemy.sql.expression import FunctionElement
+import sqlalchemy.types as sql_types
+import csv
+import io
+
+# Label, and first and last day overdue
+BUCKETS = (
+    ("0–30", 0, 30),
+    ("31–60", 31, 60),
+    ("61–90", 61, 90),
+    ("90+", 91, None),
+)
+
+
+## The column, but not something SQLite will look up in an index. Without
+## statistics SQLite would rather seek on community and due date than read
+## ix_billing_charge_unpaid, a partial index that is already in GROUP BY order and holds
+## every column the report needs; a unary + is its documented way to say so.
+class not_indexed(FunctionElement):
+    type = sql_types.Date()
+    name = "not_indexed"
+    inherit_cache = True
+
+
+@compiles(not_indexed)
+def compile_not_indexed(element, compiler, **kw):
+    (column,) = list(element.clauses)
+    return compiler.process(column, **kw)
+
+
+@compiles(not_indexed, "sqlite")
+def compile_not_indexed_sqlite(element, compiler, **kw):
+    (column,) = list(element.clauses)
+    return f"+{compiler.process(column, **kw)}"
+
+
+def owed_since(cutoff):
+    # Without an ELSE the sum skips older charges instead of adding zeros,
+    # which SQLite does measurably faster over a large community
+    return func.sum(case((BillingCharge.due_date >= cutoff, BillingCharge.base_amount)))
+
+
+def aging_statement(community_id, today):
+    # Each charge is compared once per bucket boundary: the inner query sums
+    # what has come due since each cutoff, and a bucket is the difference
+    # between neighbouring sums
+    cutoffs = [today - timedelta(days=high) for (_, _, high) in BUCKETS[:-1]]
+    owed = (
+        select(
+            BillingCharge.residence_id,
+            BillingCharge.user_id,
+            *[
+                owed_since(cutoff).label(f"since{i}")
+                for i, cutoff in enumerate(cutoffs)
+            ],
+            func.sum(BillingCharge.base_amount).label("total"),
+            func.min(BillingCharge.due_date).label("oldest"),
+            func.count().label("charges"),
+        )
+        .where(
+            BillingCharge.community_id == community_id,
+            BillingCharge.paid == False,
+            not_indexed(BillingCharge.due_date) <= today,
+        )
+        .group_by(BillingCharge.residence_id, BillingCharge.user_id)
+        .subquery()
+    )
+    since = [func.coalesce(owed.c[f"since{i}"], 0) for i in range(len(cutoffs))]
+    since.append(owed.c.total)
+    buckets = [since[0]] + [since[i] - since[i - 1] for i in range(1, len(since))]
+    return (
+        select(
+            owed.c.residence_id,
+            owed.c.user_id,
+            Residence.unit_no,
+            Residence.street,
+            User.personal_name,
+            User.family_name,
+            *buckets,
+            owed.c.total,
+            owed.c.oldest,
+            owed.c.charges,
+            func.rank().over(order_by=owed.c.total.desc()).label("rank"),
+            # Postgres sums bigints into numeric, which comes back as Decimal
+            # and can't be stored in the JSON cache
+            *[cast(func.sum(bucket).over(), BigInteger) for bucket in buckets],
+            cast(func.sum(owed.c.total).over(), BigInteger).label("community_total"),
+        )
+        .outerjoin(Residence, Residence.id == owed.c.residence_id)
+        .outerjoin(User, User.id == owed.c.user_id)
+        .order_by(owed.c.total.desc(), owed.c.residence_id, owed.c.user_id)
+    )
+
+
+## Plain lists and strings, so the report can go in the shared cache
+@memoize("aging", ttl=24 * 60 * 60)
+def aging_report(community_id, today):
+    count = len(BUCKETS)
+    report = {
+        "as_of": today.isoformat(),
+        "totals": [0] * count,
+        "total": 0,
+        "residences": [],
+        "members": [],
+    }
+    for row in current_app.Session.execute(aging_statement(community_id, today)):
+        (residence_id, user_id, unit_no, street, personal_name, family_name) = row[:6]
+        (total, oldest, charges, rank) = row[6 + count : 10 + count]
+        report["totals"] = list(row[10 + count : 10 + 2 * count])
+        report["total"] = row.community_total
+        if residence_id is not None:
+            label = f"{unit_no or ''} {street}".strip()
+            kind = "residences"
+        else:
+            label = f"{family_name}, {personal_name}"
+            kind = "members"
+        report[kind].append(
+            {
+                "label": label,
+                "buckets": list(row[6 : 6 + count]),
+                "total": total,
+                "oldest": oldest.isoformat(),
+                "charges": charges,
+                "rank": rank,
+            }
+        )
+    return report
+
+
+def plain_amount(cents):
+    # Spreadsheets take "1234.50" as a number; "$1,234.50" as text
+    return str(Money(cents))
+
+
+def aging_csv(report, money_format=plain_amount):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(
+        ["Owed By", "Name", *(f"{b[0]} Days" for b in BUCKETS), "Total"]
+        + ["Oldest Due", "Charges"]
+    )
+    for kind, heading in (("residences", "Residence"), ("members", "Member")):
+        for owner in report[kind]:
+            writer.writerow(
+                [heading, owner["label"]]
+                + [money_format(cents) for cents in owner["buckets"]]
+                + [money_format(owner["total"]), owner["oldest"], owner["charges"]]
+            )
+    writer.writerow(
+        ["Total", ""]
+        + [money_format(cents) for cents in report["totals"]]
+        + [money_format(report["total"]), "", ""]
+    )
+    return out.getvalue()
+
+
+def add_unpaid_index(conn):
+    existing = {i["name"] for i in inspect(conn).get_indexes("billing_charge")}
+    if "ix_billing_charge_unpaid" in existing:
+        return False
+    for index in BillingCharge.__table__.indexes:
+        if index.name == "ix_billing_charge_unpaid":
+            index.create(conn)
+    return True
+
+
+aging_cli = AppGroup("aging", help="Report how long charges have been overdue.")
+
+
+@aging_cli.command("migrate")
+def migrate_command():
+    for session in each_shard_session():
+        with session.get_bind().begin() as conn:
+            if add_unpaid_index(conn):
+                click.echo("Added the unpaid charges index to billing_charge")
+            else:
+                click.echo("billing_charge already has the unpaid charges index")
+
+
+@aging_cli.command("export")
+@click.argument("community_id", type=int)
+def export_command(community_id):
+    # Outside a request, a sharded session needs telling which community's
+    # shard to use
+    current_app.Session().info["community_id"] = community_id
+    click.echo(aging_csv(aging_report(community_id, date.today())), nl=False)
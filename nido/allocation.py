@@ -0,0 +1,118 @@
+#  Nido allocation.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Splitting a special assessment across a community's residences by
+## ownership stake. Amounts are whole cents and the shares always add up to
+## exactly the total: each residence gets the floor of its exact share and
+## the cents left over go to the largest remainders (Hamilton's method), so
+## no cent is lost or invented by rounding.
+
+from .models import STAKE_SCALE, BillingCharge, Residence
+
+from datetime import date
+from sqlalchemy.sql import func, select
+import heapq
+
+
+def apportion(total, weights):
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise ValueError("Nothing to apportion over")
+    shares = []
+    remainders = []
+    for weight in weights:
+        share, remainder = divmod(total * weight, weight_sum)
+        shares.append(share)
+        remainders.append(remainder)
+    # Fewer cents are left over than there are shares. Ties go to the
+    # earlier share, since nlargest keeps the input order for equal keys.
+    leftover = total - sum(shares)
+    for i in heapq.nlargest(leftover, range(len(shares)), key=remainders.__getitem__):
+        shares[i] += 1
+    return shares
+
+
+class Allocation:
+    __slots__ = ("residence_id", "unit_no", "street", "stake", "amount")
+
+    def __init__(self, row, amount):
+        self.residence_id, self.unit_no, self.street, self.stake = row
+        self.amount = amount
+
+
+## Every residence with a stake, in one query. Residences without one, or
+## with a stake of zero, aren't charged.
+def stakes(session, community_id):
+    return session.execute(
+        select(
+            Residence.id,
+            Residence.unit_no,
+            Residence.street,
+            Residence.ownership_stake,
+        )
+        .where(
+            Residence.community_id == community_id,
+            Residence.ownership_stake > 0,
+        )
+        .order_by(Residence.id)
+    ).all()
+
+
+def allocate(session, community_id, total):
+    rows = stakes(session, community_id)
+    weights = [int(row.ownership_stake.scaleb(STAKE_SCALE)) for row in rows]
+    return [
+        Allocation(row, amount) for row, amount in zip(rows, apportion(total, weights))
+    ]
+
+
+## Adds a charge per residence to the session's transaction with a single
+## executemany insert; nothing is written until the caller commits.
+def insert_charges(session, community_id, allocations, name, due_date):
+    today = date.today()
+    session.execute(
+        BillingCharge.__table__.insert(),
+        [
+            {
+                "residence_id": allocation.residence_id,
+                "r_community_id": community_id,
+                "community_id": community_id,
+                "name": name,
+                "base_amount": allocation.amount,
+                "paid": False,
+                "charge_date": today,
+                "due_date": due_date,
+            }
+            for allocation in allocations
+            if allocation.amount > 0
+        ],
+    )
+
+
+## How many residence charges an assessment with this name and due date made
+## and their total, so an assessment is only charged once.
+def charged(session, community_id, name, due_date):
+    return session.execute(
+        select(
+            func.count(BillingCharge.id),
+            func.coalesce(func.sum(BillingCharge.base_amount), 0),
+        ).where(
+            BillingCharge.community_id == community_id,
+            BillingCharge.residence_id != None,
+            BillingCharge.name == name,
+            BillingCharge.due_date == due_date,
+        )
+    ).one()
@@ -0,0 +1,216 @@
+#  Nido assets.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Production build of the static files. In development SassMiddleware
+## compiles the stylesheet on each request and the icons are served one by
+## one. `flask assets build` instead writes everything the pages load into
+## static/dist: the compiled stylesheet, the icons bundled into one SVG
+## sprite, the scripts and any other file the stylesheet refers to, each under
+## a name containing a hash of its contents and with gzip (and, when the
+## brotli package is installed, brotli) copies alongside. manifest.json maps
+## the original names to the built ones; url_for("static", ...) follows it
+## and the built files are served as immutable, so browsers never
+## revalidate them and a rebuild changes every name that changed.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+
+import click
+from flask import Blueprint, abort, current_app, request, send_file
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+STYLESHEET = "sass/style.scss"
+SPRITE = "icons.svg"
+# A year, the longest max-age worth setting
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+SVG_NS = "http://www.w3.org/2000/svg"
+ET.register_namespace("", SVG_NS)
+
+# url('/static/...') in the compiled CSS, with or without quotes
+STATIC_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+
+## Bundle every icon into one image. Each icon keeps its own coordinates in
+## a nested <svg>, stacked down the sprite, and a <view> with the icon's
+## name selects its region, so sprite.svg#name displays just that icon
+def build_sprite(icon_dir):
+    sprite = ET.Element(f"{{{SVG_NS}}}svg")
+    width = offset = 0
+    for name in sorted(os.listdir(icon_dir)):
+        if not name.endswith(".svg"):
+            continue
+        icon = ET.parse(os.path.join(icon_dir, name)).getroot()
+        view_box = icon.get("viewBox")
+        (w, h) = (float(v) for v in view_box.split()[2:])
+        nested = ET.SubElement(
+            sprite,
+            f"{{{SVG_NS}}}svg",
+            {"y": f"{offset:g}", "width": f"{w:g}", "height": f"{h:g}"},
+        )
+        nested.set("viewBox", view_box)
+        nested.extend(list(icon))
+        ET.SubElement(
+            sprite,
+            f"{{{SVG_NS}}}view",
+            {"id": name[: -len(".svg")], "viewBox": f"0 {offset:g} {w:g} {h:g}"},
+        )
+        width = max(width, w)
+        offset += h
+    sprite.set("width", f"{width:g}")
+    sprite.set("height", f"{offset:g}")
+    sprite.set("viewBox", f"0 0 {width:g} {offset:g}")
+    return ET.tostring(sprite)
+
+
+def compile_stylesheet(static_folder):
+    import sass
+
+    return sass.compile(
+        filename=os.path.join(static_folder, STYLESHEET), output_style="compressed"
+    ).encode()
+
+
+def hashed_name(name, content):
+    (stem, ext) = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:16]}{ext}"
+
+
+def write_asset(out_dir, name, content):
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    # mtime=0 so that rebuilding the same content gives the same bytes
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(content))
+
+
+def build_assets(static_folder, out_dir):
+    icon_dir = os.path.join(static_folder, "icons")
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    manifest = {}
+
+    sprite = build_sprite(icon_dir)
+    sprite_name = hashed_name(SPRITE, sprite)
+    write_asset(out_dir, sprite_name, sprite)
+    manifest[SPRITE] = f"{DIST}/{sprite_name}"
+
+    # Icons become views into the sprite; anything else the stylesheet
+    # refers to is built as it is found
+    def rewrite(match):
+        name = match.group(2)
+        if name.startswith("icons/"):
+            icon = os.path.splitext(os.path.basename(name))[0]
+            return f"url(/static/{manifest[SPRITE]}#{icon})"
+        if name not in manifest:
+            with open(os.path.join(static_folder, name), "rb") as f:
+                content = f.read()
+            built = hashed_name(name, content)
+            write_asset(out_dir, built, content)
+            manifest[name] = f"{DIST}/{built}"
+        return f"url(/static/{manifest[name]})"
+
+    css = STATIC_URL.sub(rewrite, compile_stylesheet(static_folder).decode())
+    css = css.encode()
+    css_name = hashed_name("css/style.css", css)
+    write_asset(out_dir, css_name, css)
+    manifest["css/style.css"] = f"{DIST}/{css_name}"
+
+    # Scripts are copied as they are
+    script_dir = os.path.join(static_folder, "js")
+    for name in sorted(os.listdir(script_dir)) if os.path.isdir(script_dir) else []:
+        with open(os.path.join(script_dir, name), "rb") as f:
+            content = f.read()
+        built = hashed_name(f"js/{name}", content)
+        write_asset(out_dir, built, content)
+        manifest[f"js/{name}"] = f"{DIST}/{built}"
+
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+## Point url_for("static", filename=...) at the built file when there is one
+def manifest_url_defaults(endpoint, values):
+    if endpoint == "static" and current_app.assets:
+        values["filename"] = current_app.assets.get(
+            values["filename"], values["filename"]
+        )
+
+
+## Serve built files, precompressed when the browser accepts it. This is
+## more specific than the static route, so it takes everything under dist/
+assets_bp = Blueprint("assets", __name__)
+
+
+@assets_bp.route("/static/dist/<path:filename>")
+def built_asset(filename):
+    path = safe_join(os.path.join(current_app.static_folder, DIST), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    (mimetype, _) = mimetypes.guess_type(filename)
+    encoding = None
+    for (candidate, suffix) in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            (encoding, path) = (candidate, path + suffix)
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+assets_cli = AppGroup("assets", help="Build the static files for production.")
+
+
+@assets_cli.command("build")
+def build_command():
+    static_folder = current_app.static_folder
+    manifest = build_assets(static_folder, os.path.join(static_folder, DIST))
+    for (name, built) in sorted(manifest.items()):
+        click.echo(f"{name} -> {built}")
@@ -18,6 +18,7 @@ import functools
 
 from flask import (
     Blueprint,
+    abort,
     current_app,
     g,
     render_template,
@@ -28,77 +29,131 @@ from flask import (
 )
 from werkzeug.local import LocalProxy
 
-from .models import User, UserSession, Group, user_groups, Role
+from sqlalchemy.sql import bindparam, func, select
+
+from .cache import memoize
+from .money import money_format
+from .models import Community, User, UserSession, Group, user_groups, Role
+from .permissions import Permissions
+from .sharding import locate_user
+
+
+## Load everything we need to know about the logged in user in one query:
+## who they are, their community, their combined permissions and whether they
+## belong to any group (which is what makes them an admin)
+##
+## This and the other per-request statements are built once at import with
+## bind parameters for the values that change, so each request skips query
+## construction and goes straight to SQLAlchemy's compiled cache
+AUTH_CONTEXT = (
+    select(
+        UserSession.user_id,
+        UserSession.community_id,
+        Community.name,
+        Community.country,
+        func.count(Group.id).label("group_count"),
+        *[func.max(getattr(Role, m.name)).label(m.name) for m in Permissions],
+    )
+    .join(Community, Community.id == UserSession.community_id)
+    .outerjoin(user_groups, user_groups.c.user_id == UserSession.user_id)
+    .outerjoin(
+        Group,
+        (Group.id == user_groups.c.group_id)
+        & (Group.community_id == UserSession.community_id),
+    )
+    .outerjoin(Role, Role.id == Group.role_id)
+    .where(UserSession.id == bindparam("session_id"))
+    .group_by(
+        UserSession.user_id,
+        UserSession.community_id,
+        Community.name,
+        Community.country,
+    )
+)
+# Session ids are only unique per shard, so when the browser session
+# records its community, check that as well
+AUTH_CONTEXT_IN_COMMUNITY = AUTH_CONTEXT.where(
+    UserSession.community_id == bindparam("community_id")
+)
+
+IS_ADMIN = (
+    select(func.count(Group.id))
+    .join(user_groups, user_groups.c.group_id == Group.id)
+    .join(Role, Role.id == Group.role_id)
+    .where(
+        Group.community_id == bindparam("community_id"),
+        user_groups.c.user_id == bindparam("user_id"),
+    )
+)
+
+
+@memoize("auth_context", ttl=60)
+def lookup_auth_context(community_id, session_id):
+    if community_id is None:
+        found = current_app.Session.execute(
+            AUTH_CONTEXT, {"session_id": session_id}
+        ).first()
+    else:
+        found = current_app.Session.execute(
+            AUTH_CONTEXT_IN_COMMUNITY,
+            {"session_id": session_id, "community_id": community_id},
+        ).first()
+    if found is None:
+        return None
+    permissions = Permissions(0)
+    for m in Permissions:
+        if getattr(found, m.name):
+            permissions |= m
+    return {
+        "user_id": found.user_id,
+        "community_id": found.community_id,
+        "community_name": found.name,
+        "country": found.country,
+        "permissions": permissions.value,
+        "is_admin": found.group_count > 0,
+    }
+
+
+def load_auth_context():
+    g.auth_loaded = True
+    try:
+        session_id = session["user_session_id"]
+    except:
+        return
+    context = lookup_auth_context(session.get("community_id"), session_id)
+    if context is None:
+        return
+    g.user_id = context["user_id"]
+    g.community_id = context["community_id"]
+    g.community_name = context["community_name"]
+    # Missing from contexts cached before it was added
+    g.country = context.get("country")
+    g.permissions = Permissions(context["permissions"])
+    g.is_admin = context["is_admin"]
+
+
+def auth_context(name):
+    if "auth_loaded" not in g:
+        load_auth_context()
+    return g.get(name)
 
 
 ## Create functions to get id of active user and community
 def get_user_id():
-    if "user_id" not in g:
-        try:
-            session_id = session["user_session_id"]
-        except:
-            return None
-        try:
-            redis_result = current_app.redis.get(f"user_session:{session_id}:user_id")
-        except:
-            redis_result = None
-
-        if redis_result is None:
-            try:
-                (user_id, community_id) = (
-                    current_app.Session.query(
-                        UserSession.user_id, UserSession.community_id
-                    )
-                    .filter(UserSession.id == session["user_session_id"])
-                    .one()
-                )
-            except:
-                return None
-            g.user_id = user_id
-            g.community_id = community_id
-            try:
-                current_app.redis.set(f"user_session:{session_id}:user_id", user_id)
-                current_app.redis.set(
-                    f"user_session:{session_id}:community_id", community_id
-                )
-            except:
-                pass
-        else:
-            g.user_id = int(redis_result)
-    return g.user_id
+    return auth_context("user_id")
 
 
 def get_community_id():
-    if "community_id" not in g:
-        try:
-            session_id = session["user_session_id"]
-        except:
-            return None
-        try:
-            redis_result = current_app.redis.get(
-                f"user_session:{session_id}:community_id"
-            )
-        except:
-            redis_result = None
-
-        if redis_result is None:
-            (user_id, community_id) = (
-                current_app.Session.query(UserSession.user_id, UserSession.community_id)
-                .filter(UserSession.id == session["user_session_id"])
-                .one()
-            )
-            g.user_id = user_id
-            g.community_id = community_id
-            try:
-                current_app.redis.set(f"user_session:{session_id}:user_id", user_id)
-                current_app.redis.set(
-                    f"user_session:{session_id}:community_id", community_id
-                )
-            except:
-                pass
-        else:
-            g.community_id = int(redis_result)
-    return g.community_id
+    return auth_context("community_id")
+
+
+def get_community_name():
+    return auth_context("community_name")
+
+
+## How the community writes amounts of money
+def get_money_format():
+    return money_format(auth_context("country"))
 
 
 ## Create login_required attribute
@@ -114,20 +169,17 @@ def login_required(view):
     return wrapped_view
 
 
-## Create attribute to test presence of permission
+## Create function and attribute to test presence of permission
+def has_permission(perm):
+    permissions = auth_context("permissions")
+    return permissions is not None and permissions & perm == perm
+
+
 def requires_permission(perm):
     def wrapper(view):
         @functools.wraps(view)
         def wrapped_view(**kwargs):
-            if (
-                current_app.Session.query(Role.id)
-                .filter_by(**{perm.name: True})
-                .join(Group)
-                .join(user_groups)
-                .filter_by(user_id=get_user_id())
-                .count()
-                < 1
-            ):
+            if not has_permission(perm):
                 return abort(403)
             return view(**kwargs)
 
@@ -138,15 +190,12 @@ def requires_permission(perm):
 
 ## Create function to check if a giver user is an admin
 def is_admin(community_id, user_id):
-    return (
-        current_app.Session.query(Group)
-        .filter_by(community_id=community_id)
-        .join(user_groups)
-        .filter_by(user_id=user_id)
-        .join(Role)
-        .count()
-        > 0
+    if (community_id, user_id) == (get_community_id(), get_user_id()):
+        return auth_context("is_admin")
+    found = current_app.Session.execute(
+        IS_ADMIN, {"community_id": community_id, "user_id": user_id}
     )
+    return found.scalar() > 0
 
 
 ## Create blueprint for auth pages
@@ -159,12 +208,19 @@ auth_bp = Blueprint("auth", __name__)
 def login():
     if request.method == "POST":
         ident = request.form.get("ident")
-        user = current_app.Session.query(User).filter_by(email=ident).first()
+        user = None
+        if current_app.shards is not None:
+            # Look up the user's community first so that the database
+            # session binds to the right shard
+            session["community_id"] = locate_user(ident)
+        if current_app.shards is None or session["community_id"] is not None:
+            user = current_app.Session.query(User).filter_by(email=ident).first()
         if user:
             new_session = UserSession(user=user)
             current_app.Session.add(new_session)
             current_app.Session.commit()
             session["user_session_id"] = new_session.id
+            session["community_id"] = user.community_id
             # The flask-login docs insist that you need to validate the next
             # parameter, but that's for when it's a url query. Since here
             # it's passed as a secure server-generated cookie, this should be fine.
@@ -179,10 +235,7 @@ def login():
 def logout():
     session_id = session.pop("user_session_id")
     current_app.Session.query(UserSession).filter_by(id=session_id).delete()
-    try:
-        current_app.redis.delete(f"user_session:{session_id}:user_id")
-        current_app.redis.delete(f"user_session:{session_id}:community_id")
-    except:
-        pass
+    lookup_auth_context.invalidate(session.get("community_id"), session_id)
     current_app.Session.commit()
+    session.pop("community_id", None)
     return redirect(url_for("login"))
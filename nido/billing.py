@@ -14,58 +14,70 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, abort, current_app, render_template, request
-from .auth import login_required, get_user_id
+from flask import Blueprint, abort, current_app, request
+from sqlalchemy.sql import bindparam, select
+from .auth import login_required, get_community_id, get_money_format, get_user_id
 
 from .models import BillingCharge, ResidenceOccupancy, RecurringCharge
+from .projections import (
+    ChargeView,
+    RecurringChargeView,
+    charge_views,
+    recurring_charge_views,
+)
+from .streaming import STREAM_BATCH, render_listing
 
 from datetime import date
 
 bill_bp = Blueprint("billing", __name__)
 
+## The member's charges are built once with bind parameters, so each request
+## reuses the compiled SQL. Charges are on the user directly, or on a
+## residence they own; written as an IN rather than a join so that each side
+## can use its own index.
+OWNED_RESIDENCES = (
+    select(ResidenceOccupancy.residence_id)
+    .where(
+        ResidenceOccupancy.user_id == bindparam("user_id"),
+        ResidenceOccupancy.is_owner == True,
+    )
+    .scalar_subquery()
+)
+
+CURRENT_CHARGES = (
+    select(*ChargeView.columns)
+    .where(
+        (BillingCharge.user_id == bindparam("user_id"))
+        | BillingCharge.residence_id.in_(OWNED_RESIDENCES),
+        BillingCharge.community_id == bindparam("community_id"),
+        BillingCharge.charge_date <= bindparam("today"),
+        BillingCharge.paid == False,
+    )
+    .order_by(BillingCharge.due_date)
+    .execution_options(yield_per=STREAM_BATCH)
+)
+
+RECURRING_CHARGES = select(*RecurringChargeView.columns).where(
+    (RecurringCharge.user_id == bindparam("user_id"))
+    | RecurringCharge.residence_id.in_(OWNED_RESIDENCES)
+)
+
 
 @bill_bp.route("/")
 @login_required
 def root():
     today = date.today()
-    current_user_id = get_user_id()
-    current_charges = (
-        current_app.Session.query(BillingCharge)
-        .outerjoin(
-            ResidenceOccupancy,
-            BillingCharge.residence_id == ResidenceOccupancy.residence_id,
-        )
-        .filter(
-            (BillingCharge.user_id == current_user_id)
-            | (
-                (ResidenceOccupancy.user_id == current_user_id)
-                & (ResidenceOccupancy.is_owner == True)
-            )
-        )
-        .filter(
-            BillingCharge.charge_date <= today,
-            BillingCharge.paid == False,
-        )
-        .order_by(BillingCharge.due_date)
-        .all()
+    params = {"user_id": get_user_id(), "community_id": get_community_id()}
+    current_charges = charge_views(
+        current_app.Session.execute(CURRENT_CHARGES, dict(params, today=today)),
+        today,
+        get_money_format(),
     )
-    recurring_charges = (
-        current_app.Session.query(RecurringCharge)
-        .outerjoin(
-            ResidenceOccupancy,
-            RecurringCharge.residence_id == ResidenceOccupancy.residence_id,
-        )
-        .filter(
-            (RecurringCharge.user_id == current_user_id)
-            | (
-                (ResidenceOccupancy.user_id == current_user_id)
-                & (ResidenceOccupancy.is_owner == True)
-            )
-        )
-        .all()
+    recurring_charges = recurring_charge_views(
+        current_app.Session.execute(RECURRING_CHARGES, params), get_money_format()
     )
 
-    return render_template(
+    return render_listing(
         "billing.html",
         today=today,
         current_charges=current_charges,
@@ -0,0 +1,123 @@
+#  Nido breaker.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+
+class BreakerOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Trips open after `threshold` consecutive failures. While open, calls
+    # fail immediately with BreakerOpen instead of waiting on a dead server,
+    # and a background thread runs `probe` every `probe_interval` seconds
+    # until it succeeds, which closes the breaker again.
+    def __init__(
+        self,
+        probe,
+        threshold=3,
+        probe_interval=5,
+        failure_exceptions=(Exception,),
+    ):
+        self.probe = probe
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.failure_exceptions = failure_exceptions
+        self.is_open = False
+        self.failures = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        if self.is_open:
+            raise BreakerOpen
+        try:
+            result = fn(*args, **kwargs)
+        except self.failure_exceptions:
+            self._record_failure()
+            raise
+        self.failures = 0
+        return result
+
+    def _record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < self.threshold:
+                return
+            self.is_open = True
+            self.trips += 1
+        threading.Thread(
+            target=self._probe_until_closed, name="nido-breaker-probe", daemon=True
+        ).start()
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except self.failure_exceptions:
+                continue
+            with self._lock:
+                self.failures = 0
+                self.is_open = False
+            return
+
+    def collect_metrics(self):
+        yield ("nido_redis_breaker_open", {}, int(self.is_open))
+        yield ("nido_redis_breaker_failures", {}, self.failures)
+        yield ("nido_redis_breaker_trips_total", {}, self.trips)
+
+
+class BreakerRedis:
+    # Wraps a redis client so every command goes through a circuit breaker
+    def __init__(self, client, breaker):
+        self.client = client
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+        if not callable(command):
+            return command
+
+        def guarded(*args, **kwargs):
+            return self.breaker.call(command, *args, **kwargs)
+
+        return guarded
+
+
+def make_redis(config):
+    # Imported here since redis is optional
+    import redis
+
+    pool = redis.ConnectionPool.from_url(
+        config["REDIS_URL"],
+        max_connections=config.get("REDIS_MAX_CONNECTIONS", 50),
+        socket_timeout=config.get("REDIS_SOCKET_TIMEOUT", 0.1),
+        socket_connect_timeout=config.get("REDIS_CONNECT_TIMEOUT", 0.1),
+    )
+    client = redis.Redis(connection_pool=pool)
+    breaker = CircuitBreaker(
+        client.ping,
+        threshold=config.get("REDIS_BREAKER_THRESHOLD", 3),
+        probe_interval=config.get("REDIS_BREAKER_PROBE_INTERVAL", 5),
+        failure_exceptions=(
+            redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError,
+        ),
+    )
+    return BreakerRedis(client, breaker)
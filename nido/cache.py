@@ -0,0 +1,281 @@
+#  Nido cache.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import functools
+import json
+import threading
+import time
+
+from flask import current_app
+
+# Returned by backends on a miss, so that falsy values like 0 or False can
+# still be cached
+MISSING = object()
+
+
+## Backends. All of them store plain JSON-able values under string keys.
+class NullCache:
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def add(self, key, value, ttl=None):
+        return True
+
+    def delete(self, key):
+        pass
+
+
+class LocalCache:
+    # An in-process LRU with per-entry expiry
+    def __init__(self, max_size=1024, default_ttl=None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                (expires, value) = self._data[key]
+            except KeyError:
+                return MISSING
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        if ttl is not None and self.default_ttl is not None:
+            ttl = min(ttl, self.default_ttl)
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        if self.get(key) is not MISSING:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisCache:
+    # Redis errors are treated as misses so that a cache outage only costs
+    # database queries, never a failed page
+    def __init__(self, client, default_ttl=None):
+        self.client = client
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        try:
+            raw = self.client.get(key)
+        except Exception:
+            return MISSING
+        if raw is None:
+            return MISSING
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.client.set(key, json.dumps(value), ex=ttl or self.default_ttl)
+        except Exception:
+            pass
+
+    def add(self, key, value, ttl=None):
+        try:
+            return bool(
+                self.client.set(
+                    key, json.dumps(value), ex=ttl or self.default_ttl, nx=True
+                )
+            )
+        except Exception:
+            return True
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except Exception:
+            pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = MISSING
+
+
+class Cache:
+    # Optional local LRU tier in front of a shared backend, with hit/miss
+    # counters per namespace and single-flight computation of missing values
+    def __init__(self, backend, local=None, lock_timeout=5):
+        self.backend = backend
+        self.local = local
+        self.lock_timeout = lock_timeout
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats = collections.defaultdict(collections.Counter)
+
+    def _count(self, namespace, event):
+        self._stats[namespace][event] += 1
+
+    def stats(self):
+        return {ns: dict(counter) for (ns, counter) in self._stats.items()}
+
+    def collect_metrics(self):
+        for (namespace, counter) in self.stats().items():
+            for (event, count) in counter.items():
+                yield (
+                    "nido_cache_events_total",
+                    {"namespace": namespace, "event": event},
+                    count,
+                )
+
+    def get(self, namespace, key):
+        full_key = f"{namespace}:{key}"
+        if self.local is not None:
+            value = self.local.get(full_key)
+            if value is not MISSING:
+                self._count(namespace, "hits")
+                return value
+        value = self.backend.get(full_key)
+        if value is MISSING:
+            self._count(namespace, "misses")
+        else:
+            self._count(namespace, "hits")
+            if self.local is not None:
+                self.local.set(full_key, value)
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        full_key = f"{namespace}:{key}"
+        if self.local is not None:
+            self.local.set(full_key, value, ttl)
+        self.backend.set(full_key, value, ttl)
+
+    def delete(self, namespace, key):
+        full_key = f"{namespace}:{key}"
+        if self.local is not None:
+            self.local.delete(full_key)
+        self.backend.delete(full_key)
+
+    def get_or_set(self, namespace, key, compute, ttl=None):
+        value = self.get(namespace, key)
+        if value is not MISSING:
+            return value
+
+        # Within this process, only the first thread to miss computes the
+        # value; the others wait for it
+        full_key = f"{namespace}:{key}"
+        with self._flights_lock:
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+        if not leader:
+            flight.done.wait(self.lock_timeout)
+            if flight.value is not MISSING:
+                self._count(namespace, "coalesced")
+                return flight.value
+            return compute()
+
+        try:
+            value = self._compute_across_processes(namespace, key, compute, ttl)
+            flight.value = value
+            return value
+        finally:
+            with self._flights_lock:
+                del self._flights[full_key]
+            flight.done.set()
+
+    def _compute_across_processes(self, namespace, key, compute, ttl):
+        # Other workers coordinate through a short-lived lock key in the shared
+        # backend. If the lock holder doesn't fill in the value in time we
+        # compute it anyway rather than fail the request.
+        lock_key = f"lock:{namespace}:{key}"
+        if not self.backend.add(lock_key, 1, self.lock_timeout):
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                value = self.backend.get(f"{namespace}:{key}")
+                if value is not MISSING:
+                    self._count(namespace, "coalesced")
+                    if self.local is not None:
+                        self.local.set(f"{namespace}:{key}", value, ttl)
+                    return value
+            return compute()
+        try:
+            value = compute()
+            # None means "not found" to our callers, so it is never cached
+            if value is not None:
+                self.set(namespace, key, value, ttl)
+            return value
+        finally:
+            self.backend.delete(lock_key)
+
+
+def make_cache(config, redis_client=None):
+    cache_type = config.get("CACHE_TYPE") or ("redis" if redis_client else "local")
+    default_ttl = config.get("CACHE_DEFAULT_TTL", 24 * 60 * 60)
+    local_size = config.get("CACHE_LOCAL_SIZE", 1024)
+    if cache_type == "redis" and redis_client is not None:
+        local = None
+        if local_size:
+            # Entries in the local tier aren't invalidated by other workers,
+            # so they only live for a short time
+            local = LocalCache(local_size, config.get("CACHE_LOCAL_TTL", 30))
+        return Cache(RedisCache(redis_client, default_ttl), local)
+    elif cache_type == "null":
+        return Cache(NullCache())
+    else:
+        # Each worker has its own copy and invalidating only reaches the one
+        # that made the change, so entries get the same short life as the
+        # Redis local tier. A single worker can raise CACHE_LOCAL_TTL.
+        local_ttl = config.get("CACHE_LOCAL_TTL", 30)
+        return Cache(LocalCache(local_size or 1024, min(local_ttl, default_ttl)))
+
+
+## Decorator for functions whose arguments (usually community and user ids)
+## fully determine the result
+def memoize(namespace, ttl=None):
+    def decorator(fn):
+        def make_key(args):
+            return ":".join(str(a) for a in args)
+
+        @functools.wraps(fn)
+        def wrapped(*args):
+            return current_app.cache.get_or_set(
+                namespace, make_key(args), lambda: fn(*args), ttl
+            )
+
+        def invalidate(*args):
+            current_app.cache.delete(namespace, make_key(args))
+
+        wrapped.invalidate = invalidate
+        return wrapped
+
+    return decorator
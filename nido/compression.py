@@ -0,0 +1,311 @@
+#  Nido compression.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Compress dynamic responses by Accept-Encoding. gzip always works;
+## brotli and zstd are used when their packages are installed. Bodies are
+## compressed as the app produces them, so streamed pages (see
+## nido.streaming) still go out in pieces: once a response is known to be
+## worth compressing, what has been buffered is flushed straight away, and
+## after that output is flushed every FLUSH_SIZE bytes of input.
+##
+## Responses that are already encoded (the precompressed files from
+## nido.assets), that aren't text, that serve byte ranges or that are
+## handed off to the web server are passed through untouched.
+
+import threading
+import time
+import zlib
+from collections import Counter
+
+from werkzeug.datastructures import Headers
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+    "text/xml",
+}
+FLUSH_SIZE = 16 * 1024
+PASS_THROUGH_HEADERS = {
+    "content-encoding",
+    "content-range",
+    "accept-ranges",
+    "x-accel-redirect",
+    "x-sendfile",
+}
+
+
+## Each codec gives (compress, flush, finish): compress may hold data back,
+## flush returns everything so far in a form the client can decode, and
+## finish ends the stream
+def gzip_codec():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def brotli_codec():
+    # Quality 11 is for precompressing; 5 is much cheaper per request
+    compressor = brotli.Compressor(quality=5)
+    return (compressor.process, compressor.flush, compressor.finish)
+
+
+def zstd_codec():
+    compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        compressor.flush,
+    )
+
+
+# In order of preference when the client accepts several equally
+CODECS = {}
+if brotli is not None:
+    CODECS["br"] = brotli_codec
+if zstandard is not None:
+    CODECS["zstd"] = zstd_codec
+CODECS["gzip"] = gzip_codec
+
+
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    best = (0, None)
+    for encoding in CODECS:
+        quality = accepted[encoding]
+        if quality > best[0]:
+            best = (quality, encoding)
+    return best[1]
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024, content_types=COMPRESSIBLE):
+        self.app = app
+        self.min_size = min_size
+        self.content_types = content_types
+        self.lock = threading.Lock()
+        self.counters = {encoding: Counter() for encoding in CODECS}
+        self.skipped = Counter()
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ["REQUEST_METHOD"] != "HEAD":
+            encoding = choose_encoding(environ.get("HTTP_ACCEPT_ENCODING"))
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            if exc_info is not None and captured.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            captured["status"] = status
+            captured["headers"] = Headers(headers)
+            captured["exc_info"] = exc_info
+            return self.write_unsupported
+
+        body = self.app(environ, capture_start_response)
+        if "status" in captured:
+            reason = self.skip_reason(encoding, captured["status"], captured["headers"])
+            if reason is not None:
+                # Hand back the app's own iterable, so the server still sees
+                # a wsgi.file_wrapper and can use sendfile
+                self.count_skipped(reason)
+                start_response(
+                    captured["status"],
+                    captured["headers"].to_wsgi_list(),
+                    captured["exc_info"],
+                )
+                captured["sent"] = True
+                return body
+        # The generator doesn't run at all if the server closes it unstarted,
+        # so the app's body is closed from outside it
+        return ClosingIterator(
+            self.respond(encoding, captured, body, start_response),
+            getattr(body, "close", None),
+        )
+
+    @staticmethod
+    def write_unsupported(data):
+        raise NotImplementedError("CompressionMiddleware doesn't support write()")
+
+    def eligible(self, status, headers):
+        if headers.get("Content-Type", "").split(";")[0].strip() not in (
+            self.content_types
+        ):
+            return "content_type"
+        if status[:3] in ("204", "206", "304") or any(
+            name.lower() in PASS_THROUGH_HEADERS for name in headers.keys()
+        ):
+            return "passthrough"
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return "passthrough"
+        return None
+
+    def skip_reason(self, encoding, status, headers):
+        # Everything that can be decided from the headers alone
+        reason = self.eligible(status, headers)
+        if reason is None:
+            headers.add("Vary", "Accept-Encoding")
+            if encoding is None:
+                reason = "not_accepted"
+        if reason is None:
+            length = headers.get("Content-Length", type=int)
+            if length is not None and length < self.min_size:
+                reason = "too_small"
+        return reason
+
+    def respond(self, encoding, captured, body, start_response):
+        # Content-Type etc. are only known once the app has started the
+        # response, which may be after the first chunk for generators
+        started = "status" in captured
+        chunks = iter(body)
+        pending = []
+        pending_size = 0
+        finished = False
+        while "status" not in captured:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                finished = True
+                break
+            pending.append(chunk)
+            pending_size += len(chunk)
+        (status, headers) = (captured["status"], captured["headers"])
+
+        reason = None
+        if not started:
+            reason = self.skip_reason(encoding, status, headers)
+        if reason is None:
+            length = headers.get("Content-Length", type=int)
+            if length is None:
+                # Read until the response is big enough to be worth it, or
+                # there is no more of it
+                while not finished and pending_size < self.min_size:
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        finished = True
+                        break
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                if finished and pending_size < self.min_size:
+                    reason = "too_small"
+            else:
+                finished = finished or pending_size >= length
+
+        if reason is not None:
+            self.count_skipped(reason)
+            start_response(status, headers.to_wsgi_list(), captured["exc_info"])
+            captured["sent"] = True
+            yield from pending
+            yield from chunks
+            return
+
+        headers.remove("Content-Length")
+        headers["Content-Encoding"] = encoding
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        start_response(status, headers.to_wsgi_list(), captured["exc_info"])
+        captured["sent"] = True
+        yield from self.compress(encoding, pending, chunks, finished)
+
+    def compress(self, encoding, pending, chunks, finished):
+        (compress, flush, finish) = CODECS[encoding]()
+        (size_in, size_out, cpu) = (0, 0, 0.0)
+        try:
+            # Send what has been buffered immediately, so the top of a
+            # streamed page isn't held back behind the rest of it
+            start = time.thread_time()
+            data = b"".join(pending)
+            size_in += len(data)
+            out = compress(data) + (finish() if finished else flush())
+            cpu += time.thread_time() - start
+            size_out += len(out)
+            yield out
+            if finished:
+                return
+            unflushed = 0
+            for chunk in chunks:
+                start = time.thread_time()
+                out = compress(chunk)
+                unflushed += len(chunk)
+                if unflushed >= FLUSH_SIZE:
+                    out += flush()
+                    unflushed = 0
+                cpu += time.thread_time() - start
+                size_in += len(chunk)
+                if out:
+                    size_out += len(out)
+                    yield out
+            start = time.thread_time()
+            out = finish()
+            cpu += time.thread_time() - start
+            size_out += len(out)
+            yield out
+        finally:
+            with self.lock:
+                counter = self.counters[encoding]
+                counter["responses"] += 1
+                counter["bytes_in"] += size_in
+                counter["bytes_out"] += size_out
+                counter["cpu_seconds"] += cpu
+
+    def count_skipped(self, reason):
+        with self.lock:
+            self.skipped[reason] += 1
+
+    def collect_metrics(self):
+        with self.lock:
+            counters = {e: Counter(c) for (e, c) in self.counters.items()}
+            skipped = Counter(self.skipped)
+        for (encoding, counter) in counters.items():
+            labels = {"encoding": encoding}
+            yield ("nido_compression_responses_total", labels, counter["responses"])
+            yield ("nido_compression_bytes_in_total", labels, counter["bytes_in"])
+            yield ("nido_compression_bytes_out_total", labels, counter["bytes_out"])
+            yield (
+                "nido_compression_cpu_seconds_total",
+                labels,
+                round(counter["cpu_seconds"], 6),
+            )
+            if counter["bytes_in"]:
+                yield (
+                    "nido_compression_ratio",
+                    labels,
+                    round(counter["bytes_out"] / counter["bytes_in"], 4),
+                )
+        for (reason, count) in skipped.items():
+            yield ("nido_compression_skipped_total", {"reason": reason}, count)
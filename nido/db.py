@@ -0,0 +1,157 @@
+#  Nido db.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import sqlite3
+import time
+
+import click
+from flask import current_app, has_request_context, request, session
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+## Named engine profiles, picked with DATABASE_PROFILE in nido.cfg. Each one
+## is a set of create_engine arguments plus PRAGMAs run on every new SQLite
+## connection. DATABASE_OPTIONS can override individual engine arguments.
+ENGINE_PROFILES = {
+    # One worker process; mostly SQLAlchemy's defaults, but wait on locks
+    # rather than failing straight away
+    "sqlite-single": {
+        "engine": {},
+        "pragmas": {"busy_timeout": 5000},
+    },
+    # Several worker processes sharing one file. WAL lets readers carry on
+    # while a writer commits, and keeping connections pooled keeps the page
+    # cache and memory map warm between requests.
+    "sqlite-wal-multiworker": {
+        "engine": {
+            "poolclass": QueuePool,
+            "pool_size": 5,
+            "max_overflow": 10,
+            "connect_args": {"check_same_thread": False},
+        },
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "mmap_size": 256 * 2**20,
+            "cache_size": -32000,
+            "temp_store": "MEMORY",
+        },
+    },
+    "postgres-pooled": {
+        "engine": {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_pre_ping": True,
+            "pool_recycle": 30 * 60,
+            "query_cache_size": 1200,
+            "isolation_level": "READ COMMITTED",
+        },
+        "pragmas": {},
+    },
+}
+
+
+def apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for (name, value) in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def make_engine(url, profile=None, options=None, **kwargs):
+    if profile is None:
+        settings = {"engine": {}, "pragmas": {}}
+    else:
+        try:
+            settings = ENGINE_PROFILES[profile]
+        except KeyError:
+            raise ValueError(f"Unknown database profile {profile}")
+    engine_args = {**settings["engine"], **(options or {}), **kwargs}
+    engine = create_engine(url, **engine_args)
+    if settings["pragmas"] and engine.dialect.name == "sqlite":
+        apply_pragmas(engine, settings["pragmas"])
+    return engine
+
+
+## Replica routing. Queries made while handling GET/HEAD/OPTIONS requests go
+## to a replica; everything else, including any flush, goes to the primary.
+## After a request commits a write, that browser sticks to the primary for
+## DATABASE_STICKY_SECONDS so it sees its own changes even if the replicas
+## are behind.
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def replica_allowed():
+    return (
+        has_request_context()
+        and request.method in SAFE_METHODS
+        and session.get("db_primary_until", 0) < time.time()
+    )
+
+
+class RoutingSession(Session):
+    def __init__(self, primary, replicas, sticky_seconds=5, **kwargs):
+        super().__init__(**kwargs)
+        self.primary = primary
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # Once this session has written anything, keep reading from the
+        # primary so the request sees its own changes
+        if self.wrote or self._flushing or not replica_allowed():
+            return self.primary
+        return random.choice(self.replicas)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def mark_written(db_session, _flush_context):
+    db_session.wrote = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def stick_to_primary(db_session):
+    if db_session.wrote and has_request_context():
+        session["db_primary_until"] = time.time() + db_session.sticky_seconds
+
+
+def sqlite_path(url):
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database:
+        raise click.ClickException(f"{url} is not an SQLite file")
+    return parsed.database
+
+
+## For local testing with SQLite, replicas are refreshed by copying the
+## primary with SQLite's online backup API, which is safe while it is in use
+@click.command("sync-replicas")
+@with_appcontext
+def sync_replicas_command():
+    primary = sqlite3.connect(sqlite_path(current_app.config["DATABASE_URL"]))
+    for url in current_app.config.get("DATABASE_REPLICA_URLS", []):
+        replica = sqlite3.connect(sqlite_path(url))
+        primary.backup(replica)
+        replica.close()
+        click.echo(f"Copied primary to {url}")
+    primary.close()
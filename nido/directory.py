@@ -14,14 +14,54 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, current_app, render_template, request
-from sqlalchemy.orm import joinedload
-from .auth import login_required, get_community_id
+from flask import Blueprint, current_app, request
+from sqlalchemy.sql import bindparam, func, select
+from .auth import login_required, get_community_id, get_community_name
 
-from .models import Community, Residence, User
+from .models import Residence, ResidenceOccupancy, User
+from .projections import ResidentView, grouped_listing_views, listing_views
+from .streaming import STREAM_BATCH, render_listing, streaming_listings
 
 directory_bp = Blueprint("directory", __name__)
 
+PAGE_SIZE = 15
+
+## Built once so each request only binds the community and page
+STREET_COUNT = select(func.count(Residence.street.distinct())).where(
+    Residence.community_id == bindparam("community_id")
+)
+
+LISTINGS = (
+    select(Residence.id, Residence.street, Residence.unit_no)
+    .where(Residence.community_id == bindparam("community_id"))
+    .order_by(Residence.unit_no)
+    .limit(PAGE_SIZE)
+    .offset(bindparam("offset"))
+)
+OCCUPIED_LISTINGS = LISTINGS.where(Residence.occupants.any())
+
+RESIDENTS = (
+    select(*ResidentView.columns)
+    .join(User, User.id == ResidenceOccupancy.user_id)
+    .where(
+        ResidenceOccupancy.residence_id.in_(bindparam("residence_ids", expanding=True))
+    )
+    .order_by(ResidenceOccupancy.residence_id)
+)
+
+## When listings stream, the whole directory goes out as one page: each
+## residence with its residents from one ordered outer join, grouped into
+## listings as the rows arrive
+ALL_LISTINGS = (
+    select(Residence.id, Residence.street, Residence.unit_no, *ResidentView.columns)
+    .outerjoin(ResidenceOccupancy, ResidenceOccupancy.residence_id == Residence.id)
+    .outerjoin(User, User.id == ResidenceOccupancy.user_id)
+    .where(Residence.community_id == bindparam("community_id"))
+    .order_by(Residence.unit_no, Residence.id)
+    .execution_options(yield_per=STREAM_BATCH)
+)
+ALL_OCCUPIED_LISTINGS = ALL_LISTINGS.where(ResidenceOccupancy.residence_id != None)
+
 
 @directory_bp.route("/")
 @login_required
@@ -33,26 +73,24 @@ def root():
     except:
         page = 0
 
-    community_name = (
-        current_app.Session.query(Community.name).filter_by(id=community_id).scalar()
-    )
-    show_street = (
-        current_app.Session.query(Residence.street)
-        .filter_by(community_id=community_id)
-        .distinct()
-        .count()
-        != 1
-    )
-    listings = (
-        current_app.Session.query(Residence)
-        .options(joinedload(Residence.occupants, innerjoin=hide))
-        .filter_by(community_id=community_id)
-        .order_by(Residence.unit_no)
-        .limit(15)
-        .offset(15 * page)
-        .all()
-    )
-    return render_template(
+    community_name = get_community_name()
+    params = {"community_id": community_id, "offset": PAGE_SIZE * page}
+    show_street = current_app.Session.execute(STREET_COUNT, params).scalar() != 1
+    if streaming_listings():
+        listings = grouped_listing_views(
+            current_app.Session.execute(
+                ALL_OCCUPIED_LISTINGS if hide else ALL_LISTINGS, params
+            )
+        )
+    else:
+        listing_rows = current_app.Session.execute(
+            OCCUPIED_LISTINGS if hide else LISTINGS, params
+        ).all()
+        resident_rows = current_app.Session.execute(
+            RESIDENTS, {"residence_ids": [row.id for row in listing_rows]}
+        )
+        listings = listing_views(listing_rows, resident_rows)
+    return render_listing(
         "directory.html",
         community_name=community_name,
         listings=listings,
@@ -0,0 +1,131 @@
+#  Nido documents.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+
+from flask import Blueprint, abort, current_app, render_template
+
+from .auth import login_required, get_community_id
+from .cache import memoize
+from .file_store import send_stored, store_stream, stored_path
+from .models import Document
+from .previews import make_preview
+
+
+## The listing is the same for everyone in a community and only changes on
+## upload, delete or when a preview finishes, so cache it per community
+@memoize("documents")
+def document_listing(community_id):
+    return [
+        {
+            "id": doc.id,
+            "title": doc.title,
+            "filename": doc.filename,
+            "size": doc.size,
+            "uploaded_at": doc.uploaded_at.isoformat(),
+            "preview_text": doc.preview_text,
+            "has_thumbnail": doc.thumbnail_digest is not None,
+        }
+        for doc in current_app.Session.query(
+            Document.id,
+            Document.title,
+            Document.filename,
+            Document.size,
+            Document.uploaded_at,
+            Document.preview_text,
+            Document.thumbnail_digest,
+        )
+        .filter_by(community_id=community_id)
+        .order_by(Document.uploaded_at.desc())
+    ]
+
+
+def invalidate_listing(community_id):
+    document_listing.invalidate(community_id)
+
+
+## Previews are generated in the app's process pool so that reading a large
+## PDF never holds up a web worker. Without a pool (PREVIEW_WORKERS = 0) they
+## are generated inline.
+def save_preview(document_id, preview_text, thumbnail):
+    document = current_app.Session.get(Document, document_id)
+    if document is None:
+        return
+    document.preview_text = preview_text
+    if thumbnail:
+        (document.thumbnail_digest, _size) = store_stream(io.BytesIO(thumbnail))
+    current_app.Session.commit()
+    invalidate_listing(document.community_id)
+
+
+def queue_preview(document):
+    executor = current_app.preview_executor
+    path = stored_path(document.digest)
+    if executor is None:
+        save_preview(document.id, *make_preview(path, document.mimetype))
+        return
+
+    app = current_app._get_current_object()
+    document_id = document.id
+    community_id = document.community_id
+
+    def done(future):
+        with app.app_context():
+            # Outside a request, a sharded session needs telling which
+            # community's shard to use
+            app.Session().info["community_id"] = community_id
+            try:
+                save_preview(document_id, *future.result())
+            except:
+                app.logger.exception(f"Preview failed for document {document_id}")
+
+    executor.submit(make_preview, path, document.mimetype).add_done_callback(done)
+
+
+documents_bp = Blueprint("documents", __name__)
+
+
+@documents_bp.route("/")
+@login_required
+def root():
+    return render_template(
+        "documents.html", documents=document_listing(get_community_id())
+    )
+
+
+def get_community_document(document_id):
+    document = current_app.Session.get(Document, document_id)
+    if document is None or document.community_id != get_community_id():
+        abort(404)
+    return document
+
+
+@documents_bp.route("/<int:document_id>")
+@login_required
+def download(document_id):
+    document = get_community_document(document_id)
+    return send_stored(document.digest, document.filename, mimetype=document.mimetype)
+
+
+@documents_bp.route("/<int:document_id>/thumbnail")
+@login_required
+def thumbnail(document_id):
+    document = get_community_document(document_id)
+    if document.thumbnail_digest is None:
+        abort(404)
+    return send_stored(
+        document.thumbnail_digest, "thumbnail.jpg", mimetype="image/jpeg"
+    )
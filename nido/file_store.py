@@ -0,0 +1,111 @@
+#  Nido file_store.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import tempfile
+
+from flask import current_app, make_response, send_file
+
+CHUNK_SIZE = 64 * 1024
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+## Files are stored under the hex sha256 of their contents, so uploading the
+## same file twice only keeps one copy on disk
+def store_root():
+    return current_app.config.get(
+        "FILE_STORE", os.path.join(current_app.instance_path, "files")
+    )
+
+
+def stored_path(digest):
+    return os.path.join(store_root(), digest[:2], digest[2:])
+
+
+# Copy a file-like object into the store in CHUNK_SIZE pieces, hashing as we
+# go so the whole upload is never held in memory. Returns the (digest, size)
+# of the stored file. If more than max_size bytes arrive, the partial copy is
+# discarded and QuotaExceeded is raised. If created is given, the digest is
+# added to it when this call is what put the file in the store.
+def store_stream(stream, max_size=None, created=None):
+    tmp_dir = os.path.join(store_root(), "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise QuotaExceeded
+                sha.update(chunk)
+                tmp_file.write(chunk)
+        digest = sha.hexdigest()
+        final_path = stored_path(digest)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+            if created is not None:
+                created.add(digest)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return (digest, size)
+
+
+def discard_stored(digest):
+    try:
+        os.remove(stored_path(digest))
+    except FileNotFoundError:
+        pass
+
+
+def send_stored(digest, download_name, mimetype=None, as_attachment=False):
+    # With X_ACCEL_REDIRECT set, nginx serves the file from an internal
+    # location mapped onto the store. Otherwise send_file handles range and
+    # conditional requests itself and either sets X-Sendfile (USE_X_SENDFILE)
+    # or hands the open file to the server's wsgi.file_wrapper, which lets
+    # servers like gunicorn use os.sendfile.
+    accel_prefix = current_app.config.get("X_ACCEL_REDIRECT")
+    if accel_prefix:
+        response = make_response("")
+        response.headers[
+            "X-Accel-Redirect"
+        ] = f"{accel_prefix.rstrip('/')}/{digest[:2]}/{digest[2:]}"
+        response.headers["Content-Type"] = mimetype or "application/octet-stream"
+        disposition = "attachment" if as_attachment else "inline"
+        response.headers.set("Content-Disposition", disposition, filename=download_name)
+        return response
+
+    return send_file(
+        stored_path(digest),
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=digest,
+    )
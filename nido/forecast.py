@@ -0,0 +1,212 @@
+#  Nido forecast.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Expected income from recurring charges over the coming months. The
+## community's recurring charges are read as columns in one query and every
+## occurrence in the window is placed in its month with arithmetic on month
+## and day numbers, a batch of charges at a time, instead of stepping each
+## charge through RecurringCharge.find_next_date. NumPy does each batch as
+## whole arrays when it is installed. The forecast writes nothing to the
+## database.
+##
+## Occurrences are counted in the month they are charged. A charge whose
+## next date has already passed only counts from the start of the window.
+
+import click
+from flask.cli import AppGroup
+
+from .models import Frequency, RecurringCharge, Residence, User, add_months
+from .sharding import each_shard_session
+from .streaming import STREAM_BATCH
+
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import inspect
+from sqlalchemy.sql import or_, select
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORECAST_MONTHS = 24
+
+COLUMNS = (
+    RecurringCharge.residence_id,
+    RecurringCharge.base_amount,
+    RecurringCharge.frequency,
+    RecurringCharge.frequency_skip,
+    RecurringCharge.next_charge,
+)
+
+
+class Forecast:
+    __slots__ = ("months", "by_month", "by_frequency", "by_residence")
+
+    # by_month and each list in by_frequency hold cents per month, in the
+    # order of months; by_residence is the total over the window, with
+    # charges on individual members under None
+    def __init__(self, start, months):
+        self.months = [add_months(start, i) for i in range(months)]
+        self.by_month = [0] * months
+        self.by_frequency = {frequency: [0] * months for frequency in Frequency}
+        self.by_residence = defaultdict(int)
+
+    @property
+    def total(self):
+        return sum(self.by_month)
+
+
+def month_number(day):
+    return day.year * 12 + day.month - 1
+
+
+def first_in_window(offset, step):
+    # The first of offset, offset + step, ... that isn't before the window
+    return offset if offset >= 0 else offset % step
+
+
+def add_batch_python(forecast, rows):
+    start = forecast.months[0]
+    months = len(forecast.months)
+    # The month of each day in the window, for charges stepped in days
+    day_months = []
+    for i, month_start in enumerate(forecast.months):
+        day_months += [i] * (add_months(month_start, 1) - month_start).days
+    for residence_id, amount, frequency, skip, next_charge in rows:
+        skip = max(skip, 1)
+        if frequency == Frequency.DAILY:
+            offset = (next_charge - start).days
+            hits = [
+                day_months[day]
+                for day in range(first_in_window(offset, skip), len(day_months), skip)
+            ]
+        else:
+            step = 12 * skip if frequency == Frequency.YEARLY else skip
+            offset = month_number(next_charge) - month_number(start)
+            hits = range(first_in_window(offset, step), months, step)
+        by_frequency = forecast.by_frequency[frequency]
+        for month in hits:
+            forecast.by_month[month] += amount
+            by_frequency[month] += amount
+        forecast.by_residence[residence_id] += amount * len(hits)
+
+
+def add_batch_numpy(forecast, rows):
+    months = len(forecast.months)
+    start_day = numpy.datetime64(forecast.months[0], "D")
+    start_month = numpy.datetime64(forecast.months[0], "M")
+    horizon_days = (
+        numpy.datetime64(add_months(forecast.months[0], months)) - start_day
+    ).astype(numpy.int64)
+
+    residence_ids, amounts, frequencies, skips, next_charges = zip(*rows)
+    amount = numpy.array(amounts, dtype=numpy.int64)
+    kind = numpy.array([frequency.value for frequency in frequencies])
+    skip = numpy.maximum(numpy.array(skips, dtype=numpy.int64), 1)
+    next_day = numpy.array(next_charges, dtype="datetime64[D]")
+    daily = kind == Frequency.DAILY.value
+
+    # Months or days from the start of the window to each next charge, and
+    # the step between occurrences in the same unit
+    step = numpy.where(kind == Frequency.YEARLY.value, 12 * skip, skip)
+    offset = numpy.where(
+        daily,
+        (next_day - start_day).astype(numpy.int64),
+        (next_day.astype("datetime64[M]") - start_month).astype(numpy.int64),
+    )
+    limit = numpy.where(daily, horizon_days, months)
+    first = numpy.where(offset >= 0, offset, offset % step)
+    count = numpy.where(first < limit, (limit - first - 1) // step + 1, 0)
+
+    # One entry per occurrence: which charge, and how many steps along it is
+    charge = numpy.repeat(numpy.arange(len(amount)), count)
+    steps = numpy.arange(count.sum()) - numpy.repeat(numpy.cumsum(count) - count, count)
+    position = first[charge] + steps * step[charge]
+    month = numpy.where(
+        daily[charge],
+        ((start_day + position).astype("datetime64[M]") - start_month).astype(
+            numpy.int64
+        ),
+        position,
+    )
+
+    # bincount sums in float64, exact for totals below 2**53 cents
+    weights = amount[charge]
+    by_month = numpy.bincount(month, weights=weights, minlength=months)
+    for i, total in enumerate(numpy.rint(by_month).astype(numpy.int64).tolist()):
+        forecast.by_month[i] += total
+    for frequency in Frequency:
+        selected = kind[charge] == frequency.value
+        totals = numpy.bincount(
+            month[selected], weights=weights[selected], minlength=months
+        )
+        for i, total in enumerate(numpy.rint(totals).astype(numpy.int64).tolist()):
+            forecast.by_frequency[frequency][i] += total
+    for residence_id, total in zip(residence_ids, (amount * count).tolist()):
+        forecast.by_residence[residence_id] += total
+
+
+def recurring_charges(session, community_id):
+    # Recurring charges don't all carry their community, so go by whose
+    # they are
+    return session.execute(
+        select(*COLUMNS)
+        .where(
+            or_(
+                RecurringCharge.residence_id.in_(
+                    select(Residence.id).where(Residence.community_id == community_id)
+                ),
+                RecurringCharge.user_id.in_(
+                    select(User.id).where(User.community_id == community_id)
+                ),
+            )
+        )
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+
+
+def forecast(session, community_id, months=FORECAST_MONTHS, start=None):
+    start = (start or date.today()).replace(day=1)
+    result = Forecast(start, months)
+    add_batch = add_batch_python if numpy is None else add_batch_numpy
+    for rows in recurring_charges(session, community_id).partitions(STREAM_BATCH):
+        add_batch(result, rows)
+    return result
+
+
+## For databases created before recurring charges kept the day of the month
+## they fall on. Existing charges take it from their next date when they
+## next step.
+def add_anchor_day_column(conn):
+    columns = [c["name"] for c in inspect(conn).get_columns("recurring_charge")]
+    if "anchor_day" in columns:
+        return False
+    conn.exec_driver_sql("ALTER TABLE recurring_charge ADD COLUMN anchor_day SMALLINT")
+    return True
+
+
+forecast_cli = AppGroup("forecast", help="Forecast income from recurring charges.")
+
+
+@forecast_cli.command("migrate")
+def migrate_command():
+    for session in each_shard_session():
+        with session.get_bind().begin() as conn:
+            if add_anchor_day_column(conn):
+                click.echo("Added anchor_day to recurring_charge")
+            else:
+                click.echo("recurring_charge already has anchor_day")
@@ -23,24 +23,36 @@ from flask import (
     request,
     url_for,
 )
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.sql import bindparam, select
 from .auth import login_required, get_user_id
 
 from .models import Residence, ResidenceOccupancy, User
 
 bp = Blueprint("household", __name__)
 
+## Loading profile: the page shows each residence and everyone living there
+HOUSEHOLD_LOADING = (
+    joinedload(ResidenceOccupancy.residence).selectinload(Residence.occupants),
+)
+
+## Built once so each request only binds the user id
+OCCUPANCIES = (
+    select(ResidenceOccupancy)
+    .join(Residence)
+    .options(*HOUSEHOLD_LOADING)
+    .where(ResidenceOccupancy.user_id == bindparam("user_id"))
+    .order_by(ResidenceOccupancy.is_owner.desc())
+)
+
 
 @bp.route("/")
 @login_required
 def root():
     current_user_id = get_user_id()
     occupancies = (
-        current_app.Session.query(ResidenceOccupancy)
-        .join(Residence)
-        .filter(
-            ResidenceOccupancy.user_id == current_user_id,
-        )
-        .order_by(ResidenceOccupancy.is_owner.desc())
+        current_app.Session.execute(OCCUPANCIES, {"user_id": current_user_id})
+        .scalars()
         .all()
     )
     if len(occupancies) == 0:
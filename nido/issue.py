@@ -14,15 +14,18 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, Markup, current_app, render_template, request
+from flask import Blueprint, Markup, abort, current_app, render_template, request
+from sqlalchemy.sql import func, select
 import sqlalchemy.sql.expression as sql_expr
 from email.headerregistry import Address
 from email.message import EmailMessage
 from email import policy
 
-from .auth import login_required, get_community_id
+from .auth import login_required, get_community_id, get_user_id, has_permission
 from .email import send_email
-from .models import ReportingHandler
+from .file_store import QuotaExceeded, discard_stored, send_stored, store_stream
+from .models import Attachment, Document, Issue, ReportingHandler
+from .permissions import Permissions
 
 
 class ReportingDisabled(ReportingHandler):
@@ -41,7 +44,7 @@ class EmailIssue(ReportingHandler):
         return "Email"
 
     def default_config(self):
-        return {"issue_address": "example" }
+        return {"issue_address": "example"}
 
     def config_form(self):
         return render_template("email-issue-handler-config.html")
@@ -49,12 +52,97 @@ class EmailIssue(ReportingHandler):
     def handle_new_submission(self, issue_subject, issue_body, issue_category=None):
         msg = EmailMessage(policy.SMTP)
         msg["From"] = current_app.config.get("STMP_USER")
-        msg["To"] = self.issue_config["issue_address"]
+        msg["To"] = self.rh_config["issue_address"]
         msg["Subject"] = issue_subject
         msg.set_content(issue_body)
         send_email(msg)
 
 
+## Hand new issues off to the community's reporting handler
+def notify_handler(issue_id):
+    issue = current_app.Session.get(Issue, issue_id)
+    handler = current_app.Session.get(ReportingHandler, issue.community_id)
+    handler.handle_new_submission(issue.subject, issue.body, issue.category)
+
+
+def queue_notification(issue_id):
+    # Handlers like EmailIssue can take seconds to talk to an outside server,
+    # so they run on the app's worker pool once the issue row is committed.
+    # Without a pool (ISSUE_WORKERS = 0) the handler runs inline.
+    executor = current_app.issue_executor
+    if executor is None:
+        notify_handler(issue_id)
+        return
+
+    app = current_app._get_current_object()
+
+    community_id = get_community_id()
+
+    def run():
+        with app.app_context():
+            # Outside a request, a sharded session needs telling which
+            # community's shard to use
+            app.Session().info["community_id"] = community_id
+            try:
+                notify_handler(issue_id)
+            except:
+                app.logger.exception(f"Reporting handler failed for issue {issue_id}")
+
+    executor.submit(run)
+
+
+## Attachments are streamed into the file store as they are read, with the
+## community's remaining quota as the size limit. If a later file goes over,
+## the files this upload added are removed again, since no attachment will
+## point at them and the quota would never count them.
+def store_attachments(community_id):
+    used = (
+        current_app.Session.query(func.coalesce(func.sum(Attachment.size), 0))
+        .filter_by(community_id=community_id)
+        .scalar()
+    )
+    remaining = current_app.config.get("ATTACHMENT_QUOTA", 500 * 2**20) - used
+    attachments = []
+    created = set()
+    try:
+        for upload in request.files.getlist("attachments"):
+            if not upload.filename:
+                continue
+            (digest, size) = store_stream(
+                upload.stream, max_size=remaining, created=created
+            )
+            remaining -= size
+            attachments.append(
+                Attachment(
+                    community_id=community_id,
+                    digest=digest,
+                    filename=upload.filename,
+                    mimetype=upload.mimetype or None,
+                    size=size,
+                )
+            )
+    except QuotaExceeded:
+        discard_unreferenced(created)
+        raise
+    return attachments
+
+
+# Another upload may have stored the same file since, so only digests that
+# no attachment or document refers to are removed
+def discard_unreferenced(digests):
+    if not digests:
+        return
+    referenced = set()
+    for column in (Attachment.digest, Document.digest, Document.thumbnail_digest):
+        referenced.update(
+            current_app.Session.execute(
+                select(column).where(column.in_(digests))
+            ).scalars()
+        )
+    for digest in digests - referenced:
+        discard_stored(digest)
+
+
 issue_bp = Blueprint("issue", __name__)
 
 
@@ -62,14 +150,61 @@ issue_bp = Blueprint("issue", __name__)
 @login_required
 def root():
     community_id = get_community_id()
+    current_user_id = get_user_id()
     handler = current_app.Session.get(ReportingHandler, community_id)
     if request.method == "POST":
-        issue_subject = request.form.get("issue_subject")
-        issue_body = request.form.get("issue_body")
-        handler.handle_new_submission(issue_subject, issue_body)
+        new_issue = Issue(
+            community_id=community_id,
+            user_id=current_user_id,
+            subject=request.form.get("issue_subject"),
+            body=request.form.get("issue_body"),
+            category=request.form.get("issue_category") or None,
+        )
+        try:
+            new_issue.attachments = store_attachments(community_id)
+        except QuotaExceeded:
+            abort(413)
+        current_app.Session.add(new_issue)
+        current_app.Session.commit()
+        queue_notification(new_issue.id)
+    my_issues = (
+        current_app.Session.query(Issue)
+        .filter_by(user_id=current_user_id)
+        .order_by(Issue.created_at.desc(), Issue.id.desc())
+        .limit(20)
+        .all()
+    )
     custom_form = handler.custom_submit_form()
     if custom_form:
-        return render_template("issue.html", custom_form=Markup(custom_form))
+        return render_template(
+            "issue.html", custom_form=Markup(custom_form), my_issues=my_issues
+        )
 
     issue_categories = handler.issue_categories()
-    return render_template("issue.html", issue_categories=issue_categories)
+    return render_template(
+        "issue.html", issue_categories=issue_categories, my_issues=my_issues
+    )
+
+
+@issue_bp.route("/attachments/<int:attachment_id>")
+@login_required
+def attachment(attachment_id):
+    found = (
+        current_app.Session.query(
+            Attachment.community_id,
+            Attachment.digest,
+            Attachment.filename,
+            Attachment.mimetype,
+            Issue.user_id,
+        )
+        .join(Issue, Issue.id == Attachment.issue_id)
+        .filter(Attachment.id == attachment_id)
+        .first()
+    )
+    if found is None or found.community_id != get_community_id():
+        abort(404)
+    if found.user_id != get_user_id() and not has_permission(
+        Permissions.MODIFY_REPORTING_SETTINGS
+    ):
+        abort(403)
+    return send_stored(found.digest, found.filename, mimetype=found.mimetype)
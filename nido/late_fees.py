@@ -0,0 +1,197 @@
+#  Nido late_fees.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Late fees. Once a month has ended, every charge that was overdue during
+## it gets one fee under its community's LateFeePolicy:
+##   FLAT     a fixed amount
+##   PERCENT  basis points of the overdue charge
+##   DAILY    a fixed amount for each day the charge was late that month
+## Each community is a single INSERT ... SELECT over its unpaid charges, so
+## the database does the whole job in one pass. A fee records the charge
+## and month it is for and the select skips charges that already have one,
+## so the job can be run any number of times; the unique index on those
+## columns backs this up. Fees are never charged on fees.
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import case, exists, false, func, insert, literal, select
+from sqlalchemy.sql.expression import FunctionElement
+import sqlalchemy.types as sql_types
+
+from datetime import date, timedelta
+
+from .aging import aging_report
+from .models import BillingCharge, LateFeeMethod, LateFeePolicy
+from .sharding import each_shard_session
+
+FEE_PREFIX = "Late fee: "
+FEE_COLUMNS = (
+    "residence_id",
+    "user_id",
+    "r_community_id",
+    "u_community_id",
+    "community_id",
+    "name",
+    "base_amount",
+    "paid",
+    "charge_date",
+    "due_date",
+    "late_fee_of",
+    "late_fee_period",
+)
+
+
+## Whole days from the second date to the first. Postgres subtracts dates
+## directly; SQLite stores them as text.
+class days_after(FunctionElement):
+    type = sql_types.Integer()
+    name = "days_after"
+    inherit_cache = True
+
+
+@compiles(days_after)
+def compile_days_after(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return f"({compiler.process(later, **kw)} - {compiler.process(earlier, **kw)})"
+
+
+@compiles(days_after, "sqlite")
+def compile_days_after_sqlite(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return (
+        f"CAST(julianday({compiler.process(later, **kw)})"
+        f" - julianday({compiler.process(earlier, **kw)}) AS INTEGER)"
+    )
+
+
+def billing_period(as_of):
+    # The last whole month before as_of
+    period_end = as_of.replace(day=1) - timedelta(days=1)
+    return period_end.replace(day=1), period_end
+
+
+def fee_amount(policy, period_start, period_end):
+    if policy.method == LateFeeMethod.FLAT:
+        return literal(policy.amount, sql_types.Integer)
+    if policy.method == LateFeeMethod.PERCENT:
+        # Integer division on both databases; the 5000 rounds half up
+        return (BillingCharge.base_amount * policy.amount + 5000) / 10000
+    # Late for the whole month, or from the day after the grace period ends
+    grace = timedelta(days=policy.grace_days)
+    days_late = case(
+        (
+            BillingCharge.due_date < period_start - grace,
+            (period_end - period_start).days + 1,
+        ),
+        else_=days_after(literal(period_end, sql_types.Date), BillingCharge.due_date)
+        - policy.grace_days,
+    )
+    return days_late * policy.amount
+
+
+def late_fee_insert(policy, as_of):
+    (period_start, period_end) = billing_period(as_of)
+    amount = fee_amount(policy, period_start, period_end)
+    fee = aliased(BillingCharge)
+    already_charged = exists().where(
+        fee.community_id == policy.community_id,
+        fee.late_fee_of == BillingCharge.id,
+        fee.late_fee_period == period_start,
+    )
+    overdue = select(
+        BillingCharge.residence_id,
+        BillingCharge.user_id,
+        BillingCharge.r_community_id,
+        BillingCharge.u_community_id,
+        BillingCharge.community_id,
+        func.substr(literal(FEE_PREFIX) + BillingCharge.name, 1, 200),
+        amount,
+        false(),
+        literal(as_of, sql_types.Date),
+        literal(as_of, sql_types.Date),
+        BillingCharge.id,
+        literal(period_start, sql_types.Date),
+    ).where(
+        BillingCharge.community_id == policy.community_id,
+        BillingCharge.paid == False,
+        BillingCharge.late_fee_of == None,
+        BillingCharge.due_date < period_end - timedelta(days=policy.grace_days),
+        amount > 0,
+        ~already_charged,
+    )
+    return insert(BillingCharge.__table__).from_select(FEE_COLUMNS, overdue)
+
+
+## Charges fees for the month before as_of in every community with a
+## policy. Returns the number of fees added per community; nothing is
+## written until the caller commits.
+def apply_late_fees(session, as_of):
+    counts = {}
+    for policy in session.execute(select(LateFeePolicy)).scalars().all():
+        result = session.execute(late_fee_insert(policy, as_of))
+        counts[policy.community_id] = result.rowcount
+    return counts
+
+
+## For databases created before late fees: the policy table, the columns
+## linking a fee to its charge and the index that keeps fees unique
+def add_late_fee_columns(conn):
+    LateFeePolicy.__table__.create(conn, checkfirst=True)
+    columns = [c["name"] for c in inspect(conn).get_columns("billing_charge")]
+    if "late_fee_of" in columns:
+        return False
+    conn.exec_driver_sql("ALTER TABLE billing_charge ADD COLUMN late_fee_of INTEGER")
+    conn.exec_driver_sql("ALTER TABLE billing_charge ADD COLUMN late_fee_period DATE")
+    for index in BillingCharge.__table__.indexes:
+        if index.name == "ix_billing_charge_late_fee":
+            index.create(conn)
+    return True
+
+
+late_fees_cli = AppGroup("late-fees", help="Charge late fees on overdue charges.")
+
+
+@late_fees_cli.command("migrate")
+def migrate_command():
+    for session in each_shard_session():
+        with session.get_bind().begin() as conn:
+            if add_late_fee_columns(conn):
+                click.echo("Added late fee columns to billing_charge")
+            else:
+                click.echo("billing_charge already has late fee columns")
+
+
+@late_fees_cli.command("apply")
+@click.option(
+    "--as-of",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help="Charge for the month before this date (default today)",
+)
+def apply_command(as_of):
+    as_of = as_of.date() if as_of else date.today()
+    counts = {}
+    for session in each_shard_session():
+        counts.update(apply_late_fees(session, as_of))
+        session.commit()
+    for community_id, count in counts.items():
+        if count:
+            aging_report.invalidate(community_id, date.today())
+    for community_id, count in sorted(counts.items()):
+        click.echo(f"Community {community_id}: {count} late fees")
@@ -0,0 +1,38 @@
+#  Nido loading.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Relationships are declared lazy so that each view states what it needs as
+## a loading profile next to its query (see household.py for an example)
+## instead of paying for eager loads it doesn't use. The cost is that a
+## template touching a relationship nobody planned for quietly issues a
+## query per row. In development and tests, enforce_planned_loading makes
+## any such lazy load raise instead.
+
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+
+
+def raise_on_lazy_load(state):
+    # Only top-level selects: the follow-up queries that selectinload and
+    # friends issue are the planned loads
+    if state.is_select and not (state.is_column_load or state.is_relationship_load):
+        # sql_only still lets many-to-ones resolve from the identity map
+        state.statement = state.statement.options(raiseload("*", sql_only=True))
+
+
+def enforce_planned_loading(session_factory):
+    event.listen(session_factory, "do_orm_execute", raise_on_lazy_load)
+    return session_factory
@@ -15,20 +15,35 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from flask import Flask
-from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 
+from .assets import assets_bp, assets_cli, load_manifest, manifest_url_defaults
+from .breaker import make_redis
+from .cache import make_cache
+from .compression import CompressionMiddleware
+from .db import RoutingSession, make_engine, sync_replicas_command
+from .loading import enforce_planned_loading
 from .main_menu import get_main_menu
-from .auth import auth_bp
+from .auth import auth_bp, load_auth_context
 from .admin_view import admin_bp
 from .billing import bill_bp
 from .directory import directory_bp
+from .documents import documents_bp
 from .er_contacts import er_bp
 from .household import bp as house_bp, root as house_root
 from .issue import issue_bp
+from .aging import aging_cli
+from .forecast import forecast_cli
+from .late_fees import late_fees_cli
+from .money import money_cli
+from .partitions import partitions_cli
+from .reconciliation import reconciliation_cli
+from .sharding import CommunityMoving, ShardedSession, shards_cli
+from .metrics import Metrics, metrics_bp
 
 
 def create_app(testing_config=None):
@@ -60,32 +75,113 @@ def create_app(testing_config=None):
                 }
             },
         )
+        app.assets = {}
+    else:
+        # Use the output of `flask assets build`, if it has been run
+        app.assets = load_manifest(app.static_folder)
+    app.url_defaults(manifest_url_defaults)
+    app.cli.add_command(assets_cli)
+
+    def engine_for(url):
+        return make_engine(
+            url,
+            app.config.get("DATABASE_PROFILE"),
+            app.config.get("DATABASE_OPTIONS"),
+            echo=app.config.get("LOG_SQL", app.env == "development"),
+        )
 
-    db_engine = create_engine(
-        app.config["DATABASE_URL"],
-        echo=app.config.get("LOG_SQL", app.env == "development"),
-    )
-    app.Session = scoped_session(sessionmaker(bind=db_engine))
+    db_engine = engine_for(app.config["DATABASE_URL"])
+    shard_urls = app.config.get("DATABASE_SHARDS")
+    replica_urls = app.config.get("DATABASE_REPLICA_URLS")
+    if shard_urls:
+        # DATABASE_URL becomes the directory of which shard holds what
+        app.directory_engine = db_engine
+        app.shards = {name: engine_for(url) for (name, url) in shard_urls.items()}
+        app.Session = scoped_session(
+            sessionmaker(class_=ShardedSession, directory=db_engine, shards=app.shards)
+        )
+    elif replica_urls:
+        app.shards = None
+        app.Session = scoped_session(
+            sessionmaker(
+                class_=RoutingSession,
+                primary=db_engine,
+                replicas=[engine_for(url) for url in replica_urls],
+                sticky_seconds=app.config.get("DATABASE_STICKY_SECONDS", 5),
+            )
+        )
+    else:
+        app.shards = None
+        app.Session = scoped_session(sessionmaker(bind=db_engine))
+    if app.config.get("RAISE_ON_LAZY_LOAD", app.env == "development"):
+        enforce_planned_loading(app.Session)
+    app.cli.add_command(sync_replicas_command)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(money_cli)
+    app.cli.add_command(late_fees_cli)
+    app.cli.add_command(forecast_cli)
+    app.cli.add_command(aging_cli)
+    app.cli.add_command(reconciliation_cli)
+
+    app.before_request(load_auth_context)
+
+    @app.errorhandler(CommunityMoving)
+    def community_moving(error):
+        # Only while a community is being moved between shards
+        return (
+            "Down for maintenance, please try again shortly",
+            503,
+            {"Retry-After": "60"},
+        )
 
     @app.teardown_appcontext
     def end_db_session(response):
         app.Session.remove()
 
-    try:
-        import redis
+    app.metrics = Metrics()
 
-        app.redis = redis.from_url(app.config["REDIS_URL"])
+    try:
+        app.redis = make_redis(app.config)
+        app.metrics.register(app.redis.breaker.collect_metrics)
     except:
         app.redis = None
 
+    app.cache = make_cache(app.config, app.redis)
+    app.metrics.register(app.cache.collect_metrics)
+
+    if app.config.get("COMPRESSION", True):
+        app.compression = CompressionMiddleware(
+            app.wsgi_app, min_size=app.config.get("COMPRESSION_MIN_SIZE", 1024)
+        )
+        app.wsgi_app = app.compression
+        app.metrics.register(app.compression.collect_metrics)
+
+    issue_workers = app.config.get("ISSUE_WORKERS", 2)
+    if issue_workers:
+        app.issue_executor = ThreadPoolExecutor(
+            max_workers=issue_workers, thread_name_prefix="nido-issue"
+        )
+    else:
+        app.issue_executor = None
+
+    preview_workers = app.config.get("PREVIEW_WORKERS", 2)
+    if preview_workers:
+        app.preview_executor = ProcessPoolExecutor(max_workers=preview_workers)
+    else:
+        app.preview_executor = None
+
     app.jinja_env.globals.update(get_main_menu=get_main_menu)
 
+    app.register_blueprint(assets_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(bill_bp, url_prefix="/billing")
     app.register_blueprint(directory_bp, url_prefix="/directory")
+    app.register_blueprint(documents_bp, url_prefix="/documents")
     app.register_blueprint(er_bp, url_prefix="/emergency-contacts")
     app.register_blueprint(house_bp, url_prefix="/my-household")
     app.register_blueprint(issue_bp, url_prefix="/report-issue")
+    app.register_blueprint(metrics_bp)
 
     app.register_blueprint(admin_bp, url_prefix="/admin")
 
@@ -29,6 +29,8 @@ def admin_menu():
     menu_list = []
     menu_list.append(MenuLink("Dashboard", url_for("admin.dash.dashboard")))
     menu_list.append(MenuLink("Manage Billing", url_for("admin.billing.root")))
+    menu_list.append(MenuLink("Issue Queue", url_for("admin.issues.queue")))
+    menu_list.append(MenuLink("Manage Documents", url_for("admin.documents.root")))
     menu_list.append(MenuLink("Edit Groups", url_for("admin.posit.edit_groups")))
     menu_list.append(MenuLink("Edit Permissions", url_for("admin.roles.edit_roles")))
     menu_list.append(MenuLink("User View", url_for("index")))
@@ -42,21 +44,9 @@ def user_menu():
     menu_list.append(MenuLink("Billing", url_for("billing.root")))
     menu_list.append(MenuLink("Report Issue", url_for("issue.root")))
     menu_list.append(MenuLink("Resident Directory", url_for("directory.root")))
+    menu_list.append(MenuLink("Documents", url_for("documents.root")))
     menu_list.append(MenuLink("Emergency Contacts", url_for("er_contacts.root")))
-    current_user_id = get_user_id()
-
-    try:
-        show_admin = int(current_app.redis.get(f"user:{current_user_id}:is_admin"))
-    except:
-        show_admin = None
-    if show_admin is None:
-        show_admin = is_admin(get_community_id(), current_user_id)
-    try:
-        current_app.redis.set(f"user:{current_user_id}:is_admin", int(show_admin))
-    except:
-        pass
-
-    if show_admin:
+    if is_admin(get_community_id(), get_user_id()):
         menu_list.append(MenuLink("Admin View", url_for("admin.root")))
     menu_list.append(MenuLink("Logout", url_for("logout")))
     return menu_list
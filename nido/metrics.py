@@ -0,0 +1,61 @@
+#  Nido metrics.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hmac
+
+from flask import Blueprint, abort, current_app, request
+
+
+## Collectors are callables yielding (name, labels, value) tuples. They are
+## only run when /metrics is scraped.
+class Metrics:
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            for (name, labels, value) in collector():
+                if labels:
+                    label_str = ",".join(f'{k}="{v}"' for (k, v) in labels.items())
+                    lines.append(f"{name}{{{label_str}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics")
+def metrics():
+    # Scrapers can't log in, so the endpoint is only enabled when a bearer
+    # token is configured
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        abort(403)
+    return (
+        current_app.metrics.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4"},
+    )
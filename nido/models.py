@@ -23,50 +23,69 @@ import sqlalchemy.types as sql_types
 import sqlalchemy.schema as sql_schema
 import sqlalchemy.sql.expression as sql_expr
 
+import calendar
 import enum
 import datetime
 import decimal
 from functools import reduce
 
+from .money import Money
 from .permissions import Permissions
 
 
-class SqliteSafeDecimal(sql_types.TypeDecorator):
-    impl = sql_types.TypeEngine
+## Decimals stored as integers scaled by 10**scale, so that SUM, AVG and
+## comparisons work on exact values in the database (a string column on
+## SQLite can only be compared as text). Binds and results are Decimals.
+class FixedPoint(sql_types.TypeDecorator):
+    impl = sql_types.BigInteger
+    cache_ok = True
 
-    def __init__(self, precision=18, scale=15, *arg, **kw):
-        self.precision = precision
+    def __init__(self, scale, *arg, **kw):
         self.scale = scale
         sql_types.TypeDecorator.__init__(self, *arg, **kw)
 
-    def load_dialect_impl(self, dialect):
-        if dialect.name == "sqlite":
-            # Precision + 1 to include the decimal point
-            return dialect.type_descriptor(sql_types.String(self.precision + 1))
-        else:
-            return dialect.type_descriptor(
-                sql_types.Numeric(precision=self.precision, scale=self.scale)
-            )
-
     def process_bind_param(self, value, dialect):
         if value is None:
             return value
-        elif dialect.name == "sqlite":
-            return str(value)
-        else:
-            return value
+        scaled = decimal.Decimal(str(value)).scaleb(self.scale)
+        return int(scaled.to_integral_value(decimal.ROUND_HALF_UP))
 
     def process_result_value(self, value, dialect):
         if value is None:
             return value
-        elif dialect.name == "sqlite":
-            return decimal.Decimal(value)
-        else:
+        # AVG comes back as a float
+        if not isinstance(value, int):
+            value = decimal.Decimal(str(value))
+        return decimal.Decimal(value).scaleb(-self.scale)
+
+
+## Integer cents read as Money. This is the SQL side of the amount hybrids:
+## base_amount typed so that sums and comparisons against Decimals or Money
+## happen on the integer column.
+class MoneyCents(sql_types.TypeDecorator):
+    impl = sql_types.Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return Money.coerce(value).cents
+
+    def process_result_value(self, value, dialect):
+        if value is None:
             return value
+        if not isinstance(value, int):
+            value = decimal.Decimal(str(value)).to_integral_value(decimal.ROUND_HALF_UP)
+        return Money(value)
+
+
+# Ownership stakes are percentages with up to 15 decimal places
+STAKE_SCALE = 15
 
 
 class BooleanFlag(sql_types.TypeDecorator):
     impl = sql_types.Boolean
+    cache_ok = True
 
     def __init__(self, true_flag, false_flag, *arg, **kw):
         self.true_flag = true_flag
@@ -149,7 +168,10 @@ class ReportingHandler(Base):
 
 class Residence(Base):
     __tablename__ = "residence"
-    __table_args__ = (sql_schema.UniqueConstraint("id", "community_id"),)
+    __table_args__ = (
+        sql_schema.UniqueConstraint("id", "community_id"),
+        sql_schema.Index("ix_residence_community_unit", "community_id", "unit_no"),
+    )
 
     id = Column(sql_types.Integer, primary_key=True)
     community_id = Column(sql_types.Integer, ForeignKey("community.id"), nullable=False)
@@ -159,7 +181,7 @@ class Residence(Base):
     locality = Column(sql_types.String(40), nullable=False)
     postcode = Column(sql_types.String(20), nullable=False)
     region = Column(sql_types.String(40), nullable=False)
-    ownership_stake = Column(SqliteSafeDecimal)
+    ownership_stake = Column(FixedPoint(STAKE_SCALE))
 
     occupants = orm.relationship(
         "User",
@@ -199,6 +221,8 @@ class ResidenceOccupancy(Base):
             ["residence.id", "residence.community_id"],
         ),
         sql_schema.CheckConstraint("u_community_id = r_community_id"),
+        # The primary key already covers lookups by residence
+        sql_schema.Index("ix_residence_occupancy_user", "user_id"),
     )
 
     residence_id = Column(sql_types.Integer, nullable=False, primary_key=True)
@@ -220,12 +244,18 @@ user_groups = Table(
     Base.metadata,
     Column("user_id", sql_types.Integer, ForeignKey("user.id"), primary_key=True),
     Column("group_id", sql_types.Integer, ForeignKey("group.id"), primary_key=True),
+    # The primary key already covers lookups by user
+    sql_schema.Index("ix_user_groups_group", "group_id"),
 )
 
 
 class Group(Base):
     __tablename__ = "group"
-    __table_args__ = (sql_schema.UniqueConstraint("id", "community_id"),)
+    __table_args__ = (
+        sql_schema.UniqueConstraint("id", "community_id"),
+        sql_schema.Index("ix_group_community", "community_id"),
+        sql_schema.Index("ix_group_role", "role_id"),
+    )
 
     id = Column(sql_types.Integer, primary_key=True)
     community_id = Column(sql_types.Integer, ForeignKey("community.id"), nullable=False)
@@ -390,7 +420,10 @@ class RootRole(Role):
 
 class User(Base):
     __tablename__ = "user"
-    __table_args__ = (sql_schema.UniqueConstraint("id", "community_id"),)
+    __table_args__ = (
+        sql_schema.UniqueConstraint("id", "community_id"),
+        sql_schema.Index("ix_user_community_family", "community_id", "family_name"),
+    )
 
     id = Column(sql_types.Integer, primary_key=True)
     community_id = Column(sql_types.Integer, ForeignKey("community.id"), nullable=False)
@@ -427,6 +460,7 @@ class UserSession(Base):
         sql_schema.ForeignKeyConstraint(
             ["user_id", "community_id"], ["user.id", "user.community_id"]
         ),
+        sql_schema.Index("ix_user_session_user", "user_id"),
         {"sqlite_autoincrement": True},
     )
 
@@ -442,6 +476,8 @@ class UserSession(Base):
 
 class EmergencyContact(Base):
     __tablename__ = "er_contact"
+    __table_args__ = (sql_schema.Index("ix_er_contact_user", "user_id"),)
+
     id = Column(sql_types.Integer, primary_key=True)
     user_id = Column(sql_types.Integer, ForeignKey("user.id"), nullable=False)
     personal_name = Column(sql_types.String(80), nullable=False)
@@ -464,6 +500,11 @@ class EmergencyContact(Base):
         )
 
 
+def charge_community_default(context):
+    params = context.get_current_parameters()
+    return params["u_community_id"] or params["r_community_id"]
+
+
 class BillingCharge(Base):
     __tablename__ = "billing_charge"
     __table_args__ = (
@@ -476,18 +517,55 @@ class BillingCharge(Base):
         ),
         sql_schema.CheckConstraint("u_community_id = r_community_id"),
         sql_schema.CheckConstraint("residence_id is null or user_id is null"),
+        sql_schema.CheckConstraint(
+            "community_id = coalesce(u_community_id, r_community_id)"
+        ),
+        sql_schema.Index("ix_billing_charge_user", "user_id", "due_date"),
+        sql_schema.Index("ix_billing_charge_residence", "residence_id", "due_date"),
+        sql_schema.Index("ix_billing_charge_community", "community_id", "due_date"),
+        # Only the unpaid charges, with every column the aging report reads
+        # so it never has to touch the table, in the order it groups them
+        sql_schema.Index(
+            "ix_billing_charge_unpaid",
+            "community_id",
+            "residence_id",
+            "user_id",
+            "due_date",
+            "base_amount",
+            sqlite_where=sql_expr.column("paid", sql_types.Boolean) == False,
+            postgresql_where=sql_expr.column("paid", sql_types.Boolean) == False,
+        ),
+        # One late fee per charge and period, whatever runs the job. Includes
+        # community_id so the index can be kept on a partitioned table.
+        sql_schema.Index(
+            "ix_billing_charge_late_fee",
+            "community_id",
+            "late_fee_of",
+            "late_fee_period",
+            unique=True,
+        ),
     )
     id = Column(sql_types.Integer, primary_key=True)
     residence_id = Column(sql_types.Integer, nullable=True)
     user_id = Column(sql_types.Integer, nullable=True)
     r_community_id = Column(sql_types.Integer, nullable=True)
     u_community_id = Column(sql_types.Integer, nullable=True)
+    # Copy of whichever of the above is set. On Postgres this is the key the
+    # table can be partitioned on (see nido.partitions), so every query on
+    # charges should filter by it.
+    community_id = Column(
+        sql_types.Integer, nullable=False, default=charge_community_default
+    )
 
     name = Column(sql_types.String(200), nullable=False)
     base_amount = Column(sql_types.Integer, nullable=False)
     paid = Column(sql_types.Boolean, nullable=False)
     charge_date = Column(sql_types.Date, nullable=False)
     due_date = Column(sql_types.Date, nullable=False)
+    # Set on late fees: the overdue charge and the first day of the month
+    # the fee is for (see nido.late_fees)
+    late_fee_of = Column(sql_types.Integer, nullable=True)
+    late_fee_period = Column(sql_types.Date, nullable=True)
 
     def __repr__(self):
         return (
@@ -502,13 +580,91 @@ class BillingCharge(Base):
 
     @hybrid_property
     def amount(self):
-        return decimal.Decimal(".01") * self.base_amount
+        return Money(self.base_amount)
+
+    @amount.setter
+    def amount(self, value):
+        self.base_amount = Money.coerce(value).cents
+
+    @amount.expression
+    def amount(cls):
+        return sql_expr.type_coerce(cls.base_amount, MoneyCents())
 
     @property
     def formatted_amount(self):
         return f"${self.amount}"
 
 
+class LateFeeMethod(enum.Enum):
+    FLAT = 1
+    PERCENT = 2
+    DAILY = 3
+
+
+## Statement payments that reconciliation has already applied, so that
+## uploading the same statement again (or one that overlaps it) doesn't pay
+## more charges. fingerprint is a hash of the bank's transaction id, or of
+## the payment's details when the statement has none.
+class ReconciledPayment(Base):
+    __tablename__ = "reconciled_payment"
+
+    community_id = Column(
+        sql_types.Integer, ForeignKey("community.id"), primary_key=True
+    )
+    fingerprint = Column(sql_types.String(64), primary_key=True)
+    paid_on = Column(sql_types.Date, nullable=False)
+    amount = Column(sql_types.Integer, nullable=False)
+    # False while the payment waits for an admin to settle it by hand
+    resolved = Column(sql_types.Boolean, nullable=False, default=True)
+
+    def __repr__(self):
+        return (
+            f"ReconciledPayment("
+            f"paid_on={self.paid_on},"
+            f"amount={self.amount},"
+            f"resolved={self.resolved}"
+            f")"
+        )
+
+
+class LateFeePolicy(Base):
+    __tablename__ = "late_fee_policy"
+
+    community_id = Column(
+        sql_types.Integer, ForeignKey("community.id"), primary_key=True
+    )
+    method = Column(sql_types.Enum(LateFeeMethod), nullable=False)
+    # Cents for FLAT, cents per day overdue for DAILY and basis points of the
+    # overdue amount for PERCENT
+    amount = Column(sql_types.Integer, nullable=False)
+    # Days after the due date before a charge counts as late
+    grace_days = Column(sql_types.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (
+            f"LateFeePolicy("
+            f"method={self.method},"
+            f"amount={self.amount},"
+            f"grace_days={self.grace_days}"
+            f")"
+        )
+
+
+## The same day of the month, months later, or the last day of that month
+## when it is shorter (Jan 31 + 1 month is Feb 28, Feb 29 + 1 year Feb 28)
+def add_months(day, months, day_of_month=None):
+    # On day_of_month (default day's own), or the month's last day if it is
+    # shorter
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    month += 1
+    day_of_month = day_of_month or day.day
+    return day.replace(
+        year=year,
+        month=month,
+        day=min(day_of_month, calendar.monthrange(year, month)[1]),
+    )
+
+
 class Frequency(enum.Enum):
     YEARLY = 1
     MONTHLY = 2
@@ -527,6 +683,8 @@ class RecurringCharge(Base):
         ),
         sql_schema.CheckConstraint("u_community_id = r_community_id"),
         sql_schema.CheckConstraint("residence_id is null or user_id is null"),
+        sql_schema.Index("ix_recurring_charge_user", "user_id"),
+        sql_schema.Index("ix_recurring_charge_residence", "residence_id"),
     )
     id = Column(sql_types.Integer, primary_key=True)
     residence_id = Column(sql_types.Integer, nullable=True)
@@ -540,6 +698,9 @@ class RecurringCharge(Base):
     frequency_skip = Column(sql_types.Integer, nullable=False, default=1)
     grace_period = Column(sql_types.Interval, nullable=False)
     next_charge = Column(sql_types.Date, nullable=False)
+    # The day of the month monthly and yearly charges fall on. next_charge is
+    # earlier in months too short for it, and goes back to it after.
+    anchor_day = Column(sql_types.SmallInteger, nullable=True)
 
     def __repr__(self):
         return (
@@ -555,7 +716,15 @@ class RecurringCharge(Base):
 
     @hybrid_property
     def amount(self):
-        return decimal.Decimal(".01") * self.base_amount
+        return Money(self.base_amount)
+
+    @amount.setter
+    def amount(self, value):
+        self.base_amount = Money.coerce(value).cents
+
+    @amount.expression
+    def amount(cls):
+        return sql_expr.type_coerce(cls.base_amount, MoneyCents())
 
     @property
     def formatted_amount(self):
@@ -572,14 +741,128 @@ class RecurringCharge(Base):
         return new_charge
 
     def find_next_date(self):
+        # Charges made before anchor_day existed take it from their next date
+        if self.anchor_day is None:
+            self.anchor_day = self.next_charge.day
         if self.frequency == Frequency.YEARLY:
-            return self.next_charge.replace(
-                year=self.next_charge.year + self.frequency_skip
+            return add_months(
+                self.next_charge, 12 * self.frequency_skip, self.anchor_day
             )
         elif self.frequency == Frequency.MONTHLY:
-            next_month = self.next_charge.month + self.frequency_skip
-            return self.next_charge.replace(
-                year=self.next_charge.year + next_month // 12, month=next_month % 12
-            )
+            return add_months(self.next_charge, self.frequency_skip, self.anchor_day)
         elif self.frequency == Frequency.DAILY:
             return self.next_charge + datetime.timedelta(days=self.frequency_skip)
+
+
+class IssueStatus(enum.Enum):
+    OPEN = 1
+    IN_PROGRESS = 2
+    CLOSED = 3
+
+
+class Issue(Base):
+    __tablename__ = "issue"
+    __table_args__ = (
+        sql_schema.ForeignKeyConstraint(
+            ["user_id", "community_id"], ["user.id", "user.community_id"]
+        ),
+        sql_schema.ForeignKeyConstraint(
+            ["assignee_id", "community_id"], ["user.id", "user.community_id"]
+        ),
+        # The admin work queue filters on community and status and pages
+        # through the result by (created_at, id), so keep that all in one index
+        sql_schema.Index(
+            "ix_issue_queue", "community_id", "status", "created_at", "id"
+        ),
+        sql_schema.Index("ix_issue_user", "user_id", "created_at"),
+    )
+
+    id = Column(sql_types.Integer, primary_key=True)
+    community_id = Column(sql_types.Integer, nullable=False)
+    user_id = Column(sql_types.Integer, nullable=False)
+    assignee_id = Column(sql_types.Integer, nullable=True)
+
+    subject = Column(sql_types.String(200), nullable=False)
+    body = Column(sql_types.Text, nullable=False)
+    category = Column(sql_types.String(80), nullable=True)
+    status = Column(
+        sql_types.Enum(IssueStatus), nullable=False, default=IssueStatus.OPEN
+    )
+    # Set client side so that stored values and keyset cursors compare with
+    # the same precision (SQLite's CURRENT_TIMESTAMP drops the microseconds)
+    created_at = Column(
+        sql_types.DateTime, nullable=False, default=datetime.datetime.now
+    )
+
+    submitter = orm.relationship(
+        "User",
+        lazy=True,
+        viewonly=True,
+        primaryjoin="and_(User.id == Issue.user_id,"
+        "User.community_id == Issue.community_id)",
+    )
+    assignee = orm.relationship(
+        "User",
+        lazy=True,
+        viewonly=True,
+        primaryjoin="and_(User.id == Issue.assignee_id,"
+        "User.community_id == Issue.community_id)",
+    )
+    attachments = orm.relationship(
+        "Attachment", lazy=True, backref=orm.backref("issue", lazy=True)
+    )
+
+    def __repr__(self):
+        return (
+            f"Issue("
+            f"subject={self.subject},"
+            f"category={self.category},"
+            f"status={self.status},"
+            f"created_at={self.created_at}"
+            f")"
+        )
+
+
+class Attachment(Base):
+    __tablename__ = "attachment"
+    __table_args__ = (sql_schema.Index("ix_attachment_community", "community_id"),)
+
+    id = Column(sql_types.Integer, primary_key=True)
+    community_id = Column(sql_types.Integer, ForeignKey("community.id"), nullable=False)
+    issue_id = Column(sql_types.Integer, ForeignKey("issue.id"), nullable=False)
+
+    # Hex sha256 of the contents; the file itself lives in the file store
+    digest = Column(sql_types.String(64), nullable=False)
+    filename = Column(sql_types.String(200), nullable=False)
+    mimetype = Column(sql_types.String(100), nullable=True)
+    size = Column(sql_types.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"Attachment(filename={self.filename}, size={self.size})"
+
+
+class Document(Base):
+    __tablename__ = "document"
+    __table_args__ = (
+        sql_schema.Index("ix_document_community", "community_id", "uploaded_at"),
+    )
+
+    id = Column(sql_types.Integer, primary_key=True)
+    community_id = Column(sql_types.Integer, ForeignKey("community.id"), nullable=False)
+
+    title = Column(sql_types.String(200), nullable=False)
+    # Hex sha256 of the contents; the file itself lives in the file store
+    digest = Column(sql_types.String(64), nullable=False)
+    filename = Column(sql_types.String(200), nullable=False)
+    mimetype = Column(sql_types.String(100), nullable=True)
+    size = Column(sql_types.Integer, nullable=False)
+    uploaded_at = Column(
+        sql_types.DateTime, nullable=False, default=datetime.datetime.now
+    )
+
+    # Filled in by the preview workers after upload
+    preview_text = Column(sql_types.Text, nullable=True)
+    thumbnail_digest = Column(sql_types.String(64), nullable=True)
+
+    def __repr__(self):
+        return f"Document(title={self.title}, filename={self.filename})"
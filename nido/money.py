@@ -0,0 +1,220 @@
+#  Nido money.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Money as whole cents. Amounts are stored and added up as integers, in
+## SQL where possible, and only turned into text for display, using the
+## conventions of the community's country.
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+import sqlalchemy.types as sql_types
+
+import decimal
+import functools
+
+
+class MoneyFormat:
+    __slots__ = ("symbol", "group", "point", "suffix")
+
+    def __init__(self, symbol, group=",", point=".", suffix=False):
+        self.symbol = symbol
+        self.group = group
+        self.point = point
+        self.suffix = suffix
+
+    # Integer arithmetic and one f-string, with no Decimal or locale module.
+    # A symbol written after the number is kept on the same line with a
+    # no-break space.
+    def __call__(self, cents):
+        sign = "-" if cents < 0 else ""
+        whole, part = divmod(abs(int(cents)), 100)
+        number = f"{whole:,}".replace(",", self.group)
+        if self.suffix:
+            return f"{sign}{number}{self.point}{part:02}\xa0{self.symbol}"
+        return f"{sign}{self.symbol}{number}{self.point}{part:02}"
+
+
+DOLLARS = MoneyFormat("$")
+EUROS = MoneyFormat("€", ".", ",", suffix=True)
+
+# Keyed by ISO code and by name, lowercased, since Community.country is free
+# text. Countries not listed are shown in dollars.
+COUNTRY_FORMATS = {
+    "us": DOLLARS,
+    "united states": DOLLARS,
+    "ca": DOLLARS,
+    "canada": DOLLARS,
+    "au": DOLLARS,
+    "australia": DOLLARS,
+    "nz": DOLLARS,
+    "new zealand": DOLLARS,
+    "gb": MoneyFormat("£"),
+    "united kingdom": MoneyFormat("£"),
+    "ie": MoneyFormat("€"),
+    "ireland": MoneyFormat("€"),
+    "de": EUROS,
+    "germany": EUROS,
+    "es": EUROS,
+    "spain": EUROS,
+    "it": EUROS,
+    "italy": EUROS,
+    "nl": MoneyFormat("€", ".", ","),
+    "netherlands": MoneyFormat("€", ".", ","),
+    "fr": MoneyFormat("€", "\u202f", ",", suffix=True),
+    "france": MoneyFormat("€", "\u202f", ",", suffix=True),
+    "ch": MoneyFormat("CHF", "’", "."),
+    "switzerland": MoneyFormat("CHF", "’", "."),
+}
+
+
+def money_format(country):
+    return COUNTRY_FORMATS.get((country or "").strip().lower(), DOLLARS)
+
+
+@functools.total_ordering
+class Money:
+    __slots__ = ("cents",)
+
+    def __init__(self, cents):
+        self.cents = int(cents)
+
+    @classmethod
+    def from_decimal(cls, value):
+        cents = decimal.Decimal(str(value)).scaleb(2)
+        return cls(cents.to_integral_value(decimal.ROUND_HALF_UP))
+
+    @property
+    def decimal(self):
+        return decimal.Decimal(self.cents).scaleb(-2)
+
+    def format(self, money_format=DOLLARS):
+        return money_format(self.cents)
+
+    # Same as str() of the Decimal amount, so "$" + str(money) still works
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        whole, part = divmod(abs(self.cents), 100)
+        return f"{sign}{whole}.{part:02}"
+
+    def __repr__(self):
+        return f"Money({self.cents})"
+
+    def __int__(self):
+        return self.cents
+
+    def __hash__(self):
+        return hash(self.decimal)
+
+    # A bare int could mean dollars or cents, so apart from 0 (what sum()
+    # starts from) ints never equal Money and can't be compared or added to
+    # it; use Money(cents) or a Decimal amount
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.cents == other.cents
+        if isinstance(other, decimal.Decimal):
+            return self.decimal == other
+        if isinstance(other, int) and other == 0:
+            return self.cents == 0
+        return NotImplemented
+
+    def __lt__(self, other):
+        return self.cents < Money.coerce(other).cents
+
+    def __add__(self, other):
+        return Money(self.cents + Money.coerce(other).cents)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.coerce(other).cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __mul__(self, factor):
+        return Money(self.cents * factor)
+
+    __rmul__ = __mul__
+
+    def __bool__(self):
+        return self.cents != 0
+
+    @classmethod
+    def coerce(cls, value):
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, int):
+            if value == 0:
+                return cls(0)
+            raise TypeError(f"Ambiguous amount {value}: use Money(cents)")
+        return cls.from_decimal(value)
+
+
+## Data migration for ownership stakes, which were stored as text on SQLite
+## and NUMERIC elsewhere. They become integers scaled by STAKE_SCALE, so SUM,
+## AVG and range filters run in the database. Values are converted with
+## Decimal in Python on SQLite, since going through REAL would lose digits.
+def store_stakes_as_integers(conn, scale):
+    columns = {c["name"]: c for c in inspect(conn).get_columns("residence")}
+    if "ownership_stake" not in columns:
+        raise click.ClickException(
+            f"{conn.engine.url} has no residence.ownership_stake column"
+        )
+    column = columns["ownership_stake"]
+    if isinstance(column["type"], sql_types.Integer):
+        return False
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            "ALTER TABLE residence ALTER COLUMN ownership_stake TYPE BIGINT"
+            f" USING round(ownership_stake * {10 ** int(scale)})::bigint"
+        )
+        return True
+    rows = conn.exec_driver_sql(
+        "SELECT id, ownership_stake FROM residence" " WHERE ownership_stake IS NOT NULL"
+    ).all()
+    conn.exec_driver_sql(
+        "ALTER TABLE residence ADD COLUMN ownership_stake_fixed BIGINT"
+    )
+    if rows:
+        conn.execute(
+            text("UPDATE residence SET ownership_stake_fixed = :stake WHERE id = :id"),
+            [
+                {"stake": int(decimal.Decimal(str(stake)).scaleb(scale)), "id": id}
+                for id, stake in rows
+            ],
+        )
+    conn.exec_driver_sql("ALTER TABLE residence DROP COLUMN ownership_stake")
+    conn.exec_driver_sql(
+        "ALTER TABLE residence RENAME COLUMN ownership_stake_fixed TO ownership_stake"
+    )
+    return True
+
+
+money_cli = AppGroup("money", help="Fixed-point storage for stakes and amounts.")
+
+
+@money_cli.command("migrate-stakes")
+def migrate_stakes_command():
+    from .models import STAKE_SCALE
+    from .sharding import each_shard_session
+
+    for session in each_shard_session():
+        with session.get_bind().begin() as conn:
+            if store_stakes_as_integers(conn, STAKE_SCALE):
+                click.echo("Stored residence.ownership_stake as scaled integers")
+            else:
+                click.echo("residence.ownership_stake is already stored as integers")
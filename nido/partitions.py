@@ -0,0 +1,171 @@
+#  Nido partitions.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect, select
+
+from .models import BillingCharge, Community
+
+## Optional Postgres schema mode where billing_charge is partitioned on
+## community_id, either by hash into a fixed number of partitions or by list
+## with one partition per community. Queries that filter on
+## BillingCharge.community_id then only touch that community's partition.
+##
+## Migrating an existing database is two steps:
+##   flask partitions add-community-column   (any database)
+##   flask partitions migrate --method hash --count 16   (Postgres only)
+
+CHARGE_COLUMNS = ", ".join(c.name for c in BillingCharge.__table__.c)
+
+
+def add_community_column(conn):
+    columns = [c["name"] for c in inspect(conn).get_columns("billing_charge")]
+    if "community_id" in columns:
+        return False
+    conn.exec_driver_sql("ALTER TABLE billing_charge ADD COLUMN community_id INTEGER")
+    conn.exec_driver_sql(
+        "UPDATE billing_charge"
+        " SET community_id = COALESCE(u_community_id, r_community_id)"
+    )
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            "ALTER TABLE billing_charge ALTER COLUMN community_id SET NOT NULL"
+        )
+    return True
+
+
+def is_partitioned(conn):
+    return bool(
+        conn.exec_driver_sql(
+            "SELECT 1 FROM pg_partitioned_table p"
+            " JOIN pg_class c ON c.oid = p.partrelid"
+            " WHERE c.relname = 'billing_charge'"
+        ).scalar()
+    )
+
+
+def create_list_partition(conn, community_id):
+    # Any rows the community already has are sitting in the default
+    # partition, which Postgres won't allow once a matching partition exists,
+    # so move them into the new table before attaching it
+    name = f"billing_charge_c{int(community_id)}"
+    conn.exec_driver_sql(
+        f"CREATE TABLE {name}"
+        f" (LIKE billing_charge INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    conn.exec_driver_sql(
+        f"INSERT INTO {name} ({CHARGE_COLUMNS})"
+        f" SELECT {CHARGE_COLUMNS} FROM billing_charge_default"
+        f" WHERE community_id = {int(community_id)}"
+    )
+    conn.exec_driver_sql(
+        f"DELETE FROM billing_charge_default WHERE community_id = {int(community_id)}"
+    )
+    conn.exec_driver_sql(
+        f"ALTER TABLE billing_charge ATTACH PARTITION {name}"
+        f" FOR VALUES IN ({int(community_id)})"
+    )
+
+
+def partition_billing_charges(conn, method="hash", count=16):
+    if conn.dialect.name != "postgresql":
+        raise click.ClickException("Partitioning needs a Postgres database")
+    if is_partitioned(conn):
+        raise click.ClickException("billing_charge is already partitioned")
+    add_community_column(conn)
+
+    conn.exec_driver_sql(
+        "ALTER TABLE billing_charge RENAME TO billing_charge_unpartitioned"
+    )
+    partition_by = "HASH" if method == "hash" else "LIST"
+    conn.exec_driver_sql(
+        "CREATE TABLE billing_charge"
+        " (LIKE billing_charge_unpartitioned"
+        "  INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        f" PARTITION BY {partition_by} (community_id)"
+    )
+    # The partition key has to be part of the primary key
+    conn.exec_driver_sql(
+        "ALTER TABLE billing_charge ADD PRIMARY KEY (id, community_id)"
+    )
+    conn.exec_driver_sql(
+        "ALTER TABLE billing_charge ADD FOREIGN KEY (user_id, u_community_id)"
+        ' REFERENCES "user" (id, community_id)'
+    )
+    conn.exec_driver_sql(
+        "ALTER TABLE billing_charge ADD FOREIGN KEY (residence_id, r_community_id)"
+        " REFERENCES residence (id, community_id)"
+    )
+
+    if method == "hash":
+        for i in range(count):
+            conn.exec_driver_sql(
+                f"CREATE TABLE billing_charge_p{i} PARTITION OF billing_charge"
+                f" FOR VALUES WITH (MODULUS {count}, REMAINDER {i})"
+            )
+    else:
+        conn.exec_driver_sql(
+            "CREATE TABLE billing_charge_default PARTITION OF billing_charge DEFAULT"
+        )
+        for (community_id,) in conn.execute(select(Community.id)).all():
+            create_list_partition(conn, community_id)
+
+    conn.exec_driver_sql(
+        f"INSERT INTO billing_charge ({CHARGE_COLUMNS})"
+        f" SELECT {CHARGE_COLUMNS} FROM billing_charge_unpartitioned"
+    )
+    # The id sequence belongs to the old table and would be dropped with it
+    conn.exec_driver_sql(
+        "ALTER SEQUENCE IF EXISTS billing_charge_id_seq OWNED BY billing_charge.id"
+    )
+    conn.exec_driver_sql("DROP TABLE billing_charge_unpartitioned")
+    for index in BillingCharge.__table__.indexes:
+        index.create(conn)
+
+
+partitions_cli = AppGroup(
+    "partitions", help="Partition billing tables by community on Postgres."
+)
+
+
+@partitions_cli.command("add-community-column")
+def add_community_column_command():
+    with current_app.Session.get_bind().begin() as conn:
+        if add_community_column(conn):
+            click.echo("Added and filled billing_charge.community_id")
+        else:
+            click.echo("billing_charge.community_id already exists")
+
+
+@partitions_cli.command("migrate")
+@click.option("--method", type=click.Choice(["hash", "list"]), default="hash")
+@click.option("--count", type=int, default=16, help="Number of hash partitions")
+def migrate_command(method, count):
+    with current_app.Session.get_bind().begin() as conn:
+        partition_billing_charges(conn, method, count)
+    click.echo(f"Partitioned billing_charge by {method} on community_id")
+
+
+@partitions_cli.command("add-community")
+@click.argument("community_id", type=int)
+def add_community_command(community_id):
+    # Only needed with list partitioning; otherwise new communities' charges
+    # land in the default partition
+    with current_app.Session.get_bind().begin() as conn:
+        create_list_partition(conn, community_id)
+    click.echo(f"Created billing_charge partition for community {community_id}")
@@ -22,6 +22,7 @@ class Permissions(Flag):
     MODIFY_BILLING_SETTINGS = auto()
     MODIFY_REPORTING_SETTINGS = auto()
     READ_ER_CONTACTS = auto()
+    MODIFY_DOCUMENTS = auto()
 
     def __bool__(self):
         return bool(self.value)
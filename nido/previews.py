@@ -0,0 +1,66 @@
+#  Nido previews.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import shutil
+import subprocess
+
+PREVIEW_CHARS = 2000
+THUMBNAIL_SIZE = (256, 256)
+
+
+## These run in the app's preview process pool, so they only take and return
+## plain picklable values and never touch the app or the database
+
+
+def text_preview(path, mimetype):
+    if mimetype and mimetype.startswith("text/"):
+        with open(path, "r", errors="replace") as text_file:
+            return text_file.read(PREVIEW_CHARS)
+    elif mimetype == "application/pdf" and shutil.which("pdftotext"):
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-l", "2", path, "-"],
+                capture_output=True,
+                timeout=60,
+            )
+        except subprocess.TimeoutExpired:
+            return None
+        if result.returncode == 0:
+            return result.stdout.decode(errors="replace")[:PREVIEW_CHARS]
+    return None
+
+
+def thumbnail(path, mimetype):
+    if not mimetype or not mimetype.startswith("image/"):
+        return None
+    try:
+        # Pillow is optional; without it documents just have no thumbnail
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            out = io.BytesIO()
+            image.convert("RGB").save(out, format="JPEG")
+    except OSError:
+        return None
+    return out.getvalue()
+
+
+def make_preview(path, mimetype):
+    return (text_preview(path, mimetype), thumbnail(path, mimetype))
@@ -0,0 +1,117 @@
+#  Nido projections.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Read-only views of rows for the listing pages. These select only the
+## columns a table shows and map each Row into a small __slots__ object with
+## the display fields worked out once, so rendering a long list of charges
+## doesn't pay for identity-map bookkeeping, change tracking or a Decimal
+## per amount. Anything that needs to modify a row should load the model.
+
+from .models import BillingCharge, RecurringCharge, ResidenceOccupancy, User
+
+
+def format_cents(cents):
+    # Same output as f"${Decimal('.01') * cents}" without building a Decimal
+    sign = "-" if cents < 0 else ""
+    whole, part = divmod(abs(cents), 100)
+    return f"${sign}{whole}.{part:02}"
+
+
+class ChargeView:
+    __slots__ = ("id", "name", "charge_date", "due_date", "formatted_amount", "overdue")
+    columns = (
+        BillingCharge.id,
+        BillingCharge.name,
+        BillingCharge.base_amount,
+        BillingCharge.charge_date,
+        BillingCharge.due_date,
+    )
+
+    def __init__(self, row, today, money_format=format_cents):
+        self.id, self.name, base_amount, self.charge_date, self.due_date = row
+        self.formatted_amount = money_format(base_amount)
+        self.overdue = self.due_date <= today
+
+
+class RecurringChargeView:
+    __slots__ = ("id", "name", "next_charge", "formatted_amount")
+    columns = (
+        RecurringCharge.id,
+        RecurringCharge.name,
+        RecurringCharge.base_amount,
+        RecurringCharge.next_charge,
+    )
+
+    def __init__(self, row, money_format=format_cents):
+        self.id, self.name, base_amount, self.next_charge = row
+        self.formatted_amount = money_format(base_amount)
+
+
+class ResidentView:
+    __slots__ = ("personal_name", "family_name", "phone", "email")
+    # The residence id comes first so rows can be grouped onto listings
+    columns = (
+        ResidenceOccupancy.residence_id,
+        User.personal_name,
+        User.family_name,
+        User.phone,
+        User.email,
+    )
+
+    def __init__(self, row):
+        _, self.personal_name, self.family_name, self.phone, self.email = row
+
+
+class ListingView:
+    __slots__ = ("id", "street", "unit_no", "occupants")
+
+    def __init__(self, row):
+        self.id, self.street, self.unit_no = row
+        self.occupants = []
+
+
+## These take an iterable of rows and yield views one at a time, so a
+## listing fed by a yield_per result never holds more than a batch of rows.
+## money_format is the community's (see nido.money); views pass
+## get_money_format().
+def charge_views(rows, today, money_format=format_cents):
+    return (ChargeView(row, today, money_format) for row in rows)
+
+
+def recurring_charge_views(rows, money_format=format_cents):
+    return (RecurringChargeView(row, money_format) for row in rows)
+
+
+def listing_views(listing_rows, resident_rows):
+    listings = {row[0]: ListingView(row) for row in listing_rows}
+    for row in resident_rows:
+        listings[row[0]].occupants.append(ResidentView(row))
+    return list(listings.values())
+
+
+def grouped_listing_views(rows):
+    # Rows are a residence's columns followed by ResidentView.columns, from
+    # an outer join ordered so that each residence's rows are together
+    listing = None
+    for row in rows:
+        if listing is None or listing.id != row[0]:
+            if listing is not None:
+                yield listing
+            listing = ListingView(row[:3])
+        if row[3] is not None:
+            listing.occupants.append(ResidentView(row[3:]))
+    if listing is not None:
+        yield listing
@@ -0,0 +1,454 @@
+#  Nido reconciliation.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+## Matching bank statement payments to open charges. The community's unpaid
+## charges are loaded once into hash indexes keyed by id, by payer and
+## amount, and by amount and due date, then the statement is read a row at a
+## time and each payment costs a handful of dict lookups however many charges
+## are open. Only matches that can't reasonably mean anything else are
+## applied; everything else comes back for an admin to review. Every payment
+## is recorded, and one seen again in a later upload is reported as already
+## reconciled, or sent back to review, instead of being matched a second time.
+
+import click
+from flask.cli import AppGroup
+
+from .models import BillingCharge, ReconciledPayment, ResidenceOccupancy, User
+from .sharding import each_shard_session
+from .streaming import STREAM_BATCH
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+from sqlalchemy import inspect
+from sqlalchemy.sql import bindparam, insert, select, update
+import csv
+import decimal
+import hashlib
+import io
+import re
+
+# How long before a charge is issued a payment for it may arrive, and how far
+# from the due date an amount-only suggestion may be
+DATE_TOLERANCE = timedelta(days=7)
+# Payers with at most this many open charges get every combination of them
+# tried for a combined payment
+MAX_COMBINED = 10
+# Invoices ask payers to quote the charge as NIDO-<id>
+REFERENCE = re.compile(r"\bNIDO-?(\d+)\b", re.IGNORECASE)
+
+# Header names banks use for each field, compared lowercased
+STATEMENT_COLUMNS = {
+    "date": ("date", "posted", "posting date", "transaction date"),
+    "amount": ("amount", "credit", "deposit"),
+    "payer": ("payer", "name", "description"),
+    "reference": ("reference", "ref", "memo"),
+    "transaction_id": ("transaction id", "transaction", "fitid", "id"),
+}
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d %b %Y")
+
+
+class StatementError(Exception):
+    pass
+
+
+def payer_key(name):
+    # "THOM, RUDD" and "Rudd Thom" are the same payer
+    return " ".join(sorted(re.findall(r"[a-z]+", name.lower())))
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def parse_amount(value):
+    cents = decimal.Decimal(value.strip().replace(",", "").replace("$", "")) * 100
+    return int(cents.to_integral_value(decimal.ROUND_HALF_UP))
+
+
+class Payment:
+    __slots__ = ("line", "paid_on", "amount", "payer", "reference", "fingerprint")
+
+    def __init__(self, line, paid_on, amount, payer, reference, fingerprint=None):
+        self.line = line
+        self.paid_on = paid_on
+        self.amount = amount
+        self.payer = payer
+        self.reference = reference
+        self.fingerprint = fingerprint
+
+
+def fingerprint(parts):
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+## Yields a Payment for each credit on the statement as it is read. Lines
+## that can't be parsed are added to skipped rather than stopping the import;
+## debits are ignored.
+def read_statement(stream, skipped):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for field, names in STATEMENT_COLUMNS.items():
+        columns[field] = next((header.index(n) for n in names if n in header), None)
+    if columns["date"] is None or columns["amount"] is None:
+        raise StatementError("The statement has no date or amount column")
+
+    def field(row, name):
+        return "" if columns[name] is None else row[columns[name]].strip()
+
+    # Without a transaction id, identical payments on one day are told apart
+    # by which of them it is on the statement, which doesn't change when a
+    # later statement overlaps this one
+    occurrences = Counter()
+    for line, row in enumerate(reader, start=2):
+        if not any(row):
+            continue
+        try:
+            payment = Payment(
+                line,
+                parse_date(field(row, "date")),
+                parse_amount(field(row, "amount")),
+                field(row, "payer"),
+                field(row, "reference"),
+            )
+            transaction_id = field(row, "transaction_id")
+        except (IndexError, ValueError, decimal.InvalidOperation):
+            skipped.append(line)
+            continue
+        if payment.amount <= 0:
+            continue
+        if transaction_id:
+            payment.fingerprint = fingerprint(("id", transaction_id))
+        else:
+            details = (
+                payment.paid_on,
+                payment.amount,
+                payer_key(payment.payer),
+                payment.reference.lower(),
+            )
+            occurrences[details] += 1
+            payment.fingerprint = fingerprint(details + (occurrences[details],))
+        yield payment
+
+
+class OpenCharge:
+    __slots__ = ("id", "amount", "charge_date", "due_date", "payers")
+    columns = (
+        BillingCharge.id,
+        BillingCharge.base_amount,
+        BillingCharge.charge_date,
+        BillingCharge.due_date,
+        BillingCharge.residence_id,
+        User.personal_name,
+        User.family_name,
+    )
+
+    def __init__(self, row, occupants):
+        (self.id, self.amount, self.charge_date, self.due_date) = row[:4]
+        residence_id, personal_name, family_name = row[4:]
+        if residence_id is None:
+            self.payers = (payer_key(f"{personal_name} {family_name}"),)
+        else:
+            self.payers = occupants.get(residence_id, ())
+
+
+## Oldest first, so that when a payer owes the same amount several times the
+## earliest charge is the one that gets paid.
+def open_charges(session, community_id):
+    occupants = defaultdict(tuple)
+    for residence_id, personal_name, family_name in session.execute(
+        select(ResidenceOccupancy.residence_id, User.personal_name, User.family_name)
+        .join(User, User.id == ResidenceOccupancy.user_id)
+        .where(User.community_id == community_id)
+    ):
+        occupants[residence_id] += (payer_key(f"{personal_name} {family_name}"),)
+    rows = session.execute(
+        select(*OpenCharge.columns)
+        .outerjoin(User, User.id == BillingCharge.user_id)
+        .where(BillingCharge.community_id == community_id, BillingCharge.paid == False)
+        .order_by(BillingCharge.due_date, BillingCharge.id)
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+    return (OpenCharge(row, occupants) for row in rows)
+
+
+class Match:
+    __slots__ = ("payment", "charge_ids", "reason")
+
+    # reason is None for payments that need review, with any likely charges
+    # in charge_ids as suggestions
+    def __init__(self, payment, charge_ids, reason=None):
+        self.payment = payment
+        self.charge_ids = charge_ids
+        self.reason = reason
+
+
+class Reconciler:
+    # Each index maps to an insertion-ordered dict of charges so a claimed
+    # charge can be dropped from all of them in constant time.
+    def __init__(self, charges, tolerance=DATE_TOLERANCE):
+        self.tolerance = tolerance
+        self.by_id = {}
+        self.by_payer = defaultdict(dict)
+        self.by_payer_amount = defaultdict(dict)
+        self.by_amount_due = defaultdict(dict)
+        for charge in charges:
+            self.by_id[charge.id] = charge
+            for payer in charge.payers:
+                self.by_payer[payer][charge.id] = charge
+                self.by_payer_amount[payer, charge.amount][charge.id] = charge
+            self.by_amount_due[charge.amount, charge.due_date][charge.id] = charge
+
+    def claim(self, payment, charges, reason):
+        for charge in charges:
+            del self.by_id[charge.id]
+            for payer in charge.payers:
+                del self.by_payer[payer][charge.id]
+                del self.by_payer_amount[payer, charge.amount][charge.id]
+            del self.by_amount_due[charge.amount, charge.due_date][charge.id]
+        return Match(payment, [charge.id for charge in charges], reason)
+
+    def issued_by(self, charge, payment):
+        return charge.charge_date - self.tolerance <= payment.paid_on
+
+    def match(self, payment):
+        reference = REFERENCE.search(f"{payment.reference} {payment.payer}")
+        if reference:
+            charge = self.by_id.get(int(reference[1]))
+            if charge is not None and charge.amount == payment.amount:
+                return self.claim(payment, [charge], "reference")
+            if charge is not None:
+                return Match(payment, [charge.id])
+
+        payer = payer_key(payment.payer)
+        for charge in self.by_payer_amount.get((payer, payment.amount), {}).values():
+            if self.issued_by(charge, payment):
+                return self.claim(payment, [charge], "payer")
+
+        subsets = self.combined(payment, payer)
+        if len(subsets) == 1:
+            return self.claim(payment, subsets[0], "combined")
+        if subsets:
+            return Match(payment, [charge.id for charge in subsets[0]])
+
+        suggestions = []
+        for days in range(-self.tolerance.days, self.tolerance.days + 1):
+            due_date = payment.paid_on + timedelta(days=days)
+            suggestions += self.by_amount_due.get((payment.amount, due_date), {})
+        return Match(payment, suggestions[:3])
+
+    ## A payment covering several charges usually clears the payer's oldest
+    ## ones, so that is tried first, then any two charges (a hash lookup per
+    ## charge for the other half). Payers with only a few open charges get an
+    ## exhaustive search; for anyone else that would be exponential.
+    def combined(self, payment, payer):
+        candidates = [
+            charge
+            for charge in self.by_payer.get(payer, {}).values()
+            if self.issued_by(charge, payment)
+        ]
+        total = 0
+        for count, charge in enumerate(candidates, start=1):
+            total += charge.amount
+            if total >= payment.amount:
+                if total == payment.amount and count > 1:
+                    return [candidates[:count]]
+                break
+        if len(candidates) <= MAX_COMBINED:
+            return combined_subsets(candidates, payment.amount)
+        pairs = {}
+        for charge in candidates:
+            remainder = payment.amount - charge.amount
+            others = self.by_payer_amount.get((payer, remainder), {})
+            for other in others.values():
+                if other is not charge and self.issued_by(other, payment):
+                    pairs.setdefault(
+                        tuple(sorted((charge.amount, remainder))), [charge, other]
+                    )
+                    break
+            if len(pairs) > 1:
+                break
+        return list(pairs.values())
+
+
+## Subsets of charges adding up to exactly amount, as a table of the sums
+## reachable so far with the first subset found for each. Subsets that differ
+## only in which of two equal charges they use count once, since the older
+## one is taken either way. Stops at two genuinely different answers, which
+## is enough to know the payment is ambiguous.
+def combined_subsets(charges, amount):
+    if sum(charge.amount for charge in charges) < amount:
+        return []
+    reachable = {0: ()}
+    found = {}
+    for charge in charges:
+        for total, subset in list(reachable.items()):
+            total += charge.amount
+            if total == amount and len(subset) > 0:
+                amounts = tuple(sorted(c.amount for c in subset + (charge,)))
+                found.setdefault(amounts, subset + (charge,))
+                if len(found) > 1:
+                    return list(found.values())
+            elif total < amount and total not in reachable:
+                reachable[total] = subset + (charge,)
+    return list(found.values())
+
+
+## Marks the matched charges paid in the session's transaction. Charges paid
+## since the statement was matched are left as they are.
+def apply_matches(session, community_id, charge_ids):
+    if not charge_ids:
+        return 0
+    result = session.connection().execute(
+        update(BillingCharge.__table__)
+        .where(
+            BillingCharge.id == bindparam("charge_id"),
+            BillingCharge.community_id == community_id,
+            BillingCharge.paid == False,
+        )
+        .values(paid=True),
+        [{"charge_id": charge_id} for charge_id in charge_ids],
+    )
+    return result.rowcount
+
+
+## Maps each fingerprint already recorded for the community to whether it
+## has been settled.
+def already_reconciled(session, community_id, fingerprints):
+    return dict(
+        session.execute(
+            select(ReconciledPayment.fingerprint, ReconciledPayment.resolved).where(
+                ReconciledPayment.community_id == community_id,
+                ReconciledPayment.fingerprint.in_(fingerprints),
+            )
+        ).all()
+    )
+
+
+def record_payments(session, community_id, payments, resolved):
+    if payments:
+        session.execute(
+            insert(ReconciledPayment),
+            [
+                {
+                    "community_id": community_id,
+                    "fingerprint": payment.fingerprint,
+                    "paid_on": payment.paid_on,
+                    "amount": payment.amount,
+                    "resolved": resolved,
+                }
+                for payment in payments
+            ],
+        )
+
+
+## Marks payments that were left for review as settled by hand, so a later
+## upload reports them as already reconciled.
+def resolve_payments(session, community_id, fingerprints):
+    if fingerprints:
+        session.execute(
+            update(ReconciledPayment)
+            .where(
+                ReconciledPayment.community_id == community_id,
+                ReconciledPayment.fingerprint.in_(fingerprints),
+            )
+            .values(resolved=True)
+        )
+
+
+## Every payment read is recorded: matched ones as settled, the rest as
+## waiting for review. A payment still waiting from an earlier upload goes
+## back to review rather than being matched, since the admin may already have
+## paid its charges by hand. The statement is looked up and applied a batch
+## of lines at a time.
+def reconcile(session, community_id, stream, tolerance=DATE_TOLERANCE):
+    skipped = []
+    payments = read_statement(stream, skipped)
+    reconciler = Reconciler(open_charges(session, community_id), tolerance)
+    matched, review, repeated = [], [], []
+    uploaded = set()
+    while batch := list(islice(payments, STREAM_BATCH)):
+        known = already_reconciled(
+            session, community_id, [payment.fingerprint for payment in batch]
+        )
+        batch_matched, batch_review = [], []
+        for payment in batch:
+            if known.get(payment.fingerprint) or payment.fingerprint in uploaded:
+                repeated.append(payment)
+                continue
+            uploaded.add(payment.fingerprint)
+            match = reconciler.match(payment)
+            if payment.fingerprint in known:
+                batch_review.append(Match(payment, match.charge_ids))
+            else:
+                (batch_matched if match.reason else batch_review).append(match)
+        apply_matches(
+            session,
+            community_id,
+            [charge_id for match in batch_matched for charge_id in match.charge_ids],
+        )
+        record_payments(
+            session, community_id, [match.payment for match in batch_matched], True
+        )
+        record_payments(
+            session,
+            community_id,
+            [
+                match.payment
+                for match in batch_review
+                if match.payment.fingerprint not in known
+            ],
+            False,
+        )
+        matched += batch_matched
+        review += batch_review
+    return matched, review, skipped, repeated
+
+
+## For databases created before payments left for review were recorded
+def add_reconciled_payments_table(conn):
+    if not inspect(conn).has_table(ReconciledPayment.__tablename__):
+        ReconciledPayment.__table__.create(conn)
+        return True
+    columns = [c["name"] for c in inspect(conn).get_columns("reconciled_payment")]
+    if "resolved" in columns:
+        return False
+    conn.exec_driver_sql(
+        "ALTER TABLE reconciled_payment"
+        " ADD COLUMN resolved BOOLEAN NOT NULL DEFAULT TRUE"
+    )
+    return True
+
+
+reconciliation_cli = AppGroup(
+    "reconciliation", help="Match bank statement payments to charges."
+)
+
+
+@reconciliation_cli.command("migrate")
+def migrate_command():
+    for session in each_shard_session():
+        with session.get_bind().begin() as conn:
+            if add_reconciled_payments_table(conn):
+                click.echo("Updated the reconciled_payment table")
+            else:
+                click.echo("The reconciled_payment table is up to date")
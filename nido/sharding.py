@@ -0,0 +1,340 @@
+#  Nido sharding.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import time
+
+import click
+from flask import current_app, has_request_context, session
+from flask.cli import AppGroup
+from sqlalchemy import Column, MetaData, Table, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import sqlalchemy.types as sql_types
+
+from .cache import memoize
+from .models import Base
+
+## The directory database (DATABASE_URL when DATABASE_SHARDS is set) only
+## knows which shard holds each community, and which community each login
+## email belongs to. Everything else lives on the community's shard.
+directory_metadata = MetaData()
+
+community_shard = Table(
+    "community_shard",
+    directory_metadata,
+    Column("community_id", sql_types.Integer, primary_key=True),
+    Column("shard", sql_types.String(40), nullable=False),
+)
+
+user_directory = Table(
+    "user_directory",
+    directory_metadata,
+    Column("email", sql_types.String(80), primary_key=True),
+    Column("community_id", sql_types.Integer, nullable=False),
+)
+
+
+## Communities being moved to another shard. Their writes are refused
+## until every worker routes them to the new shard.
+community_move = Table(
+    "community_move",
+    directory_metadata,
+    Column("community_id", sql_types.Integer, primary_key=True),
+    Column("target", sql_types.String(40), nullable=False),
+)
+
+SHARD_TTL = 5 * 60
+
+
+class CommunityMoving(Exception):
+    pass
+
+
+@memoize("community_shard", ttl=SHARD_TTL)
+def shard_for(community_id):
+    with current_app.directory_engine.connect() as conn:
+        return conn.execute(
+            select(community_shard.c.shard).where(
+                community_shard.c.community_id == community_id
+            )
+        ).scalar()
+
+
+def locate_user(email):
+    with current_app.directory_engine.connect() as conn:
+        return conn.execute(
+            select(user_directory.c.community_id).where(user_directory.c.email == email)
+        ).scalar()
+
+
+class ShardedSession(Session):
+    # Binds to the shard of the community in the browser's session, which is
+    # set at login. Code that runs outside a request (like the CLI) sets
+    # info["community_id"] instead.
+    def __init__(self, directory, shards, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.shards = shards
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        community_id = self.info.get("community_id")
+        if community_id is None and has_request_context():
+            community_id = session.get("community_id")
+        if community_id is None:
+            return self.directory
+        if self._flushing or (clause is not None and clause.is_dml):
+            # Not cached, so a move blocks writes as soon as it starts
+            with self.directory.connect() as conn:
+                moving = conn.execute(
+                    select(community_move.c.target).where(
+                        community_move.c.community_id == community_id
+                    )
+                ).scalar()
+            if moving is not None:
+                raise CommunityMoving(community_id)
+        return self.shards[shard_for(community_id)]
+
+
+## Jobs that cover every community (like charging late fees) run once per
+## shard. Without shards that is just the usual session.
+def each_shard_session():
+    if current_app.shards is None:
+        yield current_app.Session()
+        return
+    for engine in current_app.shards.values():
+        with Session(bind=engine) as shard_session:
+            yield shard_session
+
+
+## Moving a community copies every row it owns to the target shard and
+## checks the copy before the directory is switched over
+def community_filter(table, community_id):
+    cols = table.c
+    if table.name == "community":
+        return cols.id == community_id
+    elif "community_id" in cols:
+        return cols.community_id == community_id
+    elif "u_community_id" in cols:
+        return (cols.u_community_id == community_id) | (
+            cols.r_community_id == community_id
+        )
+    elif "user_id" in cols:
+        users = Base.metadata.tables["user"]
+        return cols.user_id.in_(
+            select(users.c.id).where(users.c.community_id == community_id)
+        )
+    raise ValueError(f"Don't know how {table.name} belongs to a community")
+
+
+def table_rows(conn, table, community_id):
+    return [
+        tuple(row)
+        for row in conn.execute(
+            select(table)
+            .where(community_filter(table, community_id))
+            .order_by(*table.primary_key.columns)
+        )
+    ]
+
+
+def rows_digest(rows):
+    sha = hashlib.sha256()
+    for row in rows:
+        sha.update(repr(row).encode())
+    return sha.hexdigest()
+
+
+def move_community(community_id, source, target, batch_size=1000):
+    tables = Base.metadata.sorted_tables
+    with source.connect() as src, target.begin() as dst:
+        copied = {}
+        for table in tables:
+            rows = table_rows(src, table, community_id)
+            if not rows:
+                continue
+            # Primary keys are only unique per shard, so refuse to move into a
+            # shard that has already used any of these ids
+            pk = list(table.primary_key.columns)
+            if len(pk) == 1:
+                pk_index = list(table.c).index(pk[0])
+                ids = [row[pk_index] for row in rows]
+                clash = dst.execute(
+                    select(pk[0]).where(pk[0].in_(ids)).limit(1)
+                ).scalar()
+                if clash is not None:
+                    raise click.ClickException(
+                        f"{table.name} id {clash} already exists on the target"
+                    )
+            keys = [c.key for c in table.c]
+            for start in range(0, len(rows), batch_size):
+                dst.execute(
+                    table.insert(),
+                    [dict(zip(keys, row)) for row in rows[start : start + batch_size]],
+                )
+            copied[table.name] = (len(rows), rows_digest(rows))
+
+        for table in tables:
+            if table.name not in copied:
+                continue
+            rows = table_rows(dst, table, community_id)
+            if (len(rows), rows_digest(rows)) != copied[table.name]:
+                raise click.ClickException(f"Copy of {table.name} does not match")
+    return copied
+
+
+def delete_community(engine, community_id):
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete().where(community_filter(table, community_id)))
+
+
+shards_cli = AppGroup("shards", help="Manage per-community database shards.")
+
+
+@shards_cli.command("init")
+def init_command():
+    directory_metadata.create_all(current_app.directory_engine)
+    for (name, engine) in current_app.shards.items():
+        Base.metadata.create_all(engine)
+        click.echo(f"Created tables on {name}")
+
+
+@shards_cli.command("assign")
+@click.argument("community_id", type=int)
+@click.argument("shard")
+def assign_command(community_id, shard):
+    if shard not in current_app.shards:
+        raise click.ClickException(f"No shard named {shard}")
+    with current_app.directory_engine.begin() as conn:
+        conn.execute(
+            community_shard.delete().where(
+                community_shard.c.community_id == community_id
+            )
+        )
+        conn.execute(
+            community_shard.insert(), {"community_id": community_id, "shard": shard}
+        )
+    shard_for.invalidate(community_id)
+
+
+@shards_cli.command("rebuild-directory")
+def rebuild_directory_command():
+    users = Base.metadata.tables["user"]
+    with current_app.directory_engine.begin() as conn:
+        conn.execute(user_directory.delete())
+        for engine in current_app.shards.values():
+            with engine.connect() as shard_conn:
+                entries = [
+                    {"email": row.email, "community_id": row.community_id}
+                    for row in shard_conn.execute(
+                        select(users.c.email, users.c.community_id).where(
+                            users.c.email.isnot(None)
+                        )
+                    )
+                ]
+            if entries:
+                conn.execute(user_directory.insert(), entries)
+
+
+def routing_lifetime(config):
+    # How long a worker might keep routing to the old shard: cached entries
+    # live at most CACHE_LOCAL_TTL in every mode (see make_cache), and the
+    # shared Redis entry is deleted by the move itself
+    if config.get("CACHE_TYPE") == "null":
+        return 0
+    return min(SHARD_TTL, config.get("CACHE_LOCAL_TTL", 30))
+
+
+## A move blocks the community's writes, waits for writes already under way,
+## copies and checks the rows, points the directory at the target and then
+## keeps writes blocked until no worker can still be using the old shard.
+## The source copy is left in place for delete-moved to remove later.
+@shards_cli.command("move-community")
+@click.argument("community_id", type=int)
+@click.argument("target")
+@click.option(
+    "--settle",
+    type=float,
+    default=5,
+    help="Seconds to let writes that started before the move finish",
+)
+def move_community_command(community_id, target, settle):
+    source = shard_for(community_id)
+    if source is None:
+        raise click.ClickException(f"Community {community_id} has no shard")
+    if target not in current_app.shards:
+        raise click.ClickException(f"No shard named {target}")
+    if source == target:
+        raise click.ClickException(f"Community {community_id} is already on {target}")
+    directory = current_app.directory_engine
+    try:
+        with directory.begin() as conn:
+            conn.execute(
+                community_move.insert(),
+                {"community_id": community_id, "target": target},
+            )
+    except IntegrityError:
+        raise click.ClickException(f"Community {community_id} is already moving")
+    try:
+        time.sleep(settle)
+        copied = move_community(
+            community_id, current_app.shards[source], current_app.shards[target]
+        )
+        with directory.begin() as conn:
+            conn.execute(
+                community_shard.update()
+                .where(community_shard.c.community_id == community_id)
+                .values(shard=target)
+            )
+        shard_for.invalidate(community_id)
+        time.sleep(routing_lifetime(current_app.config))
+    finally:
+        with directory.begin() as conn:
+            conn.execute(
+                community_move.delete().where(
+                    community_move.c.community_id == community_id
+                )
+            )
+    for (table, (count, _digest)) in copied.items():
+        click.echo(f"{table}: {count} rows")
+    click.echo(f"Moved community {community_id} from {source} to {target}")
+    click.echo(f"Run delete-moved {community_id} {source} to remove the old copy")
+
+
+@shards_cli.command("delete-moved")
+@click.argument("community_id", type=int)
+@click.argument("shard")
+def delete_moved_command(community_id, shard):
+    if shard not in current_app.shards:
+        raise click.ClickException(f"No shard named {shard}")
+    with current_app.directory_engine.connect() as conn:
+        current = conn.execute(
+            select(community_shard.c.shard).where(
+                community_shard.c.community_id == community_id
+            )
+        ).scalar()
+        moving = conn.execute(
+            select(community_move.c.target).where(
+                community_move.c.community_id == community_id
+            )
+        ).scalar()
+    if current is None or current == shard or moving is not None:
+        raise click.ClickException(
+            f"Community {community_id} still lives on {shard} or is being moved"
+        )
+    delete_community(current_app.shards[shard], community_id)
+    click.echo(f"Deleted community {community_id} from {shard}")
@@ -0,0 +1,124 @@
+/*  Nido fragments.js
+ *  Copyright (C) 2022 John Arnold
+ *
+ *  This program is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU Affero General Public License as published
+ *  by the Free Software Foundation, either version 3 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU Affero General Public License for more details.
+ *
+ *  You should have received a copy of the GNU Affero General Public License
+ *  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ */
+
+/* Submit marked forms in the background and patch the table in place with
+ * the rows the server sends back, instead of reloading the page. Without
+ * this script the forms post and redirect as usual.
+ *
+ *   data-fragment-append="<tbody id>"  add the returned rows to that table,
+ *                                      before the first row with a later
+ *                                      data-order, if rows have one
+ *   data-fragment-remove               remove the row the form is in
+ *
+ * Failures, including a redirect to the login page, are shown next to the
+ * form rather than retried, since the server may already have acted.
+ *
+ * Elements marked data-fragment-load="<url>" are replaced with what that URL
+ * returns once the page has loaded; if it can't be fetched, whatever they
+ * held (usually a link to the full page) stays.
+ */
+function showError(form, message) {
+  let error = form.querySelector(".fragment-error");
+  if (!message) {
+    if (error) {
+      error.remove();
+    }
+    return;
+  }
+  if (!error) {
+    error = document.createElement("span");
+    error.className = "fragment-error";
+    error.setAttribute("role", "alert");
+    form.append(error);
+  }
+  error.textContent = message;
+}
+
+document.addEventListener("submit", async (event) => {
+  const form = event.target;
+  const target = form.dataset.fragmentAppend;
+  const remove = form.hasAttribute("data-fragment-remove");
+  if (!target && !remove) {
+    return;
+  }
+  event.preventDefault();
+  let response;
+  try {
+    response = await fetch(form.action, {
+      method: "POST",
+      body: new FormData(form),
+      headers: { "Nido-Fragment": "1" },
+      credentials: "same-origin",
+      // A redirect here is the login page after the session has expired,
+      // not the page the form would have gone to
+      redirect: "manual",
+    });
+  } catch (error) {
+    // The connection can fail after the server has done the work, so the
+    // form isn't sent again
+    showError(
+      form,
+      "The server could not be reached. Reload the page to see whether this was saved."
+    );
+    return;
+  }
+  if (response.type === "opaqueredirect") {
+    showError(form, "Not saved: you have been logged out. Reload the page to log in.");
+    return;
+  }
+  if (!response.ok) {
+    // The server may have done part of the work already; sending the form
+    // again could do it twice
+    showError(
+      form,
+      `Not saved: the server answered ${response.status} ${response.statusText}`
+    );
+    return;
+  }
+  showError(form, null);
+  if (remove) {
+    form.closest("tr").remove();
+    return;
+  }
+  const tbody = document.getElementById(target);
+  const template = document.createElement("template");
+  template.innerHTML = await response.text();
+  for (const row of template.content.querySelectorAll("tr")) {
+    const later = row.dataset.order === undefined ? null : Array.from(
+      tbody.rows
+    ).find((other) => other.dataset.order > row.dataset.order);
+    tbody.insertBefore(row, later || null);
+  }
+  form.reset();
+});
+
+document.addEventListener("DOMContentLoaded", () => {
+  for (const element of document.querySelectorAll("[data-fragment-load]")) {
+    fetch(element.dataset.fragmentLoad, {
+      headers: { "Nido-Fragment": "1" },
+      credentials: "same-origin",
+      redirect: "manual",
+    })
+      .then((response) => (response.ok ? response.text() : null))
+      .then((html) => {
+        if (html !== null) {
+          element.innerHTML = html;
+        }
+      })
+      .catch(() => {});
+  }
+});
@@ -0,0 +1,48 @@
+#  Nido streaming.py
+#  Copyright (C) 2022 John Arnold
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from flask import Response, current_app, render_template, stream_with_context
+
+# Rows fetched from the database at a time while a listing is streamed
+STREAM_BATCH = 500
+
+
+## Flask 2.0 has no stream_template, so this does the same: render the
+## template as a generator, so the head and navigation are sent before the
+## first row has been fetched and rows go out as they are read. The request
+## context (and with it the database session) stays open until the last
+## chunk is sent.
+def stream_template(template_name, **context):
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    response = Response(stream_with_context(template.generate(context)))
+    # Otherwise nginx collects the whole response before passing it on
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+## Long listings stream when STREAM_LISTINGS is set. Their views pass
+## iterators over yield_per results either way, so the only difference is
+## whether the page is built up in memory before it's sent.
+def streaming_listings():
+    return current_app.config.get("STREAM_LISTINGS", False)
+
+
+def render_listing(template_name, **context):
+    if streaming_listings():
+        return stream_template(template_name, **context)
+    return render_template(template_name, **context)
@@ -1,9 +1,13 @@
 import pytest
+import tempfile
+
+from flask import g
 
 
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 from nido import create_app
+from nido.loading import enforce_planned_loading
 from nido.models import Base
 from mock_data import seed_db
 
@@ -15,6 +19,11 @@ def app():
             "TESTING": True,
             "DATABASE_URL": "sqlite:///:memory:",
             "SECRET_KEY": "VERY_SECRET",
+            "ISSUE_WORKERS": 0,
+            "PREVIEW_WORKERS": 0,
+            "CACHE_TYPE": "null",
+            "RAISE_ON_LAZY_LOAD": True,
+            "FILE_STORE": tempfile.mkdtemp(),
         }
     )
 
@@ -42,8 +51,8 @@ def db(app):
 def session(db):
     connection = db.get_bind().connect()
     transaction = connection.begin()
-    yield scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=connection)
+    yield enforce_planned_loading(
+        scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=connection))
     )
     transaction.rollback()
     connection.close()
@@ -52,4 +61,8 @@ def session(db):
 @pytest.fixture(scope="function")
 def client(app, session):
     app.Session = session
+    # Requests reuse the application context pushed above, and with it g, so
+    # drop whatever the previous test's requests cached there (such as the
+    # logged in user)
+    vars(g).clear()
     return app.test_client()
@@ -0,0 +1,181 @@
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from nido.models import (
+    BillingCharge,
+    Group,
+    Role,
+    Community,
+    EmergencyContact,
+    RecurringCharge,
+    Residence,
+    ResidenceOccupancy,
+    User,
+    UserSession,
+    Frequency,
+    user_groups,
+)
+from nido.permissions import Permissions
+
+# SQLite reports a full table scan as "SCAN <table>", while index use shows
+# up as "SEARCH <table> USING ..." or "SCAN <table> USING ... INDEX ...".
+# Scans of anon_N subqueries are of already filtered and limited rows.
+FULL_SCAN = re.compile(r"^SCAN (?!anon_)(\w+)(?: AS \w+)?$")
+
+
+@contextmanager
+def capture_selects(engine):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def full_scans(conn, statement, parameters):
+    plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return [m.group(1) for m in (FULL_SCAN.match(row[3]) for row in plan) if m]
+
+
+def seed_large(conn, communities=5, per_community=1000):
+    # Bulk insert enough rows in other communities that a full scan would
+    # show up in the plan, then let SQLite gather statistics
+    today = date.today()
+    for c in range(communities):
+        community_id = conn.execute(
+            Community.__table__.insert(), {"name": f"Big {c}", "country": "US"}
+        ).inserted_primary_key[0]
+        conn.execute(
+            User.__table__.insert(),
+            [
+                {
+                    "community_id": community_id,
+                    "personal_name": f"P{i}",
+                    "family_name": f"F{i}",
+                    "email": f"user{c}-{i}@big.org",
+                }
+                for i in range(per_community)
+            ],
+        )
+        users = [
+            row.id
+            for row in conn.execute(
+                User.__table__.select().where(User.community_id == community_id)
+            )
+        ]
+        conn.execute(
+            Residence.__table__.insert(),
+            [
+                {
+                    "community_id": community_id,
+                    "unit_no": f"Unit {i}",
+                    "street": "Big Street",
+                    "locality": "Town",
+                    "postcode": "00000",
+                    "region": "Region",
+                }
+                for i in range(per_community)
+            ],
+        )
+        residences = [
+            row.id
+            for row in conn.execute(
+                Residence.__table__.select().where(
+                    Residence.community_id == community_id
+                )
+            )
+        ]
+        conn.execute(
+            ResidenceOccupancy.__table__.insert(),
+            [
+                {
+                    "residence_id": r,
+                    "user_id": u,
+                    "r_community_id": community_id,
+                    "u_community_id": community_id,
+                    "relationship_name": "Occupant",
+                    "is_owner": True,
+                }
+                for (r, u) in zip(residences, users)
+            ],
+        )
+        conn.execute(
+            UserSession.__table__.insert(),
+            [{"user_id": u, "community_id": community_id} for u in users],
+        )
+        conn.execute(
+            EmergencyContact.__table__.insert(),
+            [
+                {
+                    "user_id": u,
+                    "personal_name": "Er",
+                    "family_name": "Contact",
+                    "relation": "Friend",
+                }
+                for u in users
+            ],
+        )
+        conn.execute(
+            BillingCharge.__table__.insert(),
+            [
+                {
+                    "user_id": u,
+                    "u_community_id": community_id,
+                    "community_id": community_id,
+                    "name": "Charge",
+                    "base_amount": 1000,
+                    "paid": n % 2 == 0,
+                    "charge_date": today - timedelta(days=n),
+                    "due_date": today - timedelta(days=n - 14),
+                }
+                for u in users
+                for n in range(5)
+            ],
+        )
+        conn.execute(
+            RecurringCharge.__table__.insert(),
+            [
+                {
+                    "residence_id": r if n % 2 else None,
+                    "r_community_id": community_id if n % 2 else None,
+                    "user_id": None if n % 2 else u,
+                    "u_community_id": None if n % 2 else community_id,
+                    "name": "Dues",
+                    "base_amount": 1000,
+                    "frequency": Frequency.MONTHLY,
+                    "frequency_skip": 1,
+                    "grace_period": timedelta(days=10),
+                    "next_charge": today,
+                }
+                for (n, (r, u)) in enumerate(zip(residences, users))
+            ],
+        )
+        role_id = conn.execute(
+            Role.__table__.insert(),
+            {
+                "community_id": community_id,
+                "parent_id": 0,
+                "name": "Root",
+                **{m.name: m for m in Permissions},
+            },
+        ).inserted_primary_key[0]
+        conn.execute(
+            Role.__table__.update().where(Role.id == role_id).values(parent_id=role_id)
+        )
+        conn.execute(
+            Group.__table__.insert(),
+            [
+                {"community_id": community_id, "role_id": role_id, "name": f"G{i}"}
+                for i in range(per_community // 10)
+            ],
+        )
+    conn.exec_driver_sql("ANALYZE")
@@ -0,0 +1,140 @@
+from datetime import date, timedelta
+
+from nido.aging import BUCKETS, aging_csv, aging_report
+from nido.cache import make_cache
+from nido.models import BillingCharge
+
+
+def login(client):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+
+
+def late_charges(session):
+    return session.query(BillingCharge).filter(
+        BillingCharge.community_id == 1,
+        BillingCharge.paid == False,
+        BillingCharge.due_date <= date.today(),
+    )
+
+
+def test_aging_buckets_match_charges(client, session):
+    today = date.today()
+    session.add(
+        BillingCharge(
+            name="Old Charge",
+            base_amount=2500,
+            paid=False,
+            charge_date=today - timedelta(days=130),
+            due_date=today - timedelta(days=100),
+            residence_id=1,
+            community_id=1,
+        )
+    )
+    session.flush()
+
+    report = aging_report(1, today)
+    totals = [0] * len(BUCKETS)
+    for charge in late_charges(session):
+        days = (today - charge.due_date).days
+        for i, (_, low, high) in enumerate(BUCKETS):
+            if days >= low and (high is None or days <= high):
+                totals[i] += charge.base_amount
+    assert report["totals"] == totals
+    assert report["total"] == sum(totals)
+    assert report["totals"][-1] == 2500
+    owners = report["residences"] + report["members"]
+    assert sum(owner["total"] for owner in owners) == report["total"]
+    assert sorted(owner["rank"] for owner in owners)[0] == 1
+
+
+def test_aging_csv(client, session):
+    today = date.today()
+    login(client)
+    response = client.get("/admin/manage-billing/aging.csv")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    lines = response.data.decode().splitlines()
+    assert lines[0].startswith("Owed By,Name,0–30 Days")
+    assert lines[-1].startswith("Total,")
+    assert lines[-1] == aging_csv(aging_report(1, today)).splitlines()[-1]
+
+
+def test_charge_changes_refresh_aging(app, client, session, monkeypatch):
+    monkeypatch.setattr(app, "cache", make_cache({"CACHE_TYPE": "local"}))
+    today = date.today()
+    login(client)
+    before = aging_report(1, today)["total"]
+    charge = late_charges(session).filter_by(user_id=1).first()
+    owed = charge.base_amount
+    response = client.post(
+        "/admin/manage-billing/delete-charge",
+        data={"delete_id": f"c{charge.id}", "lookup_id": "u1"},
+    )
+    assert response.status_code == 302
+    assert aging_report(1, today)["total"] == before - owed
+
+
+def test_dashboard_loads_aging_summary_with_one_query(
+    app, client, session, monkeypatch
+):
+    from sqlalchemy import event
+
+    monkeypatch.setattr(app, "cache", make_cache({"CACHE_TYPE": "local"}))
+    login(client)
+    response = client.get("/admin/dashboard")
+    assert b'data-fragment-load="/admin/manage-billing/aging-summary"' in response.data
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind().engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        first = client.get("/admin/manage-billing/aging-summary")
+        # The auth context is cached by the dashboard request, and the whole
+        # report is one statement
+        assert len(statements) == 1
+        assert "OVER" in statements[0]
+        statements.clear()
+        second = client.get("/admin/manage-billing/aging-summary")
+        assert statements == []
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert b"Overdue Charges" in first.data
+    assert first.data == second.data
+
+
+def test_late_fee_job_refreshes_aging(app, session, monkeypatch):
+    from nido.cache import MISSING
+    from nido.models import LateFeeMethod, LateFeePolicy
+
+    monkeypatch.setattr(app, "cache", make_cache({"CACHE_TYPE": "local"}))
+    monkeypatch.setattr(app, "Session", session)
+    today = date.today()
+    aging_report(1, today)
+    assert app.cache.get("aging", f"1:{today}") is not MISSING
+    session.add(LateFeePolicy(community_id=1, method=LateFeeMethod.FLAT, amount=500))
+    session.flush()
+    as_of = (today + timedelta(days=62)).isoformat()
+    result = app.test_cli_runner().invoke(args=["late-fees", "apply", "--as-of", as_of])
+    assert result.exit_code == 0, result.output
+    assert "Community 1: 0 late fees" not in result.output
+    assert app.cache.get("aging", f"1:{today}") is MISSING
+
+
+def test_migrate_adds_unpaid_index(session):
+    from sqlalchemy import create_engine, inspect
+    from nido.aging import add_unpaid_index
+    from nido.models import Base
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_billing_charge_unpaid")
+        assert add_unpaid_index(conn)
+        assert not add_unpaid_index(conn)
+        names = {i["name"] for i in inspect(conn).get_indexes("billing_charge")}
+    assert "ix_billing_charge_unpaid" in names
@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from nido.allocation import apportion
+from nido.models import BillingCharge, Residence
+
+
+def test_apportion_keeps_every_cent():
+    assert apportion(100, [1, 1, 1]) == [34, 33, 33]
+    assert apportion(100, [1, 2, 2]) == [20, 40, 40]
+    shares = apportion(40000000, [3333, 3333, 3334, 7])
+    assert sum(shares) == 40000000
+    assert shares == [13322674, 13322674, 13326671, 27981]
+
+
+def test_assessment_previews_then_charges_by_stake(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    residences = session.query(Residence).filter_by(community_id=1).all()
+    for residence in residences:
+        residence.ownership_stake = Decimal("12.5")
+    session.commit()
+    old_count = session.query(BillingCharge).count()
+    form = {
+        "name": "Roof Replacement",
+        "amount": "1000.01",
+        "due": date.today() + timedelta(days=30),
+    }
+
+    response = client.post("/admin/manage-billing/assessment", data=form)
+    assert response.status_code == 200
+    assert b"Create Charges" in response.data
+    assert session.query(BillingCharge).count() == old_count
+
+    response = client.post(
+        "/admin/manage-billing/assessment", data={**form, "confirm": "1"}
+    )
+    assert response.status_code == 302
+    assert "/admin/manage-billing/assessment/charged" in response.location
+    response = client.get(response.location)
+    assert f"charged to {len(residences)} residences".encode() in response.data
+
+    # Submitting again, or refreshing, doesn't charge anyone twice
+    client.post("/admin/manage-billing/assessment", data={**form, "confirm": "1"})
+    response = client.post("/admin/manage-billing/assessment", data=form)
+    assert b"has already been charged" in response.data
+    assert b"Create Charges" not in response.data
+    amounts = [
+        amount
+        for (amount,) in session.query(BillingCharge.base_amount).filter_by(
+            name="Roof Replacement"
+        )
+    ]
+    assert len(amounts) == len(residences)
+    assert sum(amounts) == 100001
+    assert max(amounts) - min(amounts) <= 1
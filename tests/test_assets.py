@@ -0,0 +1,60 @@
+import gzip
+import os
+import shutil
+
+import pytest
+from flask import url_for
+
+from nido.assets import build_assets
+
+
+@pytest.fixture
+def built(app, monkeypatch, tmp_path):
+    static = tmp_path / "static"
+    shutil.copytree(app.static_folder, static)
+    manifest = build_assets(str(static), str(static / "dist"))
+    monkeypatch.setattr(app, "static_folder", str(static))
+    monkeypatch.setattr(app, "assets", manifest)
+    return manifest
+
+
+def test_build_writes_hashed_compressed_files(built, app):
+    css_name = built["css/style.css"]
+    assert css_name.startswith("dist/css/style.") and css_name.endswith(".css")
+    css_path = os.path.join(app.static_folder, css_name)
+    with open(css_path, "rb") as f:
+        css = f.read()
+    with gzip.open(css_path + ".gz") as f:
+        assert f.read() == css
+    # Icons point into the sprite, and the sprite has a view for each
+    sprite = built["icons.svg"]
+    assert f"url(/static/{sprite}#household)".encode() in css
+    assert b"/static/icons/" not in css
+    with open(os.path.join(app.static_folder, sprite), "rb") as f:
+        assert b'<view id="household"' in f.read()
+    assert f"url(/static/{built['bg.svg']})".encode() in css
+
+
+def test_url_for_follows_manifest(built, app):
+    with app.test_request_context():
+        assert url_for("static", filename="css/style.css") == (
+            "/static/" + built["css/style.css"]
+        )
+        assert url_for("static", filename="icons/user.svg") == (
+            "/static/icons/user.svg"
+        )
+
+
+def test_built_files_are_immutable_and_precompressed(built, client):
+    url = "/static/" + built["css/style.css"]
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/css"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data).startswith(b"@import")
+
+    response = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data.startswith(b"@import")
+    assert client.get("/static/dist/missing.css").status_code == 404
@@ -8,3 +8,58 @@ def test_user_login(client):
         "/login", data={"ident": "rthom0@com.com"}, follow_redirects=True
     )
     assert b"Rudd Thom" in response.data
+
+
+def test_admin_page_loads_auth_context_in_one_query(client, session):
+    from sqlalchemy import event
+
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind().engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/admin/dashboard")
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert b"Rolfson-Durgan Admin Dashboard" in response.data
+    assert len(statements) == 1
+
+
+def test_missing_permission_is_forbidden(client):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 4
+    response = client.get("/admin/manage-billing")
+    assert response.status_code == 403
+
+
+def test_hot_statements_reuse_compiled_sql(client, session):
+    from sqlalchemy import event
+
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    compiled = []
+
+    def grab(conn, cursor, statement, parameters, context, executemany):
+        compiled.append(context.compiled)
+
+    engine = session.get_bind().engine
+    event.listen(engine, "before_cursor_execute", grab)
+    try:
+        # The first round compiles and warms the cache; after that nothing
+        # should be compiled again
+        rounds = []
+        for _ in range(3):
+            compiled.clear()
+            for url in ("/my-household/", "/billing/", "/directory/"):
+                assert client.get(url).status_code == 200
+            rounds.append([id(c) for c in compiled])
+    finally:
+        event.remove(engine, "before_cursor_execute", grab)
+
+    assert rounds[1] == rounds[2]
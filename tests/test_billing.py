@@ -40,3 +40,106 @@ def test_new_valid_recurring_charge_is_created(client, session):
     )
 
     assert session.query(RecurringCharge).count() == old_count + 1
+
+
+def test_fragment_requests_return_only_changed_rows(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    headers = {"Nido-Fragment": "1"}
+    response = client.post(
+        "/admin/manage-billing/new-single-charge",
+        data={
+            "name": "Fragment Charge",
+            "amount": "7.50",
+            "due": date.today() + timedelta(days=14),
+            "lookup_id": "u1",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.data.count(b"<tr") == 1
+    assert b"Fragment Charge" in response.data
+    assert b"$7.50" in response.data
+    assert b"<html" not in response.data
+
+    (charge_id,) = (
+        session.query(BillingCharge.id).filter_by(name="Fragment Charge").one()
+    )
+    response = client.post(
+        "/admin/manage-billing/delete-charge",
+        data={"delete_id": f"b{charge_id}", "lookup_id": "u1"},
+        headers=headers,
+    )
+    assert response.status_code == 204
+    assert session.query(BillingCharge).filter_by(id=charge_id).count() == 0
+
+
+def test_bulk_dry_run_reports_without_changing_charges(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "mark_paid", "lookup_id": "u1", "dry_run": "1"},
+    )
+    assert response.status_code == 200
+    assert b"Dry run: 2 unpaid charges" in response.data
+    assert b"$510.50" in response.data
+    assert session.query(BillingCharge).filter_by(user_id=1, paid=True).count() == 0
+
+
+def test_bulk_actions_update_matching_charges(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    (late_id,) = (
+        session.query(BillingCharge.id)
+        .filter_by(user_id=1, name="Example Late Charge")
+        .one()
+    )
+    client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "adjust", "amount": "-0.50", "charge_ids": late_id},
+    )
+    assert session.get(BillingCharge, late_id).base_amount == 1000
+    session.expire_all()
+    client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "mark_paid", "charge_ids": late_id},
+    )
+    assert session.get(BillingCharge, late_id).paid
+    session.expire_all()
+    client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "void", "lookup_id": "u1"},
+    )
+    assert session.query(BillingCharge).filter_by(user_id=1).count() == 1
+
+
+def test_bulk_action_without_criteria_is_rejected(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.post(
+        "/admin/manage-billing/bulk", data={"action": "void", "name": ""}
+    )
+    assert response.status_code == 400
+
+
+def test_amounts_with_fractional_cents_are_rejected(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    for amount in ("10.005", "NaN", "ten"):
+        response = client.post(
+            "/admin/manage-billing/bulk",
+            data={"action": "adjust", "amount": amount, "lookup_id": "u1"},
+        )
+        assert response.status_code == 400
+    # Trailing zeros are still whole cents
+    response = client.post(
+        "/admin/manage-billing/bulk",
+        data={
+            "action": "adjust",
+            "amount": "10.500",
+            "lookup_id": "u1",
+            "dry_run": "1",
+        },
+    )
+    assert response.status_code == 200
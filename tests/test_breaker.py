@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from nido.breaker import BreakerOpen, BreakerRedis, CircuitBreaker
+
+
+class FlakyRedis:
+    def __init__(self):
+        self.up = False
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        if not self.up:
+            raise ConnectionError
+        return b"1"
+
+    def ping(self):
+        if not self.up:
+            raise ConnectionError
+        return True
+
+
+def test_breaker_skips_redis_while_open_and_recovers():
+    server = FlakyRedis()
+    breaker = CircuitBreaker(
+        server.ping,
+        threshold=2,
+        probe_interval=0.01,
+        failure_exceptions=(ConnectionError,),
+    )
+    client = BreakerRedis(server, breaker)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            client.get("key")
+    assert breaker.is_open
+    with pytest.raises(BreakerOpen):
+        client.get("key")
+    assert server.calls == 2
+
+    server.up = True
+    deadline = time.monotonic() + 1
+    while breaker.is_open and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.get("key") == b"1"
+    assert dict((n, v) for (n, _l, v) in breaker.collect_metrics()) == {
+        "nido_redis_breaker_open": 0,
+        "nido_redis_breaker_failures": 0,
+        "nido_redis_breaker_trips_total": 1,
+    }
+
+
+def test_metrics_requires_token(app, client):
+    assert client.get("/metrics").status_code == 404
+    app.config["METRICS_TOKEN"] = "scrape"
+    try:
+        assert client.get("/metrics").status_code == 403
+        response = client.get("/metrics", headers={"Authorization": "Bearer scrape"})
+    finally:
+        del app.config["METRICS_TOKEN"]
+    assert response.status_code == 200
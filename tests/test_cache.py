@@ -0,0 +1,76 @@
+import threading
+import time
+
+from nido.cache import MISSING, Cache, LocalCache, NullCache
+
+
+def test_local_cache_evicts_least_recently_used():
+    local = LocalCache(max_size=2)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")
+    local.set("c", 3)
+
+    assert local.get("a") == 1
+    assert local.get("b") is MISSING
+    assert local.get("c") == 3
+
+
+def test_falsy_values_are_cached_but_none_is_not():
+    cache = Cache(LocalCache())
+    calls = []
+
+    def compute_false():
+        calls.append("false")
+        return False
+
+    def compute_none():
+        calls.append("none")
+        return None
+
+    for _ in range(2):
+        assert cache.get_or_set("flags", "f", compute_false) is False
+        assert cache.get_or_set("flags", "n", compute_none) is None
+
+    assert calls == ["false", "none", "none"]
+    assert cache.stats()["flags"] == {"misses": 3, "hits": 1}
+
+
+def test_concurrent_misses_compute_once():
+    cache = Cache(NullCache())
+    calls = []
+
+    def slow_compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_or_set("slow", 1, slow_compute))
+        )
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [42] * 5
+    assert len(calls) == 1
+    assert cache.stats()["slow"]["coalesced"] == 4
+
+
+def test_local_mode_keeps_entries_briefly(monkeypatch):
+    from nido import cache as cache_module
+    from nido.cache import make_cache
+
+    cache = make_cache({"CACHE_TYPE": "local"})
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache.set("auth_context", "None:1", {"user_id": 1}, ttl=60)
+    now[0] += 29
+    assert cache.get("auth_context", "None:1") == {"user_id": 1}
+    now[0] += 2
+    assert cache.get("auth_context", "None:1") is MISSING
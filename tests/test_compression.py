@@ -0,0 +1,140 @@
+import gzip
+import zlib
+
+from nido.compression import CompressionMiddleware, choose_encoding
+
+PAGE = b"<tr><td>Unit</td><td>Resident</td></tr>\n" * 100
+
+
+def run(app, accept="gzip", **kwargs):
+    middleware = CompressionMiddleware(app, **kwargs)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = dict(headers)
+
+    environ = {"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": accept}
+    body = middleware(environ, start_response)
+    return (middleware, started, body)
+
+
+def html_app(body, content_type="text/html; charset=utf-8", extra=()):
+    def app(environ, start_response):
+        start_response(
+            "200 OK",
+            [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+            + list(extra),
+        )
+        return [body]
+
+    return app
+
+
+def test_choose_encoding_honours_quality():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding(None) is None
+
+
+def test_buffered_html_is_compressed_and_counted():
+    (middleware, started, body) = run(html_app(PAGE))
+    data = b"".join(body)
+    assert started["headers"]["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in started["headers"]
+    assert started["headers"]["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(data) == PAGE
+
+    metrics = {(n, l.get("encoding")): v for (n, l, v) in middleware.collect_metrics()}
+    assert metrics[("nido_compression_bytes_in_total", "gzip")] == len(PAGE)
+    assert metrics[("nido_compression_bytes_out_total", "gzip")] == len(data)
+    assert metrics[("nido_compression_ratio", "gzip")] < 0.1
+
+
+def test_small_binary_and_encoded_responses_pass_through():
+    for (app, kwargs) in [
+        (html_app(b"<p>hi</p>"), {}),
+        (html_app(PAGE, content_type="image/png"), {}),
+        (html_app(PAGE, extra=[("Content-Encoding", "br")]), {}),
+    ]:
+        (_, started, body) = run(app, **kwargs)
+        assert b"".join(body) in (b"<p>hi</p>", PAGE)
+        assert started["headers"].get("Content-Encoding") in (None, "br")
+
+
+def test_streamed_response_flushes_before_finishing():
+    produced = []
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/html")])
+
+        def generate():
+            for i in range(3):
+                produced.append(i)
+                yield PAGE
+
+        return generate()
+
+    (_, started, body) = run(app)
+    first = next(body)
+    assert produced == [0]
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(first) == PAGE
+    rest = b"".join(body)
+    assert decompressor.decompress(rest) == PAGE * 2
+    assert decompressor.eof
+
+
+def test_pages_are_compressed(client, app):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.get("/directory/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert b"Rudd Thom" in gzip.decompress(response.data)
+
+
+def test_send_file_keeps_servers_file_wrapper(tmp_path):
+    from flask import Flask, send_file
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wsgi import FileWrapper
+
+    class ServerFileWrapper(FileWrapper):
+        pass
+
+    path = tmp_path / "minutes.pdf"
+    path.write_bytes(b"%PDF" + b"0" * 5000)
+    flask_app = Flask(__name__)
+    flask_app.add_url_rule("/doc", "doc", lambda: send_file(path))
+    middleware = CompressionMiddleware(flask_app.wsgi_app)
+    environ = EnvironBuilder("/doc", headers={"Accept-Encoding": "gzip"}).get_environ()
+    environ["wsgi.file_wrapper"] = ServerFileWrapper
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+
+    body = middleware(environ, start_response)
+    assert isinstance(body, ServerFileWrapper)
+    assert started["status"] == "200 OK"
+    assert b"".join(body) == path.read_bytes()
+    body.close()
+
+
+def test_unstarted_response_is_closed():
+    closed = []
+
+    class Body:
+        def __iter__(self):
+            yield PAGE
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/html")])
+        return Body()
+
+    (_middleware, _started, body) = run(app)
+    body.close()
+    assert closed == [True]
@@ -0,0 +1,91 @@
+import flask
+import pytest
+from sqlalchemy import create_engine
+
+from nido import create_app
+from nido.db import make_engine
+from nido.partitions import add_community_column
+from nido.models import Base, Community
+
+
+def test_wal_profile_sets_pragmas(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'wal.db'}", "sqlite-wal-multiworker")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+    engine.dispose()
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        make_engine("sqlite://", "no-such-profile")
+
+
+def test_reads_route_to_replica_until_a_write(tmp_path):
+    primary_url = f"sqlite:///{tmp_path / 'primary.db'}"
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "VERY_SECRET",
+            "DATABASE_URL": primary_url,
+            "DATABASE_REPLICA_URLS": [replica_url],
+            "CACHE_TYPE": "null",
+            "ISSUE_WORKERS": 0,
+            "PREVIEW_WORKERS": 0,
+        }
+    )
+    for url in (primary_url, replica_url):
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+    engine = create_engine(replica_url)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO community (name, country) VALUES ('Replica', 'US')"
+        )
+    engine.dispose()
+
+    def community_names():
+        return [c.name for c in app.Session.query(Community).all()]
+
+    with app.test_request_context("/", method="GET"):
+        assert community_names() == ["Replica"]
+        app.Session.remove()
+
+    with app.test_request_context("/", method="POST"):
+        assert community_names() == []
+        app.Session.add(Community(name="Primary", country="US"))
+        app.Session.commit()
+        sticky_until = flask.session["db_primary_until"]
+        app.Session.remove()
+
+    with app.test_request_context("/", method="GET"):
+        flask.session["db_primary_until"] = sticky_until
+        assert community_names() == ["Primary"]
+        app.Session.remove()
+
+    result = app.test_cli_runner().invoke(args=["sync-replicas"])
+    assert result.exit_code == 0
+    with app.test_request_context("/", method="GET"):
+        assert community_names() == ["Primary"]
+        app.Session.remove()
+
+
+def test_add_community_column_backfills_charges(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE billing_charge (id INTEGER PRIMARY KEY,"
+            " u_community_id INTEGER, r_community_id INTEGER)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO billing_charge VALUES (1, 3, NULL), (2, NULL, 4)"
+        )
+        assert add_community_column(conn)
+        assert not add_community_column(conn)
+        assert conn.exec_driver_sql(
+            "SELECT community_id FROM billing_charge ORDER BY id"
+        ).scalars().all() == [3, 4]
+    engine.dispose()
@@ -0,0 +1,59 @@
+import io
+
+from nido.models import Document
+
+
+def test_uploaded_document_is_listed_with_preview(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    client.post(
+        "/admin/manage-documents/upload",
+        data={
+            "title": "Bylaws",
+            "document": (io.BytesIO(b"Article I: Name"), "bylaws.txt", "text/plain"),
+        },
+    )
+    document = session.query(Document).filter_by(title="Bylaws").one()
+    assert document.preview_text == "Article I: Name"
+
+    response = client.get("/documents/")
+    assert b"Bylaws" in response.data
+    assert b"Article I: Name" in response.data
+
+
+def test_identical_uploads_share_storage(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    for title in ("Minutes", "Minutes Copy"):
+        client.post(
+            "/admin/manage-documents/upload",
+            data={
+                "title": title,
+                "document": (io.BytesIO(b"Same minutes"), "minutes.txt"),
+            },
+        )
+    (first, second) = (
+        session.query(Document.digest)
+        .filter(Document.title.in_(["Minutes", "Minutes Copy"]))
+        .all()
+    )
+    assert first.digest == second.digest
+
+
+def test_document_conditional_get(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    client.post(
+        "/admin/manage-documents/upload",
+        data={
+            "title": "Budget",
+            "document": (io.BytesIO(b"Budget 2022"), "budget.txt"),
+        },
+    )
+    document = session.query(Document).filter_by(title="Budget").one()
+
+    response = client.get(f"/documents/{document.id}")
+    etag = response.headers["ETag"]
+    response.close()
+    response = client.get(f"/documents/{document.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+from nido import forecast as forecast_module
+from nido.forecast import forecast
+from nido.models import Frequency, RecurringCharge, add_months
+
+
+def stepped_forecast(session, start, months):
+    # What stepping each charge with find_next_date gives
+    end = add_months(start, months)
+    by_month = [0] * months
+    for charge in session.query(RecurringCharge):
+        while charge.next_charge < end:
+            if charge.next_charge >= start:
+                month = (charge.next_charge.year - start.year) * 12 + (
+                    charge.next_charge.month - start.month
+                )
+                by_month[month] += charge.base_amount
+            charge.next_charge = charge.find_next_date()
+    return by_month
+
+
+def test_forecast_matches_stepping_each_charge(session, monkeypatch):
+    start = date(2026, 11, 1)
+    session.add_all(
+        [
+            RecurringCharge(
+                residence_id=1,
+                r_community_id=1,
+                name="Quarterly Dues",
+                base_amount=30000,
+                frequency=Frequency.MONTHLY,
+                frequency_skip=3,
+                grace_period=timedelta(days=10),
+                next_charge=date(2026, 12, 31),
+            ),
+            RecurringCharge(
+                user_id=1,
+                u_community_id=1,
+                name="Weekly Parking",
+                base_amount=500,
+                frequency=Frequency.DAILY,
+                frequency_skip=7,
+                grace_period=timedelta(days=3),
+                next_charge=date(2026, 10, 20),
+            ),
+            RecurringCharge(
+                residence_id=2,
+                r_community_id=1,
+                name="Annual Insurance",
+                base_amount=120000,
+                frequency=Frequency.YEARLY,
+                frequency_skip=1,
+                grace_period=timedelta(days=30),
+                next_charge=date(2028, 2, 29),
+            ),
+        ]
+    )
+    session.flush()
+
+    expected = forecast(session, 1, start=start)
+    # Without NumPy the same batches are expanded in plain Python
+    monkeypatch.setattr(forecast_module, "numpy", None)
+    assert forecast(session, 1, start=start).by_month == expected.by_month
+    assert expected.by_month == stepped_forecast(session, start, 24)
+    assert sum(expected.by_frequency[Frequency.YEARLY]) == 120000
+    assert expected.by_residence[2] >= 120000
+
+
+def test_forecast_report_renders(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.get("/admin/manage-billing/forecast")
+    assert response.status_code == 200
+    assert b"Income Forecast" in response.data
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+
+from nido.file_store import stored_path
+from nido.models import Attachment, Community, Issue, IssueStatus, User
+
+
+def test_new_issue_is_stored(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    old_count = session.query(Issue).count()
+    response = client.post(
+        "/report-issue/",
+        data={"issue_subject": "Leaking pipe", "issue_body": "Under the sink"},
+    )
+
+    assert session.query(Issue).count() == old_count + 1
+    issue = session.query(Issue).filter_by(subject="Leaking pipe").one()
+    assert issue.status == IssueStatus.OPEN
+    assert issue.user_id == 1
+    assert b"Leaking pipe" in response.data
+
+
+def test_issue_queue_pages_by_keyset(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    for i in range(30):
+        session.add(
+            Issue(
+                community_id=1,
+                user_id=2,
+                subject=f"Queued issue {i:02}",
+                body="Body",
+            )
+        )
+    session.commit()
+
+    response = client.get("/admin/issue-queue")
+    assert b"Queued issue 00" in response.data
+    assert b"Queued issue 29" not in response.data
+    assert b"after=" in response.data
+
+    last = session.query(Issue).filter_by(subject="Queued issue 24").one()
+    after = f"{last.created_at.isoformat()}_{last.id}"
+    response = client.get("/admin/issue-queue", query_string={"after": after})
+    assert b"Queued issue 25" in response.data
+    assert b"Queued issue 24" not in response.data
+
+
+def test_attachment_is_stored_and_served_with_ranges(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    client.post(
+        "/report-issue/",
+        data={
+            "issue_subject": "Leak photo",
+            "issue_body": "See attached",
+            "attachments": (io.BytesIO(b"0123456789" * 10000), "leak.jpg"),
+        },
+    )
+    attachment = (
+        session.query(Attachment).join(Issue).filter_by(subject="Leak photo").one()
+    )
+    assert attachment.size == 100000
+
+    response = client.get(
+        f"/report-issue/attachments/{attachment.id}",
+        headers={"Range": "bytes=10-19"},
+    )
+    assert response.status_code == 206
+    assert response.data == b"0123456789"
+    response.close()
+
+
+def test_attachment_over_quota_is_rejected(app, client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    old_count = session.query(Issue).count()
+    app.config["ATTACHMENT_QUOTA"] = 10
+    try:
+        response = client.post(
+            "/report-issue/",
+            data={
+                "issue_subject": "Too big",
+                "issue_body": "Body",
+                "attachments": (io.BytesIO(b"x" * 100), "big.bin"),
+            },
+        )
+    finally:
+        del app.config["ATTACHMENT_QUOTA"]
+    assert response.status_code == 413
+    assert session.query(Issue).count() == old_count
+
+
+def test_files_stored_before_going_over_quota_are_removed(app, client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    first = b"fits under the quota" * 5
+    app.config["ATTACHMENT_QUOTA"] = 150
+    try:
+        response = client.post(
+            "/report-issue/",
+            data={
+                "issue_subject": "Second file too big",
+                "issue_body": "Body",
+                "attachments": [
+                    (io.BytesIO(first), "small.txt"),
+                    (io.BytesIO(b"y" * 100), "big.bin"),
+                ],
+            },
+        )
+    finally:
+        del app.config["ATTACHMENT_QUOTA"]
+    assert response.status_code == 413
+    with app.app_context():
+        assert not os.path.exists(stored_path(hashlib.sha256(first).hexdigest()))
+
+
+def test_update_issue_rejects_bad_input(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    issue = Issue(community_id=1, user_id=2, subject="Broken gate", body="Body")
+    other = Community(name="Elsewhere", country="United States")
+    outsider = User(community=other, personal_name="Out", family_name="Sider")
+    session.add_all([issue, other, outsider])
+    session.commit()
+
+    url = f"/admin/issue-queue/{issue.id}"
+    assert client.post(url, data={"status": "NOPE"}).status_code == 400
+    assert client.post(url, data={}).status_code == 400
+    response = client.post(url, data={"status": "OPEN", "assignee_id": "x"})
+    assert response.status_code == 400
+    response = client.post(url, data={"status": "OPEN", "assignee_id": outsider.id})
+    assert response.status_code == 400
+    session.refresh(issue)
+    assert issue.assignee_id is None
+
+    response = client.post(url, data={"status": "CLOSED", "assignee_id": 2})
+    assert response.status_code == 302
+    session.refresh(issue)
+    assert issue.assignee_id == 2
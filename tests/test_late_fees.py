@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+
+from nido.late_fees import apply_late_fees, billing_period
+from nido.models import BillingCharge, LateFeeMethod, LateFeePolicy
+
+
+def months_ahead(months):
+    day = date.today().replace(day=1)
+    for _ in range(months):
+        day = (day + timedelta(days=32)).replace(day=1)
+    return day
+
+
+def test_late_fees_are_charged_once_per_charge_and_month(session):
+    session.add(
+        LateFeePolicy(community_id=1, method=LateFeeMethod.PERCENT, amount=1000)
+    )
+    session.flush()
+    # Far enough ahead that every unpaid charge is overdue for the period
+    as_of = months_ahead(3)
+    overdue = (
+        session.query(BillingCharge)
+        .filter_by(community_id=1, paid=False, late_fee_of=None)
+        .count()
+    )
+
+    assert apply_late_fees(session, as_of) == {1: overdue}
+    assert apply_late_fees(session, as_of) == {1: 0}
+    (late_id,) = (
+        session.query(BillingCharge.id)
+        .filter_by(user_id=1, name="Example Late Charge")
+        .one()
+    )
+    fee = session.query(BillingCharge).filter_by(late_fee_of=late_id).one()
+    assert fee.base_amount == 105
+    assert fee.name == "Late fee: Example Late Charge"
+    assert fee.late_fee_period == billing_period(as_of)[0]
+
+    # Fees get no fees of their own the following month
+    assert apply_late_fees(session, months_ahead(4)) == {1: overdue}
+
+
+def test_daily_late_fees_count_days_late_in_the_month(session):
+    session.add(
+        LateFeePolicy(
+            community_id=1, method=LateFeeMethod.DAILY, amount=100, grace_days=5
+        )
+    )
+    as_of = months_ahead(3)
+    (period_start, period_end) = billing_period(as_of)
+    late_in_month = BillingCharge(
+        user_id=1,
+        u_community_id=1,
+        name="Due Mid Period",
+        base_amount=5000,
+        paid=False,
+        charge_date=period_start,
+        due_date=period_start + timedelta(days=9),
+    )
+    session.add(late_in_month)
+    session.flush()
+    apply_late_fees(session, as_of)
+
+    (late_id,) = (
+        session.query(BillingCharge.id)
+        .filter_by(user_id=1, name="Example Late Charge")
+        .one()
+    )
+    fees = dict(
+        session.query(BillingCharge.late_fee_of, BillingCharge.base_amount).filter(
+            BillingCharge.late_fee_of.in_([late_in_month.id, late_id])
+        )
+    )
+    # Late from the 16th: due on the 10th plus five days' grace
+    assert fees[late_in_month.id] == 100 * (period_end.day - 15)
+    assert fees[late_id] == 100 * period_end.day
+
+
+def test_late_fee_policy_is_saved_and_cleared(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    client.post(
+        "/admin/manage-billing/late-fees",
+        data={"method": "FLAT", "amount": "25.00", "grace_days": "10"},
+    )
+    policy = session.get(LateFeePolicy, 1)
+    assert (policy.method, policy.amount, policy.grace_days) == (
+        LateFeeMethod.FLAT,
+        2500,
+        10,
+    )
+    response = client.get("/admin/manage-billing")
+    assert b'value="25.00"' in response.data
+
+    client.post("/admin/manage-billing/late-fees", data={"method": ""})
+    session.expire_all()
+    assert session.get(LateFeePolicy, 1) is None
@@ -36,3 +36,39 @@ def test_position_min_size(session):
 
     with pytest.raises(Exception):
         g.members.remove(u1)
+
+
+def test_unplanned_lazy_load_raises(session):
+    from sqlalchemy.exc import InvalidRequestError
+    from sqlalchemy.orm import selectinload
+
+    group = session.query(Group).first()
+    with pytest.raises(InvalidRequestError):
+        group.members
+
+    group = session.query(Group).options(selectinload(Group.members)).first()
+    assert len(group.members) > 0
+
+
+def test_monthly_recurring_charge_crosses_year_end():
+    from datetime import date
+    from nido.models import Frequency, RecurringCharge
+
+    charge = RecurringCharge(
+        frequency=Frequency.MONTHLY, frequency_skip=2, next_charge=date(2026, 12, 31)
+    )
+    assert charge.find_next_date() == date(2027, 2, 28)
+    charge.next_charge = date(2026, 11, 15)
+    charge.anchor_day = None
+    charge.frequency_skip = 1
+    assert charge.find_next_date() == date(2026, 12, 15)
+
+    # Stepping past a short month goes back to the original day
+    charge = RecurringCharge(
+        frequency=Frequency.MONTHLY, frequency_skip=1, next_charge=date(2027, 1, 31)
+    )
+    dates = []
+    for _ in range(3):
+        charge.next_charge = charge.find_next_date()
+        dates.append(charge.next_charge)
+    assert dates == [date(2027, 2, 28), date(2027, 3, 31), date(2027, 4, 30)]
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import click
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.sql import func
+
+from nido.models import BillingCharge, Residence
+from nido.money import Money, money_format, store_stakes_as_integers
+
+
+def test_money_formats_follow_country():
+    assert money_format("US")(123456789) == "$1,234,567.89"
+    assert money_format("France")(-123456789) == "-1\u202f234\u202f567,89\xa0€"
+    assert money_format("Germany")(5) == "0,05\xa0€"
+    assert money_format("Atlantis")(100) == "$1.00"
+    assert str(Money(-1050)) == "-10.50"
+    assert Money.from_decimal(Decimal("10.505")) == Money(1051)
+
+
+def test_amounts_and_stakes_aggregate_in_sql(session):
+    total = session.query(func.sum(BillingCharge.amount)).filter_by(user_id=1).scalar()
+    assert total == Money(51050)
+    assert (
+        session.query(BillingCharge)
+        .filter(BillingCharge.user_id == 1, BillingCharge.amount > Decimal("100"))
+        .count()
+        == 1
+    )
+
+    residences = session.query(Residence).filter_by(community_id=1).all()
+    for i, residence in enumerate(residences):
+        residence.ownership_stake = Decimal("0.000000000000001") * (i + 1) + 9
+    session.flush()
+    n = len(residences)
+    assert (
+        session.query(func.sum(Residence.ownership_stake))
+        .filter_by(community_id=1)
+        .scalar()
+        == Decimal(9 * n) + Decimal("0.000000000000001") * n * (n + 1) / 2
+    )
+    assert (
+        session.query(Residence)
+        .filter(Residence.ownership_stake > Decimal("9.000000000000001"))
+        .count()
+        == n - 1
+    )
+
+
+def test_string_stakes_migrate_to_integers():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE residence (id INTEGER PRIMARY KEY,"
+            " ownership_stake VARCHAR(19))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO residence VALUES (1, '12.345000000000001'), (2, NULL)"
+        )
+        assert store_stakes_as_integers(conn, 15)
+        assert not store_stakes_as_integers(conn, 15)
+        rows = conn.exec_driver_sql(
+            "SELECT ownership_stake FROM residence ORDER BY id"
+        ).all()
+    assert rows == [(12345000000000001,), (None,)]
+
+    with create_engine("sqlite://").begin() as conn:
+        with pytest.raises(click.ClickException, match="ownership_stake"):
+            store_stakes_as_integers(conn, 15)
+
+
+def test_bare_ints_are_not_amounts():
+    import pytest
+
+    assert int(Money(500)) == 500
+    assert Money(500) != 5
+    assert Money(500) != 500
+    assert Money(500) == Decimal("5")
+    assert Money(0) == 0
+    assert sum([Money(500), Money(25)]) == Money(525)
+    for operation in (lambda: Money(500) + 5, lambda: Money(500) < 5):
+        with pytest.raises(TypeError):
+            operation()
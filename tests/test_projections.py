@@ -0,0 +1,26 @@
+import decimal
+
+from nido.projections import format_cents, listing_views
+
+
+def test_format_cents_matches_decimal_formatting():
+    for cents in (0, 5, -5, 99, 100, 1050, -123456, 10**12 + 7):
+        assert format_cents(cents) == f"${decimal.Decimal('.01') * cents}"
+
+
+def test_listing_views_group_residents_in_listing_order():
+    listings = listing_views(
+        [(2, "Main St", "Unit 2"), (1, "Main St", "Unit 1")],
+        [(1, "Ann", "Lee", None, None), (2, "Bo", "Kim", None, None)],
+    )
+    assert [l.unit_no for l in listings] == ["Unit 2", "Unit 1"]
+    assert [r.personal_name for r in listings[1].occupants] == ["Ann"]
+    assert not hasattr(listings[0], "__dict__")
+
+
+def test_member_billing_marks_overdue_charges(client):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.get("/billing/")
+    assert b"<td><b>Example Late Charge</b></td>" in response.data
+    assert b"<td>Example Personal Charge</td>" in response.data
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from nido import create_app
+from query_plans import capture_selects, full_scans, seed_large
+
+HOT_VIEWS = [
+    "/my-household/",
+    "/billing/",
+    "/directory/",
+    "/emergency-contacts/",
+    "/report-issue/",
+    "/documents/",
+    "/admin/dashboard",
+    "/admin/manage-billing",
+    "/admin/manage-billing/edit-billing-records?lookup_id=u1",
+    "/admin/manage-billing/edit-billing-records?lookup_id=r1",
+    "/admin/manage-billing/aging",
+    "/admin/issue-queue",
+    "/admin/edit-groups",
+    "/admin/edit-permissions",
+]
+
+# Tables small enough (or only ever read in full) that scanning them is fine
+SMALL_TABLES = {"community", "role"}
+
+
+@pytest.fixture(scope="module")
+def large_app(db, tmp_path_factory):
+    # Start from a copy of the standard test data, then bulk up
+    path = tmp_path_factory.mktemp("plans") / "large.db"
+    target = sqlite3.connect(path)
+    db.get_bind().raw_connection().driver_connection.backup(target)
+    target.close()
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "VERY_SECRET",
+            "DATABASE_URL": f"sqlite:///{path}",
+            "CACHE_TYPE": "null",
+            "RAISE_ON_LAZY_LOAD": True,
+            "ISSUE_WORKERS": 0,
+            "PREVIEW_WORKERS": 0,
+        }
+    )
+    with app.app_context():
+        with app.Session.get_bind().begin() as conn:
+            seed_large(conn)
+    return app
+
+
+@pytest.mark.parametrize("url", HOT_VIEWS)
+def test_hot_view_uses_indexes(large_app, url):
+    client = large_app.test_client()
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    engine = large_app.Session.get_bind()
+    with capture_selects(engine) as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+
+    with engine.connect() as conn:
+        for (statement, parameters) in statements:
+            scans = set(full_scans(conn, statement, parameters)) - SMALL_TABLES
+            assert not scans, f"Full scan of {scans} in:\n{statement}"
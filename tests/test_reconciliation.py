@@ -0,0 +1,142 @@
+from datetime import date, timedelta
+from io import BytesIO
+
+from nido.models import BillingCharge
+from nido.reconciliation import (
+    OpenCharge,
+    Payment,
+    Reconciler,
+    fingerprint,
+    payer_key,
+)
+
+
+def test_statement_matches_and_queues_payments(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    (personal_id,) = (
+        session.query(BillingCharge.id)
+        .filter_by(user_id=1, name="Example Personal Charge")
+        .one()
+    )
+    today = date.today().isoformat()
+    statement = (
+        "Date,Description,Reference,Amount\n"
+        f'{today},"THOM, RUDD",,10.50\n'
+        f"{today},Someone Else,NIDO-{personal_id},500.00\n"
+        f"{today},Unknown Payer,,12.34\n"
+        f"{today},Bank Fee,,-5.00\n"
+        "not a date,Unknown Payer,,1.00\n"
+    )
+    response = client.post(
+        "/admin/manage-billing/reconcile",
+        data={"statement": (BytesIO(statement.encode()), "statement.csv")},
+    )
+    assert response.status_code == 200
+    assert b"2 payments matched" in response.data
+    assert b"1 needs review" in response.data
+    assert b"Lines that could not be read: 6" in response.data
+    assert session.query(BillingCharge).filter_by(user_id=1, paid=True).count() == 2
+
+
+def test_combined_payment_pays_a_unique_subset():
+    issued = date.today() - timedelta(days=30)
+    charges = [
+        OpenCharge((i, amount, issued, issued, None, "Ada", "Lovelace"), {})
+        for i, amount in enumerate((1000, 2500, 4000), start=1)
+    ]
+    reconciler = Reconciler(charges)
+    match = reconciler.match(Payment(2, date.today(), 3500, "Lovelace Ada", ""))
+    assert match.reason == "combined"
+    assert match.charge_ids == [1, 2]
+    # Only the 4000 charge is left, so a payment of 3500 can't be placed
+    match = reconciler.match(Payment(3, date.today(), 3500, "Lovelace Ada", ""))
+    assert match.reason is None
+
+
+def test_uploading_a_statement_again_applies_nothing(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    for name in ("Charge A", "Charge B"):
+        session.add(
+            BillingCharge(
+                name=name,
+                base_amount=7777,
+                paid=False,
+                charge_date=date.today() - timedelta(days=3),
+                due_date=date.today() + timedelta(days=10),
+                user_id=1,
+                u_community_id=1,
+                community_id=1,
+            )
+        )
+    session.commit()
+    statement = f"Date,Description,Amount\n{date.today()},Rudd Thom,77.77\n"
+
+    def upload():
+        return client.post(
+            "/admin/manage-billing/reconcile",
+            data={"statement": (BytesIO(statement.encode()), "statement.csv")},
+        )
+
+    assert b"1 payment matched" in upload().data
+    response = upload()
+    assert b"0 payments matched" in response.data
+    assert b"Already reconciled from an earlier upload" in response.data
+    paid = session.query(BillingCharge).filter_by(base_amount=7777, paid=True)
+    assert paid.count() == 1
+
+
+def test_payment_settled_by_hand_is_not_matched_again(client, session):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    charges = {}
+    for name, amount in (("Charge A", 5000), ("Charge B", 7777)):
+        charges[name] = BillingCharge(
+            name=name,
+            base_amount=amount,
+            paid=False,
+            charge_date=date.today() - timedelta(days=3),
+            due_date=date.today() + timedelta(days=10),
+            user_id=1,
+            u_community_id=1,
+            community_id=1,
+        )
+        session.add(charges[name])
+    session.commit()
+    charge_a, charge_b = charges["Charge A"].id, charges["Charge B"].id
+    reference = f"NIDO-{charge_a}"
+    statement = f"Date,Description,Reference,Amount\n{date.today()},Rudd Thom,{reference},77.77\n"
+
+    def upload():
+        return client.post(
+            "/admin/manage-billing/reconcile",
+            data={"statement": (BytesIO(statement.encode()), "statement.csv")},
+        )
+
+    def paid(charge_id):
+        session.expire_all()
+        return session.get(BillingCharge, charge_id).paid
+
+    assert b"1 needs review" in upload().data
+    client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "mark_paid", "charge_ids": charge_a},
+    )
+    # Not ticked as settled, so it comes back for review but pays nothing
+    response = upload()
+    assert b"0 payments matched" in response.data
+    assert b"1 needs review" in response.data
+    assert paid(charge_a) and not paid(charge_b)
+
+    settled = fingerprint(
+        (date.today(), 7777, payer_key("Rudd Thom"), reference.lower(), 1)
+    )
+    client.post(
+        "/admin/manage-billing/bulk",
+        data={"action": "mark_paid", "charge_ids": charge_a, "payments": settled},
+    )
+    response = upload()
+    assert b"0 need review" in response.data
+    assert b"Already reconciled from an earlier upload" in response.data
+    assert not paid(charge_b)
@@ -0,0 +1,155 @@
+import pytest
+from sqlalchemy import select
+
+from nido import create_app
+from nido.models import Community, User, UserSession, Residence
+from nido.sharding import community_move
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "VERY_SECRET",
+            "DATABASE_URL": f"sqlite:///{tmp_path / 'directory.db'}",
+            "DATABASE_SHARDS": {
+                "a": f"sqlite:///{tmp_path / 'a.db'}",
+                "b": f"sqlite:///{tmp_path / 'b.db'}",
+            },
+            "CACHE_TYPE": "null",
+            "ISSUE_WORKERS": 0,
+            "PREVIEW_WORKERS": 0,
+        }
+    )
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=["shards", "init"]).exit_code == 0
+    assert runner.invoke(args=["shards", "assign", "1", "a"]).exit_code == 0
+    with app.app_context():
+        db = app.Session()
+        db.info["community_id"] = 1
+        community = Community(id=1, name="Sharded", country="US")
+        community.members.append(
+            User(personal_name="Sam", family_name="Shard", email="sam@shard.org")
+        )
+        community.residences.append(
+            Residence(street="1 Shard Way", locality="A", postcode="1", region="B")
+        )
+        db.add(community)
+        db.commit()
+    assert runner.invoke(args=["shards", "rebuild-directory"]).exit_code == 0
+    return app
+
+
+def test_login_finds_users_shard(sharded_app):
+    client = sharded_app.test_client()
+    client.post("/login", data={"ident": "sam@shard.org"})
+    with client.session_transaction() as user_session:
+        assert user_session["community_id"] == 1
+    with sharded_app.shards["a"].connect() as conn:
+        assert conn.execute(select(UserSession.user_id)).scalar() == 1
+
+
+def test_move_community_between_shards(sharded_app):
+    result = sharded_app.test_cli_runner().invoke(
+        args=["shards", "move-community", "1", "b", "--settle", "0"]
+    )
+    assert result.exit_code == 0, result.output
+
+    # The source is only emptied by a separate, later command
+    with sharded_app.shards["a"].connect() as conn:
+        assert conn.execute(select(User.id)).all() == [(1,)]
+    result = sharded_app.test_cli_runner().invoke(
+        args=["shards", "delete-moved", "1", "b"]
+    )
+    assert result.exit_code != 0
+    result = sharded_app.test_cli_runner().invoke(
+        args=["shards", "delete-moved", "1", "a"]
+    )
+    assert result.exit_code == 0, result.output
+    with sharded_app.shards["a"].connect() as conn:
+        assert conn.execute(select(User.id)).all() == []
+    with sharded_app.shards["b"].connect() as conn:
+        assert conn.execute(select(User.email)).scalar() == "sam@shard.org"
+        assert conn.execute(select(Residence.street)).scalar() == "1 Shard Way"
+
+    client = sharded_app.test_client()
+    client.post("/login", data={"ident": "sam@shard.org"})
+    with sharded_app.shards["b"].connect() as conn:
+        assert conn.execute(select(UserSession.user_id)).scalar() == 1
+
+
+def test_moving_community_refuses_writes(sharded_app):
+    with sharded_app.directory_engine.begin() as conn:
+        conn.execute(community_move.insert(), {"community_id": 1, "target": "b"})
+    client = sharded_app.test_client()
+    response = client.post("/login", data={"ident": "sam@shard.org"})
+    assert response.status_code == 503
+    with sharded_app.shards["a"].connect() as conn:
+        assert conn.execute(select(UserSession.id)).all() == []
+
+    result = sharded_app.test_cli_runner().invoke(
+        args=["shards", "move-community", "1", "b", "--settle", "0"]
+    )
+    assert result.exit_code != 0
+    assert "already moving" in result.output
+
+
+def test_late_fees_are_charged_on_each_shard(sharded_app):
+    from datetime import date, timedelta
+    from nido.models import BillingCharge, LateFeeMethod, LateFeePolicy
+
+    overdue = date.today() - timedelta(days=90)
+    with sharded_app.app_context():
+        db = sharded_app.Session()
+        db.info["community_id"] = 1
+        db.add(LateFeePolicy(community_id=1, method=LateFeeMethod.FLAT, amount=500))
+        db.add(
+            BillingCharge(
+                name="Dues",
+                base_amount=10000,
+                paid=False,
+                charge_date=overdue,
+                due_date=overdue,
+                user_id=1,
+                u_community_id=1,
+                community_id=1,
+            )
+        )
+        db.commit()
+    result = sharded_app.test_cli_runner().invoke(args=["late-fees", "apply"])
+    assert result.exit_code == 0, result.output
+    assert "Community 1: 1 late fees" in result.output
+    with sharded_app.shards["a"].connect() as conn:
+        fees = conn.execute(
+            select(BillingCharge.base_amount).where(BillingCharge.late_fee_of != None)
+        ).all()
+    assert fees == [(500,)]
+
+
+def test_reconciliation_migrate_updates_each_shard(sharded_app):
+    from sqlalchemy import inspect
+
+    with sharded_app.shards["b"].begin() as conn:
+        conn.exec_driver_sql("DROP TABLE reconciled_payment")
+    result = sharded_app.test_cli_runner().invoke(args=["reconciliation", "migrate"])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("Updated the reconciled_payment table") == 1
+    assert inspect(sharded_app.shards["b"]).has_table("reconciled_payment")
+    assert not inspect(sharded_app.directory_engine).has_table("reconciled_payment")
+
+
+def test_aging_commands_use_the_shards(sharded_app):
+    runner = sharded_app.test_cli_runner()
+    result = runner.invoke(args=["aging", "migrate"])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("already has the unpaid charges index") == 2
+    result = runner.invoke(args=["aging", "export", "1"])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("Owed By,Name,")
+
+
+def test_migrate_stakes_runs_on_each_shard(sharded_app):
+    result = sharded_app.test_cli_runner().invoke(args=["money", "migrate-stakes"])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("already stored as integers") == 2
@@ -0,0 +1,57 @@
+import pytest
+
+from nido.projections import grouped_listing_views
+
+
+@pytest.fixture
+def streaming(app, monkeypatch):
+    monkeypatch.setitem(app.config, "STREAM_LISTINGS", True)
+
+
+def test_grouped_listing_views_groups_consecutive_rows():
+    rows = [
+        (1, "Main St", "Unit 1", 1, "Ann", "Lee", None, None),
+        (1, "Main St", "Unit 1", 1, "Bo", "Lee", None, None),
+        (2, "Main St", "Unit 2", None, None, None, None, None),
+    ]
+    listings = list(grouped_listing_views(rows))
+    assert [l.unit_no for l in listings] == ["Unit 1", "Unit 2"]
+    assert [r.personal_name for r in listings[0].occupants] == ["Ann", "Bo"]
+    assert listings[1].occupants == []
+
+
+def test_render_listing_streams_when_enabled(app, streaming):
+    from nido.streaming import render_listing
+
+    with app.test_request_context("/login"):
+        response = render_listing("login.html")
+        assert not isinstance(response.response, list)
+        assert b"</html>" in response.get_data()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/directory/",
+        "/billing/",
+        "/admin/manage-billing/edit-billing-records?lookup_id=u1",
+    ],
+)
+def test_listing_streams_same_page(client, streaming, app, url):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    streamed = client.get(url)
+    streamed_data = streamed.data
+    streamed.close()
+
+    app.config["STREAM_LISTINGS"] = False
+    assert client.get(url).data == streamed_data
+
+
+def test_streamed_directory_hides_vacant(client, streaming):
+    with client.session_transaction() as user_session:
+        user_session["user_session_id"] = 1
+    response = client.get("/directory/?hide_vacant=on")
+    assert b"Rudd Thom" in response.data
+    assert b'colspan="3">Vacant' not in response.data
+    response.close()